@@ -265,6 +265,117 @@ def migrate_number_fields(fix):
     if stats["issues_found"] and not fix:
         click.echo("Dry run only. Rerun with --fix to normalize the fixable values.")
 
+@udc.command("graph-rebuild")
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True, help="Number of compile processes.")
+@click.option("--chunk-size", default=100, show_default=True, help="Packages per N-Triples chunk.")
+@click.option("--checkpoint", default=None, help="Checkpoint file (default: <ckan.storage_path>/udc_graph_rebuild.json).")
+@click.option("--resume", is_flag=True, default=False, help="Continue an interrupted rebuild from its checkpoint.")
+@click.option("--no-backup", is_flag=True, default=False, help="Do not keep the previous graph in urn:udc:graph-rebuild:previous.")
+@click.pass_context
+def graph_rebuild(ctx, workers, chunk_size, checkpoint, resume, no_backup):
+    """
+    Regenerate the catalogue knowledge graph from the CKAN database.
+    """
+    import ckan.plugins.toolkit as tk
+    from ..graph.sparql_client import SparqlClient, sparql_client_options
+    from ..graph.rebuild import rebuild_graph
+
+    # The plugin does not connect to GraphDB when loaded by the CLI
+    endpoint = tk.config.get("udc.sparql.endpoint")
+    if not endpoint:
+        click.echo("No GraphDB Endpoint is provided.")
+        return
+    client = SparqlClient(
+        endpoint,
+        username=tk.config.get("udc.sparql.username") or None,
+        password=tk.config.get("udc.sparql.password") or None,
+        **sparql_client_options(tk.config),
+    )
+
+    if checkpoint is None:
+        storage_path = tk.config.get("ckan.storage_path") or "./"
+        checkpoint = os.path.join(storage_path, "udc_graph_rebuild.json")
+
+    with ctx.meta["flask_app"].test_request_context():
+        stats = rebuild_graph(
+            client,
+            checkpoint,
+            workers=workers,
+            chunk_size=chunk_size,
+            resume=resume,
+            backup=not no_backup,
+            echo=click.echo,
+        )
+
+    click.echo(
+        "Summary: "
+        f'packages={stats["packages"]} '
+        f'triples={stats["triples"]} '
+        f'failed={stats["failed"]} '
+        f'requeued={stats["requeued"]} '
+        f'seconds={stats["seconds"]} '
+        f'packages_per_second={stats["packages_per_second"]}'
+    )
+
+
+@udc.command()
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True, help="Number of document build processes.")
+@click.option("--shard-size", default=100, show_default=True, help="Packages per worker task.")
+@click.option("--batch-size", default=1000, show_default=True, help="Documents per Solr add request.")
+@click.option("--since", default=None, type=click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"]),
+              help="Only reindex packages modified at or after this time (UTC).")
+@click.pass_context
+def reindex(ctx, workers, shard_size, batch_size, since):
+    """
+    Rebuild the Solr index of the packages in parallel, committing once.
+    """
+    from ..solr.reindex import reindex as reindex_packages
+
+    with ctx.meta["flask_app"].test_request_context():
+        stats = reindex_packages(
+            workers=workers,
+            shard_size=shard_size,
+            batch_size=batch_size,
+            since=since,
+            echo=click.echo,
+        )
+
+    if stats["failed"]:
+        click.echo("Failed package ids:")
+        for package_id in stats["failed"]:
+            click.echo(f"  {package_id}")
+    click.echo(
+        "Summary: "
+        f'packages={stats["packages"]} '
+        f'documents={stats["documents"]} '
+        f'deleted={stats["deleted"]} '
+        f'failed={len(stats["failed"])} '
+        f'seconds={stats["seconds"]} '
+        f'packages_per_second={stats["packages_per_second"]}'
+    )
+
+
+@udc.command("facet-store-rebuild")
+@click.pass_context
+def facet_store_rebuild(ctx):
+    """
+    Recompute the facet counts served by filter_facets_get.
+    """
+    from ..search.facet_store import rebuild_facet_store
+
+    with ctx.meta["flask_app"].test_request_context():
+        stats = rebuild_facet_store(echo=click.echo)
+
+    click.echo(
+        "Summary: "
+        f'packages={stats["packages"]} '
+        f'fields={len(stats["fields"])} '
+        f'values={stats["values"]} '
+        f'failed={stats["failed"]} '
+        f'seconds={stats["seconds"]}'
+    )
+
+
 @udc.command()
 def initdb():
     """
@@ -279,6 +390,10 @@ def initdb():
     
     from ..licenses.model import init_tables
     init_tables()
+    from ..graph.model import init_tables as init_graph_tables
+    init_graph_tables()
+    from ..search.model import init_tables as init_search_tables
+    init_search_tables()
     
     libs = [
         "ckanext.udc_import_other_portals.model",
@@ -0,0 +1,88 @@
+"""
+In-memory cache of serialized catalogue graphs (the /catalogue/<id>/graph endpoint).
+
+Entries are keyed by (package id, metadata_modified, format), evicted in LRU
+order once the total size exceeds `udc.graph.export_cache_max_bytes` and
+expire after `udc.graph.export_cache_ttl` seconds, since a shared instance
+(e.g. a publisher) can change without the package being modified.
+Each CKAN process has its own cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import ckan.plugins.toolkit as tk
+
+
+class LRUSizeCache:
+    """Thread-safe LRU cache with a cap on the total size of the values and a TTL."""
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value, size: int):
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable):
+        _value, size, _expires_at = self._entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_cache = {}
+
+
+def get_graph_export_cache() -> LRUSizeCache:
+    cache = _cache.get("graph")
+    if cache is None:
+        cache = _cache["graph"] = LRUSizeCache(
+            int(tk.config.get("udc.graph.export_cache_max_bytes", 32 * 1024 * 1024)),
+            ttl=float(tk.config.get("udc.graph.export_cache_ttl", 3600)),
+        )
+    return cache
+
+
+def clear_graph_export_cache():
+    cache = _cache.get("graph")
+    if cache is not None:
+        cache.clear()
@@ -0,0 +1,53 @@
+from sqlalchemy import Column
+from sqlalchemy import types
+from sqlalchemy.ext.declarative import declarative_base
+
+import ckan.model as model
+import datetime
+
+log = __import__('logging').getLogger(__name__)
+
+Base = declarative_base()
+
+
+class GraphSyncOutbox(Base):
+    """
+    A pending knowledge graph sync for one package.
+
+    There is at most one row per package: enqueueing a package that is already
+    pending only bumps `version`, so repeated saves are applied once.
+    """
+    __tablename__ = 'udc_graph_sync_outbox'
+
+    package_id = Column(types.UnicodeText, primary_key=True)
+    # "update" or "delete"
+    operation = Column(types.UnicodeText, nullable=False)
+    # Incremented on every enqueue; a sync only removes the row it has applied
+    version = Column(types.Integer, nullable=False, default=1)
+    attempts = Column(types.Integer, nullable=False, default=0)
+    last_error = Column(types.UnicodeText)
+    # First time the package became pending (used for the sync lag)
+    enqueued_at = Column(types.DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(types.DateTime, default=datetime.datetime.utcnow)
+    # Not picked up by the worker before this time (retry backoff / claim lease)
+    next_attempt_at = Column(types.DateTime, default=datetime.datetime.utcnow, index=True)
+
+    @classmethod
+    def get(cls, package_id):
+        return model.Session.query(cls).filter(cls.package_id == package_id).first()
+
+    def as_dict(self):
+        return {
+            'package_id': self.package_id,
+            'operation': self.operation,
+            'version': self.version,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'enqueued_at': self.enqueued_at.isoformat() if self.enqueued_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+        }
+
+
+def init_tables():
+    Base.metadata.create_all(model.meta.engine)
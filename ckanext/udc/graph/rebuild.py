@@ -0,0 +1,253 @@
+"""
+Rebuild the catalogue knowledge graph from the CKAN database (`ckan udc graph-rebuild`).
+
+Package ids are read from Postgres in keyset pages, a process pool turns each
+page into N-Triples (package_show -> prepare_data_dict -> compiled mapping
+template), and the chunks are inserted into a staging named graph. When every
+package is in, one update request moves the staging graph over the default
+graph, so readers never see a half-built graph.
+
+A checkpoint file records the last package id written to the staging graph,
+so an interrupted rebuild continues where it stopped with `--resume`. It also
+records the swap, so a resume after it only requeues the changed packages. An
+empty staging graph is never swapped in.
+"""
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from rdflib import Graph
+
+import ckan.logic as logic
+import ckan.model as model
+import ckan.plugins as plugins
+
+from .logic import get_mappings
+from .template import CompiledTemplate
+from .mapping_helpers import all_helpers
+from .ckan_field import prepare_data_dict
+
+log = logging.getLogger(__name__)
+
+STAGING_GRAPH = "urn:udc:graph-rebuild:staging"
+# The default graph before the last swap, kept for a manual rollback
+BACKUP_GRAPH = "urn:udc:graph-rebuild:previous"
+PACKAGE_TYPES = ["catalogue", "dataset"]
+
+
+def _package_query():
+    return (
+        model.Session.query(model.Package.id)
+        .filter(model.Package.state == "active")
+        .filter(model.Package.type.in_(PACKAGE_TYPES))
+    )
+
+
+def count_packages(after_id: Optional[str] = None) -> int:
+    query = _package_query()
+    if after_id:
+        query = query.filter(model.Package.id > after_id)
+    return query.count()
+
+
+def iter_package_id_chunks(chunk_size: int, after_id: Optional[str] = None) -> Iterator[List[str]]:
+    """Yield the ids of the active packages in id order, `chunk_size` at a time."""
+    while True:
+        query = _package_query()
+        if after_id:
+            query = query.filter(model.Package.id > after_id)
+        ids = [row[0] for row in query.order_by(model.Package.id).limit(chunk_size)]
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+def compile_packages_to_ntriples(template: CompiledTemplate, packages: List[dict]) -> Tuple[str, int, list]:
+    """Return (N-Triples, number of triples, [(package id, error)]) for a list of package dicts."""
+    chunks = []
+    triples = 0
+    failed = []
+    for pkg_dict in packages:
+        try:
+            # Remove empty fields, as onUpdateCatalogue does
+            pkg_dict = {k: v for k, v in pkg_dict.items() if v != ''}
+            compiled = template.render(all_helpers, prepare_data_dict(pkg_dict))
+            g = Graph()
+            g.parse(data=compiled, format='json-ld')
+            chunks.append(g.serialize(format='nt'))
+            triples += len(g)
+        except Exception as e:
+            failed.append((pkg_dict.get("id"), str(e)))
+    return "".join(chunks), triples, failed
+
+
+def build_insert_query(graph: str, ntriples: str) -> str:
+    return f"INSERT DATA {{ GRAPH <{graph}> {{\n{ntriples}\n}} }}"
+
+
+def build_swap_query(staging: str, backup: Optional[str] = None) -> str:
+    """Replace the default graph with `staging` in a single (atomic) update request."""
+    operations = []
+    if backup:
+        operations.append(f"COPY SILENT DEFAULT TO GRAPH <{backup}>")
+    operations.append(f"MOVE GRAPH <{staging}> TO DEFAULT")
+    return " ;\n".join(operations)
+
+
+def load_checkpoint(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+    os.replace(tmp_path, path)
+
+
+# State of a pool worker, set by _init_worker()
+_worker = {}
+
+
+def _init_worker(mappings, text_fields, user: str):
+    # Do not share the database connections inherited from the parent process
+    model.Session.remove()
+    model.meta.engine.dispose(close=False)
+    _worker["template"] = CompiledTemplate(mappings, text_fields)
+    _worker["user"] = user
+
+
+def _compile_chunk(ids: List[str]):
+    package_show = logic.get_action("package_show")
+    packages = []
+    failed = []
+    for package_id in ids:
+        try:
+            context = {"model": model, "session": model.Session, "user": _worker["user"],
+                       "ignore_auth": True, "use_cache": False}
+            packages.append(package_show(context, {"id": package_id}))
+        except Exception as e:
+            failed.append((package_id, str(e)))
+    ntriples, triples, compile_failed = compile_packages_to_ntriples(_worker["template"], packages)
+    model.Session.remove()
+    return ids[-1], len(ids), ntriples, triples, failed + compile_failed
+
+
+def requeue_changed_packages(since: str, package_ids: List[str]) -> int:
+    """
+    Queue a graph sync for the packages saved while the rebuild was running
+    (their changes went to the old default graph) and for the ones that failed.
+    """
+    from .sync import enqueue_graph_sync
+
+    rows = (
+        model.Session.query(model.Package.id, model.Package.state)
+        .filter(model.Package.metadata_modified >= datetime.datetime.fromisoformat(since))
+        .all()
+    )
+    operations = {package_id: "update" for package_id in package_ids}
+    for package_id, state in rows:
+        operations[package_id] = "delete" if state == "deleted" else "update"
+    for package_id, operation in operations.items():
+        enqueue_graph_sync({}, package_id, operation)
+    return len(operations)
+
+
+def staging_has_triples(client) -> bool:
+    result = client.execute_sparql(f"ASK {{ GRAPH <{STAGING_GRAPH}> {{ ?s ?p ?o }} }}", method="select")
+    return bool(result.get("boolean"))
+
+
+def _load_staging(client, state: dict, checkpoint_path: str, workers: int, chunk_size: int,
+                  echo: Callable[[str], None]) -> int:
+    """Compile the packages after state["last_id"] into the staging graph; returns how many."""
+    remaining = count_packages(state["last_id"])
+    echo(f"Compiling {remaining} packages with {workers} workers.")
+
+    udc_plugin = plugins.get_plugin("udc")
+    site_user = logic.get_action("get_site_user")({"ignore_auth": True}, {})
+    chunks = iter_package_id_chunks(chunk_size, state["last_id"])
+    # fork: the workers inherit the loaded CKAN app and config
+    pool = multiprocessing.get_context("fork").Pool(
+        workers, initializer=_init_worker,
+        initargs=(get_mappings(), list(udc_plugin.text_fields), site_user["name"]),
+    )
+    start = time.monotonic()
+    done = 0
+    try:
+        for last_id, count, ntriples, triples, failed in pool.imap(_compile_chunk, chunks):
+            if ntriples:
+                client.execute_sparql(build_insert_query(STAGING_GRAPH, ntriples), method="update")
+            state["last_id"] = last_id
+            state["packages"] += count
+            state["triples"] += triples
+            state["failed"].extend(package_id for package_id, _error in failed)
+            save_checkpoint(checkpoint_path, state)
+            for package_id, error in failed:
+                log.error(f"Cannot compile package {package_id}: {error}")
+
+            done += count
+            rate = done / max(time.monotonic() - start, 1e-6)
+            echo(f"{done}/{remaining} packages, {rate:.1f} packages/sec, "
+                 f"{state['triples']} triples, {len(state['failed'])} failed")
+    finally:
+        pool.terminate()
+        pool.join()
+    return done
+
+
+def rebuild_graph(client, checkpoint_path: str, workers: int = 4, chunk_size: int = 100,
+                  resume: bool = False, backup: bool = True,
+                  echo: Callable[[str], None] = log.info) -> dict:
+    """Rebuild the catalogue graph; see the module docstring."""
+    state = load_checkpoint(checkpoint_path) if resume else None
+    if state is None:
+        client.execute_sparql(f"DROP SILENT GRAPH <{STAGING_GRAPH}>", method="update")
+        state = {
+            "started_at": datetime.datetime.utcnow().isoformat(),
+            "last_id": None,
+            "packages": 0,
+            "triples": 0,
+            "failed": [],
+            "swapped": False,
+        }
+        save_checkpoint(checkpoint_path, state)
+    elif state.get("swapped"):
+        echo("The staging graph was already swapped in, requeueing the changed packages.")
+    else:
+        echo(f"Resuming after package {state['last_id']} ({state['packages']} packages done).")
+
+    start = time.monotonic()
+    done = 0
+    if not state.get("swapped"):
+        done = _load_staging(client, state, checkpoint_path, workers, chunk_size, echo)
+
+        # An empty staging graph would replace the catalogue graph with nothing
+        if not staging_has_triples(client):
+            raise RuntimeError(f"The staging graph <{STAGING_GRAPH}> has no triples, not swapping it in.")
+        echo("Swapping the staging graph into the default graph.")
+        client.execute_sparql(build_swap_query(STAGING_GRAPH, BACKUP_GRAPH if backup else None), method="update")
+        # The staging graph is gone now: a resume must not swap again
+        state["swapped"] = True
+        save_checkpoint(checkpoint_path, state)
+
+    requeued = requeue_changed_packages(state["started_at"], state["failed"])
+    os.remove(checkpoint_path)
+
+    elapsed = time.monotonic() - start
+    return {
+        "packages": state["packages"],
+        "triples": state["triples"],
+        "failed": len(state["failed"]),
+        "requeued": requeued,
+        "seconds": round(elapsed, 1),
+        "packages_per_second": round(done / max(elapsed, 1e-6), 1),
+    }
@@ -1,4 +1,6 @@
 import re
+import threading
+import time
 import requests
 import urllib
 
@@ -70,10 +72,13 @@ class SPARQLWrapper:
         query_string = query_string.strip()
         return bool(re.match(r'^(construct|describe)', query_string, re.IGNORECASE))
 
-    def __init__(self, endpoint, retry_attempts = 3, is_update=False, is_graph_query=False):
+    def __init__(self, endpoint, retry_attempts = 3, is_update=False, is_graph_query=False,
+                 session=None, timeout=None):
         """
         retry_attempts: number of retry attempts after timeouts
         is_graph_query: True if query is CONSTRUCT/DESCRIBE (returns RDF graph)
+        session: a shared requests.Session (see SparqlClient), created lazily if None
+        timeout: requests timeout, a number or a (connect, read) tuple
         """
         self.endpoint = endpoint
         self.is_update = is_update
@@ -81,9 +86,11 @@ class SPARQLWrapper:
         self.username = None
         self.password = None
         self.method = 'POST'
-        self.session = None
+        self.session = session
+        self.timeout = timeout
         self._query = None
         self.retry_attempts = retry_attempts
+        self._session_lock = threading.Lock()
 
     def set_method(self, method):
         self.method = method
@@ -95,70 +102,176 @@ class SPARQLWrapper:
         self.username = username
         self.password = password
 
-    def query(self, infer=True):
-        # Init session
+    def _get_session(self):
         if self.session is None:
-            self.session = requests.Session()
-            # Automatic retries
-            retries = Retry(total=self.retry_attempts,
-                backoff_factor=0.1,
-                status_forcelist=[ 500, 502, 503, 504 ])
-            self.session.mount(self.endpoint, HTTPAdapter(max_retries=retries))
-            
-            if self.username:
-                self.session.auth = (self.username, self.password)
+            with self._session_lock:
+                if self.session is None:
+                    session = requests.Session()
+                    # Automatic retries
+                    retries = Retry(total=self.retry_attempts,
+                        backoff_factor=0.1,
+                        status_forcelist=[ 500, 502, 503, 504 ])
+                    session.mount(self.endpoint, HTTPAdapter(max_retries=retries))
+                    self.session = session
+        return self.session
+
+    def query(self, infer=True):
+        return self.request(self._query, method=self.method, infer=infer)
+
+    def request(self, query, method=POST, infer=True):
+        """Send `query`. Nothing is stored on the wrapper, so it can be shared by threads."""
+        session = self._get_session()
+        auth = (self.username, self.password) if self.username else None
 
-        if self.method == POST:
+        if method == POST:
             if self.is_update:
-                response = self.session.request(self.method, self.endpoint,
-                                                data=f'update={urllib.parse.quote(self._query)}',
-                                                headers={
-                                                    'Accept': 'text/plain',
-                                                    'Content-Type': 'application/x-www-form-urlencoded'
-                                                })
+                response = session.request(method, self.endpoint,
+                                           data=f'update={urllib.parse.quote(query)}',
+                                           headers={
+                                               'Accept': 'text/plain',
+                                               'Content-Type': 'application/x-www-form-urlencoded'
+                                           }, auth=auth, timeout=self.timeout)
             elif self.is_graph_query:
                 # CONSTRUCT/DESCRIBE queries return RDF graphs, not JSON results
-                response = self.session.request(self.method, self.endpoint,
-                                                data=f'query={urllib.parse.quote(self._query)}&infer={"true" if infer else "false"}',
-                                                headers={
-                                                    'Accept': 'text/turtle, application/rdf+xml, application/n-triples',
-                                                    'Content-Type': 'application/x-www-form-urlencoded'
-                                                })
+                response = session.request(method, self.endpoint,
+                                           data=f'query={urllib.parse.quote(query)}&infer={"true" if infer else "false"}',
+                                           headers={
+                                               'Accept': 'text/turtle, application/rdf+xml, application/n-triples',
+                                               'Content-Type': 'application/x-www-form-urlencoded'
+                                           }, auth=auth, timeout=self.timeout)
             else:
-                response = self.session.request(self.method, self.endpoint,
-                                                data=f'query={urllib.parse.quote(self._query)}&infer={"true" if infer else "false"}',
-                                                headers={
-                                                    'Accept': 'application/x-sparqlstar-results+json, application/sparql-results+json',
-                                                    'Content-Type': 'application/x-www-form-urlencoded'
-                                                })
-        elif self.method == GET:
+                response = session.request(method, self.endpoint,
+                                           data=f'query={urllib.parse.quote(query)}&infer={"true" if infer else "false"}',
+                                           headers={
+                                               'Accept': 'application/x-sparqlstar-results+json, application/sparql-results+json',
+                                               'Content-Type': 'application/x-www-form-urlencoded'
+                                           }, auth=auth, timeout=self.timeout)
+        elif method == GET:
             if self.is_update:
                 raise ValueError('update operations MUST be done by POST')
             
             if self.is_graph_query:
-                response = self.session.request(self.method, self.endpoint,
-                                                params={'query': urllib.parse.quote(self._query), 'infer': "true" if infer else "false"},
-                                                headers={
-                                                    'Accept': 'text/turtle, application/rdf+xml, application/n-triples'
-                                                })
+                response = session.request(method, self.endpoint,
+                                           params={'query': urllib.parse.quote(query), 'infer': "true" if infer else "false"},
+                                           headers={
+                                               'Accept': 'text/turtle, application/rdf+xml, application/n-triples'
+                                           }, auth=auth, timeout=self.timeout)
             else:
-                response = self.session.request(self.method, self.endpoint,
-                                                params={'query': urllib.parse.quote(self._query), 'infer': "true" if infer else "false"},
-                                                headers={
-                                                    'Accept': 'application/x-sparqlstar-results+json,application/sparql-results+json'
-                                                })
+                response = session.request(method, self.endpoint,
+                                           params={'query': urllib.parse.quote(query), 'infer': "true" if infer else "false"},
+                                           headers={
+                                               'Accept': 'application/x-sparqlstar-results+json,application/sparql-results+json'
+                                           }, auth=auth, timeout=self.timeout)
         else:
-            raise ValueError('Illegal method:', self.method)
+            raise ValueError('Illegal method:', method)
 
         return SPARQLResponse(response, is_update=self.is_update, is_graph_query=self.is_graph_query)
 
 
+class SparqlMetrics:
+    """
+    Latency histograms of the SPARQL requests, per query type (select/update/construct).
+    Kept in memory, so each CKAN process has its own.
+    """
+    # Upper bounds of the histogram buckets, in milliseconds
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.reset()
+
+    def reset(self):
+        """Clear the cumulative counters; requests still running keep being counted in in_flight."""
+        with self._lock:
+            self._stats = {}
+            self.max_in_flight = self.in_flight
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finished(self, query_type: str, seconds: float, error: bool = False):
+        ms = seconds * 1000
+        with self._lock:
+            self.in_flight -= 1
+            stats = self._stats.get(query_type)
+            if stats is None:
+                stats = self._stats[query_type] = {
+                    "count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "buckets": [0] * (len(self.BUCKETS_MS) + 1),
+                }
+            stats["count"] += 1
+            stats["errors"] += 1 if error else 0
+            stats["total_ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+            for idx, bound in enumerate(self.BUCKETS_MS):
+                if ms <= bound:
+                    stats["buckets"][idx] += 1
+                    break
+            else:
+                stats["buckets"][-1] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            query_types = {}
+            for query_type, stats in self._stats.items():
+                labels = [f"<={bound}ms" for bound in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+                query_types[query_type] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0,
+                    "max_ms": round(stats["max_ms"], 2),
+                    "histogram": dict(zip(labels, stats["buckets"])),
+                }
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "query_types": query_types,
+            }
+
+
+def sparql_client_options(config) -> dict:
+    """Read the pool / timeout settings of SparqlClient from the CKAN config."""
+    return {
+        "pool_size": int(config.get("udc.sparql.pool_size", 10)),
+        "max_concurrent_queries": int(config.get("udc.sparql.max_concurrent_queries", 8)),
+        "connect_timeout": float(config.get("udc.sparql.connect_timeout", 5)),
+        "read_timeout": float(config.get("udc.sparql.read_timeout", 120)),
+    }
+
+
 class SparqlClient:
+    """
+    Thread-safe SPARQL client.
+
+    All requests go through one keep-alive `requests.Session` with a bounded
+    connection pool; at most `max_concurrent_queries` requests are in flight at
+    a time and every request is timed into `metrics`.
+    """
+
+    def __init__(self, endpoint, username=None, password=None, pool_size=10,
+                 max_concurrent_queries=8, connect_timeout=5, read_timeout=120):
+        self.session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+                              max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        timeout = (connect_timeout, read_timeout)
+        # Wait at most one request timeout for a free slot
+        self.acquire_timeout = connect_timeout + read_timeout
+        self.semaphore = threading.BoundedSemaphore(max_concurrent_queries)
+        self.metrics = SparqlMetrics()
 
-    def __init__(self, endpoint, username=None, password=None):
-        self.query_client = SPARQLWrapper(endpoint, is_update=False, is_graph_query=False)
-        self.update_client = SPARQLWrapper(endpoint + '/statements', is_update=True, is_graph_query=False)
-        self.graph_client = SPARQLWrapper(endpoint, is_update=False, is_graph_query=True)
+        self.query_client = SPARQLWrapper(endpoint, is_update=False, is_graph_query=False,
+                                          session=self.session, timeout=timeout)
+        self.update_client = SPARQLWrapper(endpoint + '/statements', is_update=True, is_graph_query=False,
+                                           session=self.session, timeout=timeout)
+        self.graph_client = SPARQLWrapper(endpoint, is_update=False, is_graph_query=True,
+                                          session=self.session, timeout=timeout)
         if username:
             self.query_client.set_credentials(username, password)
             self.update_client.set_credentials(username, password)
@@ -174,16 +287,19 @@ class SparqlClient:
         
         # Check which client to use
         if method == 'construct' or (method is None and SPARQLWrapper.is_graph_query(query_string)):
-            client = self.graph_client
+            client, query_type = self.graph_client, 'construct'
         elif method == 'select' or not SPARQLWrapper.is_update_request(query_string):
-            client = self.query_client
+            client, query_type = self.query_client, 'select'
         else:
-            client = self.update_client
+            client, query_type = self.update_client, 'update'
 
-        client.set_method(POST)
-        client.set_query(query_string)
+        if not self.semaphore.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError('Too many SPARQL queries in flight')
+        self.metrics.started()
+        start = time.perf_counter()
+        error = False
         try:
-            response = client.query(infer=infer)
+            response = client.request(query_string, method=POST, infer=infer)
             
             # For graph queries (CONSTRUCT/DESCRIBE), return text (Turtle format)
             if client == self.graph_client:
@@ -192,16 +308,19 @@ class SparqlClient:
                 return response.json()
 
         except:
+            error = True
             print('error with the below sparql query using ' + (
                 'update client' if client == self.update_client else 
                 'graph client' if client == self.graph_client else 'normal client'))
             print(query_string.strip())
             raise
+        finally:
+            self.metrics.finished(query_type, time.perf_counter() - start, error=error)
+            self.semaphore.release()
     
     def test_connecetion(self):
-        self.query_client.set_query("SELECT * WHERE {?s ?p ?o.} LIMIT 1")
         try:
-            self.query_client.query().json()
+            self.execute_sparql("SELECT * WHERE {?s ?p ?o.} LIMIT 1", method='select')
         except Exception as e:
             print(e)
             return False
@@ -0,0 +1,355 @@
+"""
+Queued knowledge graph sync.
+
+`package_update` / `package_delete` only record the package in the
+`udc_graph_sync_outbox` table and make sure a background job is queued.
+The job (`process_graph_sync_outbox`) runs on the CKAN jobs queue, applies the
+pending packages to GraphDB in batches and retries failures with an
+exponential backoff, so saving a catalogue never waits on the triple store.
+
+Set `udc.sparql.sync_mode = sync` to keep the previous synchronous behaviour.
+"""
+import datetime
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy.dialects.postgresql import insert
+
+import ckan.authz as authz
+import ckan.lib.jobs as jobs
+import ckan.logic as logic
+import ckan.model as model
+import ckan.plugins as plugins
+import ckan.plugins.toolkit as tk
+from ckan.common import _
+from ckan.lib.redis import connect_to_redis
+from ckan.types import Context
+
+from .diff import remove_orphaned_instances
+from .logic import onUpdateCatalogue, onDeleteCatalogue
+from .model import GraphSyncOutbox
+from .queries import get_client
+
+log = logging.getLogger(__name__)
+
+# Set while a sync job is waiting in the queue, so saves do not flood it
+SCHEDULED_FLAG_KEY = "udc:graph_sync:scheduled"
+SCHEDULED_FLAG_TTL = 3600
+# Holds the due time of the delayed run that retries failed packages. A
+# separate flag, so a pending retry never keeps a save from queueing a run now.
+RETRY_FLAG_KEY = "udc:graph_sync:retry"
+# Session.info key: queue a sync run once the session commits the outbox rows
+SCHEDULE_ON_COMMIT = "udc_graph_sync_schedule"
+# How long a claimed batch is hidden from other workers
+CLAIM_LEASE = datetime.timedelta(minutes=10)
+
+
+def is_async_sync() -> bool:
+    return (tk.config.get("udc.sparql.sync_mode") or "async").lower() != "sync"
+
+
+def _batch_size() -> int:
+    return int(tk.config.get("udc.sparql.sync_batch_size", 50))
+
+
+def _retry_delay(attempts: int) -> datetime.timedelta:
+    """Exponential backoff: 10s, 20s, 40s, ... capped at `udc.sparql.sync_max_backoff` seconds."""
+    max_backoff = int(tk.config.get("udc.sparql.sync_max_backoff", 3600))
+    return datetime.timedelta(seconds=min(10 * 2 ** max(attempts - 1, 0), max_backoff))
+
+
+def enqueue_graph_sync(context: Context, package_id: str, operation: str) -> None:
+    """Record that `package_id` needs to be synced and make sure the worker runs."""
+    now = datetime.datetime.utcnow()
+    table = GraphSyncOutbox.__table__
+    stmt = insert(table).values(
+        package_id=package_id,
+        operation=operation,
+        version=1,
+        attempts=0,
+        enqueued_at=now,
+        updated_at=now,
+        next_attempt_at=now,
+    )
+    # Coalesce with a pending sync of the same package, keep the original enqueued_at
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.package_id],
+        set_={
+            "operation": stmt.excluded.operation,
+            "version": table.c.version + 1,
+            "attempts": 0,
+            "last_error": None,
+            "updated_at": now,
+            "next_attempt_at": now,
+        },
+    )
+    model.Session.execute(stmt)
+    if context.get("defer_commit"):
+        # A job started now might not see the row yet: queue it after the commit
+        model.Session.info[SCHEDULE_ON_COMMIT] = True
+        return
+    model.Session.commit()
+    schedule_graph_sync_job()
+
+
+@event.listens_for(model.Session, "after_commit")
+def _schedule_after_commit(session) -> None:
+    if session.info.pop(SCHEDULE_ON_COMMIT, False):
+        schedule_graph_sync_job()
+
+
+@event.listens_for(model.Session, "after_rollback")
+def _cancel_scheduling(session) -> None:
+    # The outbox rows are gone with the rollback
+    session.info.pop(SCHEDULE_ON_COMMIT, None)
+
+
+def schedule_graph_sync_job(delay: Optional[datetime.timedelta] = None) -> None:
+    """
+    Queue `process_graph_sync_outbox` unless a run is already waiting.
+    With `delay`, schedule the retry run instead, unless one is due sooner.
+    """
+    try:
+        redis = connect_to_redis()
+        if delay:
+            due = round(time.time() + delay.total_seconds())
+            current = redis.get(RETRY_FLAG_KEY)
+            if current is not None and int(current) <= due:
+                return
+            redis.set(RETRY_FLAG_KEY, due, ex=int(delay.total_seconds()) + SCHEDULED_FLAG_TTL)
+            _enqueue_retry(delay, due)
+            return
+        if not redis.set(SCHEDULED_FLAG_KEY, "1", nx=True, ex=SCHEDULED_FLAG_TTL):
+            return
+        jobs.enqueue(process_graph_sync_outbox, title="UDC knowledge graph sync")
+    except Exception as e:
+        # The outbox row is durable; the next save (or the status action) reschedules
+        log.error(f"Cannot queue the knowledge graph sync job: {e}")
+
+
+def _enqueue_retry(delay: datetime.timedelta, due: int) -> None:
+    from rq_scheduler import Scheduler
+    queue = jobs.get_queue()
+    Scheduler(queue=queue, connection=queue.connection).enqueue_in(
+        delay, process_graph_sync_outbox, retry_due=due
+    )
+
+
+def _claim_batch(limit: int) -> List[Tuple[str, str, int, int]]:
+    """Claim up to `limit` due rows and return (package_id, operation, version, attempts)."""
+    now = datetime.datetime.utcnow()
+    rows = (
+        model.Session.query(GraphSyncOutbox)
+        .filter(GraphSyncOutbox.next_attempt_at <= now)
+        .order_by(GraphSyncOutbox.enqueued_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    claimed = []
+    for row in rows:
+        row.next_attempt_at = now + CLAIM_LEASE
+        claimed.append((row.package_id, row.operation, row.version, row.attempts))
+    # Release the row locks before talking to GraphDB so saves never block on it
+    model.Session.commit()
+    return claimed
+
+
+def _finish(package_id: str, version: int) -> None:
+    # A newer version means the package was saved again while syncing: keep it pending
+    model.Session.query(GraphSyncOutbox).filter(
+        GraphSyncOutbox.package_id == package_id,
+        GraphSyncOutbox.version == version,
+    ).delete(synchronize_session=False)
+
+
+def _fail(package_id: str, version: int, attempts: int, error: Exception) -> None:
+    log.error(f"Knowledge graph sync failed for {package_id} (attempt {attempts + 1}): {error}")
+    model.Session.query(GraphSyncOutbox).filter(
+        GraphSyncOutbox.package_id == package_id,
+        GraphSyncOutbox.version == version,
+    ).update({
+        "attempts": attempts + 1,
+        "last_error": str(error)[:2000],
+        "next_attempt_at": datetime.datetime.utcnow() + _retry_delay(attempts + 1),
+    }, synchronize_session=False)
+
+
+def _prepare(context: Context, package_id: str, operation: str) -> dict:
+    """Compute the update for one package without sending it."""
+    if operation == "update":
+        package = model.Package.get(package_id)
+        if package is None or package.state == "deleted":
+            operation = "delete"
+    if operation == "delete":
+        return onDeleteCatalogue(context, {"id": package_id}, apply=False)
+    pkg_dict = logic.get_action("package_show")(
+        {**context, "use_cache": False}, {"id": package_id}
+    )
+    return onUpdateCatalogue(context, pkg_dict, apply=False)
+
+
+def _remove_released_instances(client, prepared: List[dict]) -> None:
+    """
+    Remove the shared instances the applied batch released. Each diff was
+    computed against the graph before the batch, so an instance shared only by
+    catalogues of the batch was kept by every one of them.
+    """
+    shared = {uri for stats in prepared for uri in stats.get("shared_instances", ())}
+    if not shared:
+        return
+    try:
+        remove_orphaned_instances(client, shared)
+    except Exception as e:
+        log.error(f"Cannot remove the instances released by the knowledge graph batch: {e}")
+
+
+def sync_batch(context: Context, claimed: List[Tuple[str, str, int, int]]) -> dict:
+    """Apply one claimed batch; the updates of all packages go out in one request."""
+    client = get_client()
+    prepared = []
+    failed = 0
+    for package_id, operation, version, attempts in claimed:
+        try:
+            prepared.append((package_id, version, attempts, _prepare(context, package_id, operation)))
+        except Exception as e:
+            _fail(package_id, version, attempts, e)
+            failed += 1
+
+    queries = [stats["update_query"] for *_, stats in prepared if stats.get("update_query")]
+    applied = prepared
+    if queries:
+        try:
+            client.execute_sparql(" ;\n".join(queries), method="update")
+        except Exception as e:
+            # Find the culprit(s): send the updates one by one
+            log.warning(f"Batched knowledge graph update failed, retrying one by one: {e}")
+            applied = []
+            for package_id, version, attempts, stats in prepared:
+                try:
+                    if stats.get("update_query"):
+                        client.execute_sparql(stats["update_query"], method="update")
+                    applied.append((package_id, version, attempts, stats))
+                except Exception as e:
+                    _fail(package_id, version, attempts, e)
+                    failed += 1
+
+    _remove_released_instances(client, [stats for *_, stats in applied])
+    for package_id, version, _attempts, _stats in applied:
+        _finish(package_id, version)
+    model.Session.commit()
+    return {"synced": len(applied), "failed": failed}
+
+
+def delete_catalogues(context: Context, package_ids: List[str]) -> dict:
+    """
+    Remove the catalogue entries of packages deleted in bulk with one update
+    request. Packages that cannot be removed now are queued in the outbox, so
+    the sync job retries them.
+    """
+    client = get_client()
+    prepared = []
+    retry = []
+    for package_id in package_ids:
+        try:
+            prepared.append(_prepare(context, package_id, "delete"))
+        except Exception as e:
+            log.error(f"Cannot prepare the knowledge graph delete of {package_id}: {e}")
+            retry.append(package_id)
+
+    queries = [stats["update_query"] for stats in prepared if stats.get("update_query")]
+    if queries:
+        try:
+            client.execute_sparql(" ;\n".join(queries), method="update")
+        except Exception as e:
+            log.warning(f"Batched knowledge graph delete of {len(package_ids)} packages failed, queued: {e}")
+            retry = list(package_ids)
+            prepared = []
+    _remove_released_instances(client, prepared)
+
+    for package_id in retry:
+        enqueue_graph_sync({**context, "defer_commit": True}, package_id, "delete")
+    if retry:
+        model.Session.commit()
+    return {"deleted": len(package_ids) - len(retry), "queued": len(retry)}
+
+
+def process_graph_sync_outbox(retry_due: Optional[int] = None) -> dict:
+    """
+    Background job: drain the due part of the outbox.
+    If rows are left waiting for a retry, another run is scheduled for then.
+
+    :param retry_due: set on the delayed retry runs, the due time they were scheduled for
+    """
+    try:
+        redis = connect_to_redis()
+        if retry_due is None:
+            redis.delete(SCHEDULED_FLAG_KEY)
+        elif redis.get(RETRY_FLAG_KEY) in (str(retry_due), str(retry_due).encode()):
+            # Unless a retry scheduled sooner replaced it, the flag is this run's
+            redis.delete(RETRY_FLAG_KEY)
+    except Exception:
+        pass
+
+    totals = {"synced": 0, "failed": 0}
+    if plugins.get_plugin("udc").disable_graphdb:
+        log.info("GraphDB is disabled, knowledge graph sync skipped.")
+        return totals
+
+    site_user = logic.get_action("get_site_user")({"ignore_auth": True}, {})
+    context: Context = {"model": model, "session": model.Session,
+                        "user": site_user["name"], "ignore_auth": True}
+    batch_size = _batch_size()
+    while True:
+        claimed = _claim_batch(batch_size)
+        if not claimed:
+            break
+        result = sync_batch(context, claimed)
+        totals["synced"] += result["synced"]
+        totals["failed"] += result["failed"]
+
+    next_retry = model.Session.query(func.min(GraphSyncOutbox.next_attempt_at)).scalar()
+    if next_retry is not None:
+        delay = max(next_retry - datetime.datetime.utcnow(), datetime.timedelta(seconds=1))
+        schedule_graph_sync_job(delay)
+
+    log.info(f"Knowledge graph sync finished: {totals}")
+    return totals
+
+
+@logic.side_effect_free
+def udc_graph_sync_status(context: Context, data_dict: dict) -> dict:
+    """
+    Report the knowledge graph sync backlog (sysadmin only).
+
+    Returns the number of pending packages, how many of them are failing, the
+    sync lag (age of the oldest pending save) and the most recent errors.
+    """
+    if not authz.is_sysadmin(context.get("user")):
+        raise logic.NotAuthorized(_("You are not authorized to view this page"))
+
+    query = model.Session.query(GraphSyncOutbox)
+    pending = query.count()
+    failing = query.filter(GraphSyncOutbox.attempts > 0).count()
+    oldest = query.order_by(GraphSyncOutbox.enqueued_at).first()
+    now = datetime.datetime.utcnow()
+    errors = (
+        query.filter(GraphSyncOutbox.attempts > 0)
+        .order_by(GraphSyncOutbox.updated_at.desc())
+        .limit(int(data_dict.get("limit", 10)))
+        .all()
+    )
+
+    if pending and tk.asbool(data_dict.get("reschedule", False)):
+        schedule_graph_sync_job()
+
+    return {
+        "mode": "async" if is_async_sync() else "sync",
+        "pending": pending,
+        "failing": failing,
+        "oldest_enqueued_at": oldest.enqueued_at.isoformat() if oldest else None,
+        "lag_seconds": (now - oldest.enqueued_at).total_seconds() if oldest else 0,
+        "errors": [row.as_dict() for row in errors],
+    }
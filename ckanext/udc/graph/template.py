@@ -101,6 +101,115 @@ def compile_template(template, global_vars, local_vars, nested=False):
         return result
 
 
+
+# Node kinds of a CompiledTemplate
+_STR = 'str'
+_DICT = 'dict'
+_NODE = 'node'
+_EVAL = 'eval'
+_LITERAL = 'literal'
+
+
+def _compile_expression(source: str):
+    """Compile a python expression once; a syntax error is kept and raised on evaluation, like eval() does."""
+    try:
+        return compile(source, '<mapping>', 'eval')
+    except Exception as e:
+        return e
+
+
+def _evaluate(code, global_vars, local_vars):
+    if isinstance(code, Exception):
+        raise code.with_traceback(None)
+    return eval(code, global_vars, local_vars)
+
+
+def _compile_list(template, text_fields):
+    items = template if isinstance(template, list) else [template]
+    compiled = []
+    for item in items:
+        if isinstance(item, str):
+            compiled.append((_STR, _compile_expression(f'f"{item}"')))
+        elif isinstance(item, dict):
+            entries = []
+            for attr, value in item.items():
+                if not isinstance(value, str):
+                    if not isinstance(value, (list, dict)):
+                        raise TypeError(f"Unsupported value in mapping template: {attr}={value!r}")
+                    entries.append((attr, _NODE, _compile_list(value, text_fields), None, False))
+                elif value.startswith('eval(') and value.endswith(')'):
+                    expression = value[5:-1].strip()
+                    if expression in text_fields:
+                        expression = f'map_to_multiple_languages({expression})'
+                    # Remove [{ "@value": '....' }] wrapping
+                    unwrap = len(items) == 1 and len(item) == 1 and attr == '@value'
+                    entries.append((attr, _EVAL, _compile_expression(expression), value, unwrap))
+                else:
+                    entries.append((attr, _LITERAL, _compile_expression(f'f"{value}"'), value, False))
+            compiled.append((_DICT, entries))
+        else:
+            raise TypeError(f"Unsupported item in mapping template: {item!r}")
+    return compiled
+
+
+def _render_list(compiled, global_vars, local_vars, nested):
+    result = []
+    for kind, payload in compiled:
+        if kind is _STR:
+            val = _evaluate(payload, global_vars, local_vars)
+            result.append(EMPTY_FIELD if val == '' or val is None else val)
+            continue
+
+        item = {}
+        for attr, attr_kind, code, source, unwrap in payload:
+            if attr_kind is _NODE:
+                val = filter_out_empty_values(_render_list(code, global_vars, local_vars, True))
+                if not (len(val) == 0 or (len(val) == 1 and len(val[0]) == 0)):
+                    item[attr] = val
+                continue
+            try:
+                val = _evaluate(code, global_vars, local_vars)
+                if unwrap:
+                    if val is None or isinstance(val, str) and len(val) == 0:
+                        return []
+                    return val
+                if val == '' or val is None:
+                    val = EMPTY_FIELD
+                if EMPTY_FIELD not in val:
+                    item[attr] = val
+            except Exception as e:
+                if not "is not defined" in str(e):
+                    print(f'Unable to evaluate: {source}; {str(e)}', file=sys.stderr)
+        result.append(item)
+
+    result = list(filter(lambda x: x != EMPTY_FIELD, filter_out_empty_values(result)))
+
+    if not nested and len(result) == 1:
+        return result[0]
+    else:
+        return result
+
+
+class CompiledTemplate:
+    """
+    The mapping template compiled once into code objects.
+
+    `render()` gives the same result as `compile_template()` on the source
+    template but skips the deepcopy and the parsing of every f-string and
+    eval() expression per package.
+    The text fields (default: those of the udc plugin) are resolved at compile
+    time, so the template has to be compiled again when the config is reloaded.
+    """
+
+    def __init__(self, template, text_fields=None):
+        if text_fields is None:
+            text_fields = get_plugin('udc').text_fields
+        self._compiled = _compile_list(template, set(text_fields))
+
+    def render(self, global_vars, local_vars, nested=False):
+        return _render_list(self._compiled, global_vars, local_vars, nested)
+
+
 def compile_with_temp_value(mappings, global_vars, local_vars, nested=False):
     """
     Parse the mapping config into json-ld data.
@@ -18,6 +18,7 @@ import ckan.lib.helpers as h
 from ckan.common import current_user, _
 
 from .graph.logic import onUpdateCatalogue, onDeleteCatalogue, get_catalogue_graph
+from .graph.sync import enqueue_graph_sync, is_async_sync
 from .search.params import get_search_details
 from ckanext.udc.file_format.logic import before_package_update as before_package_update_for_file_format
 
@@ -53,9 +54,14 @@ def package_update(original_action, context, data_dict):
     before_package_update_for_file_format(context, data_dict)
     
     result = original_action(context, data_dict)
+    if plugins.get_plugin('udc').disable_graphdb:
+        return result
+    if is_async_sync():
+        # Applied to GraphDB by the background sync job
+        enqueue_graph_sync(context, result['id'], 'update')
+        return result
     try:
-        if not plugins.get_plugin('udc').disable_graphdb:
-            onUpdateCatalogue(context, result)
+        onUpdateCatalogue(context, result)
     except Exception as e:
         log.error(e)
         print(e)
@@ -67,9 +73,15 @@ def package_update(original_action, context, data_dict):
 def package_delete(original_action, context, data_dict):
     print(f"Package Delete: ", data_dict)
     result = original_action(context, data_dict)
+    if plugins.get_plugin('udc').disable_graphdb:
+        return result
+    if is_async_sync():
+        package = model.Package.get(data_dict.get('id'))
+        if package:
+            enqueue_graph_sync(context, package.id, 'delete')
+        return result
     try:
-        if not plugins.get_plugin('udc').disable_graphdb:
-            onDeleteCatalogue(context, data_dict)
+        onDeleteCatalogue(context, data_dict)
     except Exception as e:
         log.error(e)
         print(e)
@@ -11,6 +11,8 @@ from ckan.logic import NotFound
 from ckan.types import Context
 from ckanext.activity.model.activity import Activity
 
+from ckanext.udc.organization.bulk import delete_packages
+
 
 @tk.side_effect_free
 def udc_organization_list(context: Context, data_dict: dict[str, Any]) -> dict[str, Any]:
@@ -115,7 +117,7 @@ def udc_organization_packages_ids(context: Context, data_dict: dict[str, Any]) -
 
 
 def udc_organization_packages_delete(context: Context, data_dict: dict[str, Any]) -> dict[str, Any]:
-    """Delete (soft-delete) packages for an organization (sysadmin only)."""
+    """Delete (soft-delete) packages for an organization in batches (sysadmin only)."""
     tk.check_access("udc_organization_packages_delete", context, data_dict)
 
     org = _get_org(data_dict)
@@ -126,18 +128,9 @@ def udc_organization_packages_delete(context: Context, data_dict: dict[str, Any]
     if not package_ids:
         raise tk.ValidationError({"ids": ["No packages selected."]})
 
-    errors: list[dict[str, str]] = []
-    deleted = 0
-    delete_action = tk.get_action("package_delete")
-
-    for pkg_id in package_ids:
-        try:
-            delete_action(context, {"id": pkg_id})
-            deleted += 1
-        except Exception as exc:  # pragma: no cover - forward exact error to UI
-            errors.append({"id": str(pkg_id), "error": str(exc)})
-
-    return {"success": not errors, "deleted": deleted, "errors": errors}
+    result = delete_packages(context, org.id, package_ids)
+    errors = result["errors"]
+    return {"success": not errors, "deleted": len(result["deleted"]), "errors": errors}
 
 
 def udc_organization_delete(context: Context, data_dict: dict[str, Any]) -> dict[str, Any]:
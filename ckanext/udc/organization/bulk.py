@@ -0,0 +1,189 @@
+"""
+Set-based removal of the packages of an organization.
+
+purge_organization_packages() selects the package ids straight from SQL and
+purges them `batch_size` at a time with one DELETE per table (what
+dataset_purge does for one package), then removes the organization's Solr
+documents with one delete-by-query. delete_packages() soft-deletes selected
+packages with CKAN's bulk_update_delete.
+
+Both take the GraphDB catalogue entries out with one update request per batch
+and keep the facet counts and the related packages cache in line, as the
+package hooks they skip would. Callers check access.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Any, Callable, Optional
+
+from sqlalchemy import and_, or_, select
+
+import ckan.plugins as plugins
+import ckan.plugins.toolkit as tk
+from ckan import model
+from ckan.lib.search.common import make_connection
+from ckan.types import Context
+
+from ckanext.udc.graph.sync import delete_catalogues
+from ckanext.udc.related_packages import invalidate_related_packages
+from ckanext.udc.search.facet_store import remove_packages_facet_values
+
+log = logging.getLogger(__name__)
+
+
+def _batch_size() -> int:
+    return int(tk.config.get("ckanext.udc.organization.purge_batch_size", 500))
+
+
+def _graphdb_enabled() -> bool:
+    return not plugins.get_plugin("udc").disable_graphdb
+
+
+def organization_package_ids(organization_id: str, package_ids: Optional[list[str]] = None) -> list[str]:
+    """Ids of the organization's packages in any state, optionally limited to `package_ids`."""
+    query = model.Session.query(model.Package.id).filter(model.Package.owner_org == organization_id)
+    if package_ids is not None:
+        query = query.filter(model.Package.id.in_(package_ids))
+    return [row[0] for row in query.order_by(model.Package.id)]
+
+
+def _purge_rows(package_ids: list[str]) -> None:
+    """Delete the packages and every row that refers to them; the caller commits."""
+    resource_ids = select(model.Resource.id).where(model.Resource.package_id.in_(package_ids))
+    statements = [
+        (model.ResourceView, model.ResourceView.resource_id.in_(resource_ids)),
+        (model.Resource, model.Resource.package_id.in_(package_ids)),
+        (model.PackageExtra, model.PackageExtra.package_id.in_(package_ids)),
+        (model.PackageTag, model.PackageTag.package_id.in_(package_ids)),
+        (model.PackageRelationship, or_(
+            model.PackageRelationship.subject_package_id.in_(package_ids),
+            model.PackageRelationship.object_package_id.in_(package_ids),
+        )),
+        (model.PackageMember, model.PackageMember.package_id.in_(package_ids)),
+        (model.UserFollowingDataset, model.UserFollowingDataset.object_id.in_(package_ids)),
+        (model.Member, and_(model.Member.table_name == "package", model.Member.table_id.in_(package_ids))),
+        (model.Package, model.Package.id.in_(package_ids)),
+    ]
+    for entity, criterion in statements:
+        model.Session.query(entity).filter(criterion).delete(synchronize_session=False)
+
+
+def _delete_from_index(organization_id: str, package_ids: Optional[list[str]] = None,
+                       batch_size: int = 500) -> None:
+    """
+    Remove the organization's documents from Solr with one delete-by-query,
+    or only those of `package_ids` (after an interrupted purge).
+    """
+    site_id = tk.config.get("ckan.site_id")
+    conn = make_connection()
+    if package_ids is None:
+        conn.delete(q=f'+site_id:"{site_id}" +owner_org:"{organization_id}"', commit=True)
+        return
+    for start in range(0, len(package_ids), batch_size):
+        ids = " OR ".join(f'"{package_id}"' for package_id in package_ids[start:start + batch_size])
+        conn.delete(q=f'+site_id:"{site_id}" +id:({ids})', commit=False)
+    conn.commit()
+
+
+def _delete_catalogues(context: Context, package_ids: list[str], graph: dict[str, int]) -> None:
+    result = delete_catalogues(context, package_ids)
+    graph["deleted"] += result["deleted"]
+    graph["queued"] += result["queued"]
+
+
+def purge_organization_packages(context: Context, organization_id: str, batch_size: Optional[int] = None,
+                                cb: Optional[Callable[[str], None]] = None) -> dict[str, Any]:
+    """
+    Purge every package of the organization, one transaction per batch.
+
+    :param cb: called with a progress message after each batch
+    :returns: {"total": packages selected, "purged": packages purged,
+        "graph": {"deleted": ..., "queued": ...} GraphDB catalogue removals}
+    """
+    batch_size = batch_size or _batch_size()
+    package_ids = organization_package_ids(organization_id)
+    total = len(package_ids)
+    purged: list[str] = []
+    graph = {"deleted": 0, "queued": 0}
+    graphdb_enabled = _graphdb_enabled()
+    if cb:
+        cb(f"{total} packages to purge")
+
+    try:
+        for start in range(0, total, batch_size):
+            chunk = package_ids[start:start + batch_size]
+            try:
+                remove_packages_facet_values(chunk)
+                _purge_rows(chunk)
+                model.Session.commit()
+            except Exception:
+                model.Session.rollback()
+                raise
+            purged.extend(chunk)
+            if graphdb_enabled:
+                _delete_catalogues(context, chunk, graph)
+            if cb:
+                cb(f"Purged {len(purged)}/{total} packages")
+    finally:
+        if purged:
+            invalidate_related_packages()
+            # Packages added while purging keep their documents
+            complete = len(purged) == total and not organization_package_ids(organization_id)
+            try:
+                _delete_from_index(organization_id, None if complete else purged, batch_size)
+                if cb:
+                    cb(f"Removed {len(purged)} packages from the search index")
+            except Exception as e:
+                log.error(f"Failed to remove the purged packages of {organization_id} from the search index: {e}")
+                if cb:
+                    cb(f"Failed to remove the purged packages from the search index: {e}")
+
+    return {"total": total, "purged": len(purged), "graph": graph}
+
+
+def delete_packages(context: Context, organization_id: str, package_ids: list[str],
+                    batch_size: Optional[int] = None) -> dict[str, Any]:
+    """
+    Soft-delete packages of the organization with bulk_update_delete, one
+    batch at a time, plus the memberships and collaborators package_delete
+    also removes.
+
+    :returns: {"deleted": [ids], "errors": [{"id": ..., "error": ...}]}
+    """
+    batch_size = batch_size or _batch_size()
+    requested = list(dict.fromkeys(str(package_id) for package_id in package_ids))
+    found = organization_package_ids(organization_id, requested)
+    errors = [
+        {"id": package_id, "error": "Package not found in this organization."}
+        for package_id in sorted(set(requested) - set(found))
+    ]
+    deleted: list[str] = []
+    graphdb_enabled = _graphdb_enabled()
+    bulk_update_delete = tk.get_action("bulk_update_delete")
+
+    for start in range(0, len(found), batch_size):
+        chunk = found[start:start + batch_size]
+        try:
+            (
+                model.Session.query(model.Member)
+                .filter(model.Member.table_id.in_(chunk))
+                .filter(model.Member.state == "active")
+                .update({"state": "deleted"}, synchronize_session=False)
+            )
+            model.Session.query(model.PackageMember).filter(
+                model.PackageMember.package_id.in_(chunk)
+            ).delete(synchronize_session=False)
+            remove_packages_facet_values(chunk)
+            # Commits the changes above with its own
+            bulk_update_delete(dict(context), {"datasets": chunk, "org_id": organization_id})
+        except Exception as exc:
+            model.Session.rollback()
+            errors.extend({"id": package_id, "error": str(exc)} for package_id in chunk)
+            continue
+        deleted.extend(chunk)
+        if graphdb_enabled:
+            delete_catalogues(context, chunk)
+
+    if deleted:
+        invalidate_related_packages()
+    return {"deleted": deleted, "errors": errors}
@@ -19,6 +19,16 @@ from typing import (
 from functools import partial
 
 from ckanext.udc.search.logic.actions import filter_facets_get
+from ckanext.udc.search.logic.utils import invalidate_cache
+from ckanext.udc.search.facet_store import remove_package_facets, update_package_facets
+from ckanext.udc.related_packages import (
+    add_related_packages,
+    get_related_packages,
+    invalidate_related_packages,
+    package_relationship_create,
+    package_relationship_delete,
+    package_relationship_update,
+)
 from ckan.types import Schema, Context, CKANApp, Response, SignalMapping
 import ckan
 import ckan.plugins as plugins
@@ -53,9 +63,10 @@ from ckanext.udc.helpers import (
 )
 from ckanext.udc.solr.config import pick_locale, pick_locale_with_fallback, get_udc_langs, get_current_lang
 from ckanext.udc.search.params import facet_alias_map, get_search_details
-from ckanext.udc.graph.sparql_client import SparqlClient
+from ckanext.udc.graph.sparql_client import SparqlClient, sparql_client_options
 from ckanext.udc.graph.preload import preload_ontologies
-from ckanext.udc.graph.logic import get_catalogue_graph
+from ckanext.udc.graph.logic import get_catalogue_graph, invalidate_mappings_cache
+from ckanext.udc.graph.sync import udc_graph_sync_status
 from babel import Locale
 
 from ckanext.udc.licenses.logic.action import (
@@ -79,7 +90,7 @@ from ckanext.udc.desc.actions import (
 )
 from ckanext.udc.desc.utils import init_plugin as init_udc_desc
 from ckanext.udc.error_handler import override_error_handler
-from ckanext.udc.system.actions import reload_supervisord, get_system_stats
+from ckanext.udc.system.actions import reload_supervisord, get_system_stats, get_sparql_stats, reset_sparql_stats
 from ckanext.udc.version.actions import udc_version_meta
 from ckanext.udc.solr.solr import update_solr_maturity_model_fields
 from ckanext.udc.solr.index import before_dataset_index as _before_dataset_index
@@ -150,6 +161,7 @@ class UdcPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm, DefaultTranslati
     plugins.implements(plugins.IAuthFunctions)
     plugins.implements(plugins.IFacets)
     plugins.implements(plugins.IPackageController)
+    plugins.implements(plugins.IDomainObjectModification, inherit=True)
     plugins.implements(plugins.IMiddleware)
     plugins.implements(plugins.IBlueprint)
     plugins.implements(plugins.IValidators)
@@ -166,6 +178,8 @@ class UdcPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm, DefaultTranslati
     date_fields: List[str] = []
     multiple_select_fields: List[str] = []
     dropdown_options: dict[str, dict[str, str]] = {}
+    # Cached by solr.index.get_index_settings(), reset when the config changes
+    index_settings = None
 
     def update_config(self, config_):
         tk.add_template_directory(config_, "templates")
@@ -214,7 +228,8 @@ class UdcPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm, DefaultTranslati
 
         else:
             self.sparql_client = SparqlClient(
-                endpoint, username=username, password=password
+                endpoint, username=username, password=password,
+                **sparql_client_options(tk.config)
             )
             if self.sparql_client.test_connecetion():
                 log.info("GraphDB connected: " + endpoint)
@@ -323,6 +338,12 @@ class UdcPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm, DefaultTranslati
             log.error("UDC Plugin Error:")
             traceback.print_exc()
 
+        self.index_settings = None
+        # The compiled mappings depend on the mappings and the text fields
+        invalidate_mappings_cache()
+        # Facet names depend on the text fields, labels on the dropdown options
+        invalidate_cache("filter_facets")
+
     def _modify_package_schema(self, schema: Schema) -> Schema:
         """
         Wire CUDC custom fields into CKAN:
@@ -648,6 +669,9 @@ class UdcPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm, DefaultTranslati
             "config_option_update": config_option_update,
             "package_update": package_update,
             "package_delete": package_delete,
+            "package_relationship_create": package_relationship_create,
+            "package_relationship_update": package_relationship_update,
+            "package_relationship_delete": package_relationship_delete,
             # Custom Licenses
             "license_create": license_create,
             "license_delete": license_delete,
@@ -665,8 +689,12 @@ class UdcPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm, DefaultTranslati
             # System actions
             "reload_supervisord": reload_supervisord,
             "get_system_stats": get_system_stats,
+            "get_sparql_stats": get_sparql_stats,
+            "reset_sparql_stats": reset_sparql_stats,
             # Version metadata helper
             "udc_version_meta": udc_version_meta,
+            # Knowledge graph sync
+            "udc_graph_sync_status": udc_graph_sync_status,
             # "maturity_model_get": get_maturity_model,
             # Filters
             "filter_facets_get": filter_facets_get,
@@ -751,82 +779,35 @@ class UdcPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm, DefaultTranslati
         pass
 
     def after_dataset_create(self, context: Context, pkg_dict: dict[str, Any]) -> None:
-        pass
+        update_package_facets(pkg_dict["id"])
+        invalidate_cache("filter_facets")
+        invalidate_related_packages()
 
     def after_dataset_update(self, context: Context, pkg_dict: dict[str, Any]) -> None:
-        pass
+        update_package_facets(pkg_dict["id"])
+        invalidate_cache("filter_facets")
+        invalidate_related_packages()
 
     def after_dataset_delete(self, context: Context, pkg_dict: dict[str, Any]) -> None:
-        pass
+        package = model.Package.get(pkg_dict["id"])
+        if package:
+            update_package_facets(package.id, deleted=True)
+        invalidate_cache("filter_facets")
+        invalidate_related_packages()
+
+    def notify(self, entity: Any, operation: str) -> None:
+        # Purges (dataset_purge, Package.purge()) delete the row without the package hooks
+        if isinstance(entity, model.Package) and operation == model.DomainObjectOperation.deleted:
+            remove_package_facets(entity.id)
+            invalidate_cache("filter_facets")
+            invalidate_related_packages()
 
     def after_dataset_show(self, context: Context, pkg_dict: dict[str, Any]) -> None:
         if context.get("for_update"):
             # Avoid injecting related_packages and udc_import_extras during package_update/patch.
             pkg_dict.pop("udc_import_extras", None)
             return
-        # Add related packages
-        related_packages = []
-
-        if pkg_dict.get("is_unified"):
-            rel = (
-                model.meta.Session.query(model.PackageRelationship)
-                .filter(model.PackageRelationship.subject_package_id == pkg_dict["id"])
-                .all()
-            )
-            for r in rel:
-                related_package = model.Package.get(r.object_package_id)
-                related_packages.append(
-                    {
-                        "title": related_package.title,
-                        "id": related_package.id,
-                        "name": related_package.name,
-                    }
-                )
-        else:
-            # Non-unified package need to get the unified package and then get the related packages
-            rel = (
-                model.meta.Session.query(model.PackageRelationship)
-                .filter(model.PackageRelationship.object_package_id == pkg_dict["id"])
-                .all()
-            )
-
-            for r in rel:
-                unified_package = model.Package.get(r.subject_package_id)
-                related_packages.append(
-                    {
-                        "title": unified_package.title,
-                        "id": unified_package.id,
-                        "name": unified_package.name,
-                    }
-                )
-
-                rel2 = (
-                    model.meta.Session.query(model.PackageRelationship)
-                    .filter(
-                        model.PackageRelationship.subject_package_id
-                        == unified_package.id
-                    )
-                    .filter(
-                        model.PackageRelationship.object_package_id != pkg_dict["id"]
-                    )
-                    .all()
-                )
-
-                for r in rel2:
-                    related_package = model.Package.get(r.object_package_id)
-                    # Check if exists
-                    if related_package.id not in set(
-                        [p["id"] for p in related_packages]
-                    ):
-                        related_packages.append(
-                            {
-                                "title": related_package.title,
-                                "id": related_package.id,
-                                "name": related_package.name,
-                            }
-                        )
-
-        pkg_dict["related_packages"] = related_packages
+        pkg_dict["related_packages"] = get_related_packages(pkg_dict["id"], pkg_dict.get("is_unified"))
 
     def before_dataset_search(self, params: dict[str, Any]) -> dict[str, Any]:
         # print(chalk.red("before_dataset_search"))
@@ -881,6 +862,10 @@ class UdcPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm, DefaultTranslati
     def after_dataset_search(
         self, search_results: dict[str, Any], search_params: dict[str, Any]
     ) -> dict[str, Any]:
+        # The indexed copies of related_packages are as old as the index
+        add_related_packages(
+            [pkg for pkg in search_results.get("results") or [] if "related_packages" in pkg]
+        )
         if not _is_catalogue_search_fq(search_params.get("fq") or ""):
             return search_results
 
@@ -0,0 +1,153 @@
+"""
+Related packages of a catalogue entry, shown as `related_packages`.
+
+A unified package is the subject of a relationship to each package it was
+deduplicated from. The related packages of a unified package are those
+packages; the related packages of any other package are its unified packages,
+each followed by the other packages of that unified package.
+
+The whole graph of a batch of packages is read with one joined query per
+package kind instead of a relationship query and a Package.get() per related
+package. Results of single packages (package_show) are cached for
+RELATED_CACHE_SECONDS; the cache is invalidated when a relationship or a
+package changes.
+"""
+from __future__ import annotations
+
+from typing import Any, Iterable, Mapping
+
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+
+import ckan.model as model
+from ckan.plugins.toolkit import chained_action
+
+from ckanext.udc.search.logic.utils import cache_for, invalidate_cache
+
+RELATED_CACHE_SECONDS = 60
+RELATED_CACHE_NAME = "related_packages"
+
+
+def _unified_rows(package_ids: list[str]) -> list[tuple]:
+    """(unified id, related id, title, name) of the given unified packages."""
+    Rel = model.PackageRelationship
+    Package = model.Package
+    return (
+        model.Session.query(Rel.subject_package_id, Package.id, Package.title, Package.name)
+        .join(Package, Package.id == Rel.object_package_id)
+        .filter(Rel.subject_package_id.in_(package_ids))
+        .all()
+    )
+
+
+def _sibling_rows(package_ids: list[str]) -> list[tuple]:
+    """
+    (package id, unified id, title, name, sibling id, title, name) of the given
+    packages; the sibling columns are None for a unified package without other
+    packages.
+    """
+    parent_rel = aliased(model.PackageRelationship)
+    sibling_rel = aliased(model.PackageRelationship)
+    parent = aliased(model.Package)
+    sibling = aliased(model.Package)
+    return (
+        model.Session.query(
+            parent_rel.object_package_id,
+            parent.id, parent.title, parent.name,
+            sibling.id, sibling.title, sibling.name,
+        )
+        .join(parent, parent.id == parent_rel.subject_package_id)
+        .outerjoin(sibling_rel, and_(
+            sibling_rel.subject_package_id == parent_rel.subject_package_id,
+            sibling_rel.object_package_id != parent_rel.object_package_id,
+        ))
+        .outerjoin(sibling, sibling.id == sibling_rel.object_package_id)
+        .filter(parent_rel.object_package_id.in_(package_ids))
+        .all()
+    )
+
+
+def _entry(package_id: str, title: str, name: str) -> dict[str, Any]:
+    return {"title": title, "id": package_id, "name": name}
+
+
+def resolve_related_packages(packages: Mapping[str, Any]) -> dict[str, list[dict[str, Any]]]:
+    """
+    Related packages of every package id in `packages` (id -> is_unified),
+    with at most two queries for the whole batch.
+    """
+    unified_ids = [package_id for package_id, is_unified in packages.items() if is_unified]
+    other_ids = [package_id for package_id, is_unified in packages.items() if not is_unified]
+    related: dict[str, dict[str, dict[str, Any]]] = {package_id: {} for package_id in packages}
+
+    if unified_ids:
+        for unified_id, package_id, title, name in _unified_rows(unified_ids):
+            related[unified_id].setdefault(package_id, _entry(package_id, title, name))
+
+    if other_ids:
+        # package id -> unified id -> {sibling id: entry}, in the order the rows come
+        groups: dict[str, dict[str, dict[str, Any]]] = {package_id: {} for package_id in other_ids}
+        parents: dict[str, dict[str, Any]] = {}
+        for package_id, parent_id, parent_title, parent_name, sibling_id, sibling_title, sibling_name in _sibling_rows(other_ids):
+            parents.setdefault(parent_id, _entry(parent_id, parent_title, parent_name))
+            siblings = groups[package_id].setdefault(parent_id, {})
+            if sibling_id is not None:
+                siblings.setdefault(sibling_id, _entry(sibling_id, sibling_title, sibling_name))
+        for package_id, unified in groups.items():
+            entries = related[package_id]
+            for parent_id, siblings in unified.items():
+                entries.setdefault(parent_id, parents[parent_id])
+                for sibling_id, entry in siblings.items():
+                    entries.setdefault(sibling_id, entry)
+
+    return {package_id: [dict(entry) for entry in entries.values()] for package_id, entries in related.items()}
+
+
+def _related_cache_key(package_id: str, is_unified: Any) -> str:
+    return f"{package_id}:{int(bool(is_unified))}"
+
+
+@cache_for(RELATED_CACHE_SECONDS, key_func=_related_cache_key, maxsize=4096, name=RELATED_CACHE_NAME)
+def _cached_related_packages(package_id: str, is_unified: Any) -> list[dict[str, Any]]:
+    return resolve_related_packages({package_id: is_unified})[package_id]
+
+
+def get_related_packages(package_id: str, is_unified: Any) -> list[dict[str, Any]]:
+    """Related packages of one package, cached."""
+    # Copies, the caller owns the result
+    return [dict(entry) for entry in _cached_related_packages(package_id, is_unified)]
+
+
+def add_related_packages(pkg_dicts: Iterable[dict[str, Any]]) -> None:
+    """Refresh `related_packages` of a list of package dicts, e.g. search results."""
+    pkg_dicts = [pkg_dict for pkg_dict in pkg_dicts if pkg_dict.get("id")]
+    if not pkg_dicts:
+        return
+    related = resolve_related_packages({pkg_dict["id"]: pkg_dict.get("is_unified") for pkg_dict in pkg_dicts})
+    for pkg_dict in pkg_dicts:
+        pkg_dict["related_packages"] = related[pkg_dict["id"]]
+
+
+def invalidate_related_packages() -> None:
+    invalidate_cache(RELATED_CACHE_NAME)
+
+
+@chained_action
+def package_relationship_create(original_action, context, data_dict):
+    result = original_action(context, data_dict)
+    invalidate_related_packages()
+    return result
+
+
+@chained_action
+def package_relationship_update(original_action, context, data_dict):
+    result = original_action(context, data_dict)
+    invalidate_related_packages()
+    return result
+
+
+@chained_action
+def package_relationship_delete(original_action, context, data_dict):
+    result = original_action(context, data_dict)
+    invalidate_related_packages()
+    return result
@@ -0,0 +1,388 @@
+"""
+Facet counts for the filter UI (`filter_facets_get`), kept in Postgres.
+
+The store is built once with `ckan udc facet-store-rebuild`. After that the
+IPackageController hooks keep it up to date: each package records the facet
+values it contributes (udc_facet_package_values), and a create/update/delete
+only applies the difference to the per value counts (udc_facet_value_count),
+inside the transaction of the package change.
+
+Until the store is built, or when the configured facet fields are not all in
+the store (run the rebuild after changing the maturity model), the facets are
+read from Solr as before.
+
+Bulk actions that skip the package hooks (bulk_update_private/public/delete)
+are not tracked; rebuild the store after using them. Set-based deletes call
+remove_packages_facet_values() instead.
+"""
+from __future__ import annotations
+
+import datetime
+import json
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Iterable, Optional
+
+from sqlalchemy import text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+import ckan.logic as logic
+import ckan.model as model
+import ckan.plugins as plugins
+import ckan.lib.helpers as h
+from ckan.lib.search.index import KEY_CHARS
+from ckan.model.system_info import get_system_info, set_system_info
+
+from ckanext.udc.solr.config import get_udc_langs
+from ckanext.udc.search.params import facet_alias_map
+from ckanext.udc.solr.index import before_dataset_index
+from .model import FacetPackageValues, FacetValueCount
+
+log = logging.getLogger(__name__)
+
+# {"status": "building" | "built", "fields": [...], "built_at": ..., "packages": ...}
+STATE_KEY = "ckanext.udc.facet_store"
+
+
+def filter_facet_aliases(lang: str) -> OrderedDict[str, str]:
+    """Stable facet key -> Solr field for the facets of the filter UI in `lang`."""
+    # Gather facet keys (prefer plugin-provided; then CKAN defaults)
+    ordered_plugin_keys: list[str] = []
+    for p in plugins.PluginImplementations(plugins.IFacets):
+        try:
+            provided = p.dataset_facets(OrderedDict(), "catalogue") or {}
+            for k in provided.keys():
+                if k not in ordered_plugin_keys:
+                    ordered_plugin_keys.append(k)
+        except Exception:
+            continue
+
+    facet_keys: list[str] = []
+    for k in ordered_plugin_keys + list(h.facets()):
+        if k not in facet_keys:
+            facet_keys.append(k)
+
+    _, alias_to_solr = facet_alias_map(facet_keys, lang)
+    return alias_to_solr
+
+
+def facet_solr_fields() -> list[str]:
+    """All Solr facet fields used by filter_facets_get, for every language."""
+    fields: list[str] = []
+    for lang in get_udc_langs():
+        for solr_name in filter_facet_aliases(lang).values():
+            if solr_name not in fields:
+                fields.append(solr_name)
+    return fields
+
+
+def get_facet_store_state() -> Optional[dict]:
+    raw = get_system_info(STATE_KEY)
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def index_document(pkg_dict: dict[str, Any]) -> dict[str, Any]:
+    """
+    The Solr document for an unvalidated package_show dict, as far as the facet
+    fields go: the flattening done by CKAN's PackageSearchIndex followed by our
+    before_dataset_index hook.
+    """
+    doc = dict(pkg_dict)
+    for extra in doc.pop("extras", None) or []:
+        key, value = extra["key"], extra["value"]
+        if isinstance(value, (tuple, list)):
+            value = " ".join(map(str, value))
+        key = "".join(c for c in key if c in KEY_CHARS)
+        doc["extras_" + key] = value
+        doc.setdefault(key, value)
+
+    doc["tags"] = [t["name"] for t in doc.get("tags") or [] if not t.get("vocabulary_id")]
+    doc["groups"] = [g["name"] for g in doc.get("groups") or []]
+    organization = doc.get("organization")
+    doc["organization"] = organization["name"] if organization else None
+    doc["res_format"] = [r.get("format", "") for r in doc.get("resources") or []]
+    doc["capacity"] = "private" if doc.get("private") else "public"
+    return before_dataset_index(doc)
+
+
+def _field_values(value: Any) -> list[str]:
+    items = value if isinstance(value, (list, tuple, set)) else [value]
+    out = set()
+    for item in items:
+        if item is None or isinstance(item, (dict, list)):
+            continue
+        if isinstance(item, bool):
+            item = "true" if item else "false"
+        item = str(item)
+        if item.strip():
+            out.add(item)
+    return sorted(out)
+
+
+def package_facet_values(pkg_dict: dict[str, Any], fields: Iterable[str]) -> dict[str, list[str]]:
+    """{solr field: [values]} counted for a package; empty unless it is public and active."""
+    if pkg_dict.get("private") or pkg_dict.get("state", "active") != "active":
+        return {}
+    doc = index_document(pkg_dict)
+    values = {}
+    for field in fields:
+        field_values = _field_values(doc.get(field))
+        if field_values:
+            values[field] = field_values
+    return values
+
+
+def facet_deltas(old: dict[str, list[str]], new: dict[str, list[str]]) -> dict[tuple[str, str], int]:
+    """The count changes, {(field, value): +1 / -1}, of replacing `old` by `new`."""
+    old_pairs = {(f, v) for f, vs in old.items() for v in vs}
+    new_pairs = {(f, v) for f, vs in new.items() for v in vs}
+    deltas = {pair: 1 for pair in new_pairs - old_pairs}
+    deltas.update({pair: -1 for pair in old_pairs - new_pairs})
+    return deltas
+
+
+def _apply_deltas(deltas: dict[tuple[str, str], int]):
+    if not deltas:
+        return
+    table = FacetValueCount.__table__
+    # Sorted, so concurrent updates lock the rows in the same order
+    rows = [{"field": f, "value": v, "count": d} for (f, v), d in sorted(deltas.items())]
+    stmt = insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.field, table.c.value],
+        set_={"count": table.c.count + stmt.excluded.count},
+    )
+    model.Session.execute(stmt)
+
+    decremented = [pair for pair, d in deltas.items() if d < 0]
+    if decremented:
+        model.Session.execute(
+            table.delete()
+            .where(tuple_(table.c.field, table.c.value).in_(decremented))
+            .where(table.c.count <= 0)
+        )
+
+
+def save_package_facet_values(package_id: str, values: dict[str, list[str]]):
+    """Record the facet values of a package and apply the count changes."""
+    session = model.Session
+    row = (
+        session.query(FacetPackageValues)
+        .filter(FacetPackageValues.package_id == package_id)
+        .with_for_update()
+        .first()
+    )
+    old = json.loads(row.values) if row else {}
+    _apply_deltas(facet_deltas(old, values))
+    if row is None:
+        row = FacetPackageValues(package_id=package_id)
+        session.add(row)
+    row.values = json.dumps(values, sort_keys=True)
+    row.updated_at = datetime.datetime.utcnow()
+
+
+def removal_deltas(stored: Iterable[dict[str, list[str]]]) -> dict[tuple[str, str], int]:
+    """The count changes of removing packages with the `stored` facet values."""
+    deltas: Counter = Counter()
+    for values in stored:
+        for field, field_values in values.items():
+            for value in field_values:
+                deltas[(field, value)] -= 1
+    return dict(deltas)
+
+
+def remove_packages_facet_values(package_ids: list[str]):
+    """
+    Take packages deleted in bulk out of the counts, in the caller's
+    transaction: one read and one delete for all of them.
+    """
+    if not get_facet_store_state():
+        return
+    session = model.Session
+    rows = (
+        session.query(FacetPackageValues.values)
+        .filter(FacetPackageValues.package_id.in_(package_ids))
+        .with_for_update()
+        .all()
+    )
+    _apply_deltas(removal_deltas(json.loads(row[0]) for row in rows))
+    session.query(FacetPackageValues).filter(
+        FacetPackageValues.package_id.in_(package_ids)
+    ).delete(synchronize_session=False)
+
+
+def remove_package_facets(package_id: str):
+    """
+    Called when a package row is deleted (dataset_purge, Package.purge()):
+    take it out of the counts and drop its stored values, in a savepoint as
+    in update_package_facets.
+    """
+    if not get_facet_store_state():
+        return
+    try:
+        with model.Session.begin_nested():
+            remove_packages_facet_values([package_id])
+    except Exception:
+        log.exception("Failed to remove the facet counts of purged package %s", package_id)
+
+
+def update_package_facets(package_id: str, deleted: bool = False):
+    """
+    Called from the package hooks: bring the counts in line with the package.
+
+    Runs in a savepoint of the package transaction, so a failure here does not
+    fail the package change (the counts are then off until the next rebuild).
+    """
+    state = get_facet_store_state()
+    if not state:
+        return
+    try:
+        with model.Session.begin_nested():
+            values = {}
+            if not deleted:
+                pkg_dict = logic.get_action("package_show")(
+                    {"ignore_auth": True, "validate": False, "use_cache": False, "for_update": True},
+                    {"id": package_id},
+                )
+                values = package_facet_values(pkg_dict, state["fields"])
+            save_package_facet_values(package_id, values)
+    except Exception:
+        log.exception("Failed to update the facet counts for package %s", package_id)
+
+
+def get_store_facets(fields: list[str]) -> Optional[dict[str, Any]]:
+    """
+    The facets for `fields` in the package_search `search_facets` format, or
+    None when the store cannot answer (not built, or missing fields).
+    """
+    state = get_facet_store_state()
+    if not state or state.get("status") != "built" or not set(fields) <= set(state.get("fields", [])):
+        return None
+
+    counts: dict[str, dict[str, int]] = {field: {} for field in fields}
+    rows = (
+        model.Session.query(FacetValueCount.field, FacetValueCount.value, FacetValueCount.count)
+        .filter(FacetValueCount.field.in_(fields))
+        .filter(FacetValueCount.count > 0)
+    )
+    for field, value, count in rows:
+        counts[field][value] = count
+    return build_search_facets(counts)
+
+
+def build_search_facets(counts: dict[str, dict[str, int]]) -> dict[str, Any]:
+    """Format {field: {value: count}} the way package_search returns `search_facets`."""
+    group_names = []
+    for field_name in ("groups", "organization"):
+        group_names.extend(counts.get(field_name, {}).keys())
+    group_titles_by_name = dict(
+        model.Session.query(model.Group.name, model.Group.title)
+        .filter(model.Group.name.in_(group_names))
+        .all()
+    ) if group_names else {}
+
+    facets: dict[str, Any] = {}
+    for field, values in counts.items():
+        items = []
+        for name, count in values.items():
+            if field in ("groups", "organization"):
+                display_name = group_titles_by_name.get(name) or ""
+                display_name = display_name if display_name.strip() else name
+            elif field == "license_id":
+                license = model.Package.get_license_register().get(name)
+                display_name = license.title if license else name
+            else:
+                display_name = name
+            items.append({"name": name, "display_name": display_name, "count": count})
+        items.sort(key=lambda item: item["display_name"], reverse=True)
+        facets[field] = {"title": field, "items": items}
+    return facets
+
+
+def _public_package_ids() -> list[str]:
+    return [
+        row[0] for row in
+        model.Session.query(model.Package.id)
+        .filter(model.Package.state == "active")
+        .filter(model.Package.private == False)  # noqa: E712
+        .order_by(model.Package.id)
+    ]
+
+
+def rebuild_facet_store(echo: Optional[Callable[[str], None]] = None) -> dict:
+    """
+    Recompute the facet values of every package and the counts.
+
+    The package hooks keep recording changes while the packages are read; those
+    newer values win over what the rebuild read. The tables are only locked for
+    the final swap.
+    """
+    echo = echo or log.info
+    fields = facet_solr_fields()
+    set_system_info(STATE_KEY, json.dumps({"status": "building", "fields": fields}))
+    started_at = datetime.datetime.utcnow()
+    start = time.monotonic()
+
+    package_ids = _public_package_ids()
+    echo(f"Reading the facet values of {len(package_ids)} packages")
+    values_by_package: dict[str, dict[str, list[str]]] = {}
+    failed = 0
+    show = logic.get_action("package_show")
+    for n, package_id in enumerate(package_ids, 1):
+        try:
+            pkg_dict = show({"ignore_auth": True, "validate": False, "use_cache": False}, {"id": package_id})
+            values_by_package[package_id] = package_facet_values(pkg_dict, fields)
+        except Exception as e:
+            failed += 1
+            log.error("Cannot read the facet values of package %s: %s", package_id, e)
+        if n % 1000 == 0:
+            echo(f"{n}/{len(package_ids)} packages")
+    # End the read transaction before taking the lock
+    model.Session.commit()
+
+    session = model.Session
+    try:
+        session.execute(text(
+            f"LOCK TABLE {FacetPackageValues.__tablename__}, {FacetValueCount.__tablename__} IN EXCLUSIVE MODE"
+        ))
+        for row in session.query(FacetPackageValues).filter(FacetPackageValues.updated_at >= started_at):
+            values_by_package[row.package_id] = json.loads(row.values)
+
+        counts: Counter = Counter()
+        for values in values_by_package.values():
+            for field, field_values in values.items():
+                counts.update((field, value) for value in field_values)
+
+        now = datetime.datetime.utcnow()
+        session.query(FacetPackageValues).delete(synchronize_session=False)
+        session.query(FacetValueCount).delete(synchronize_session=False)
+        session.bulk_insert_mappings(FacetPackageValues, [
+            {"package_id": package_id, "values": json.dumps(values, sort_keys=True), "updated_at": now}
+            for package_id, values in values_by_package.items() if values
+        ])
+        session.bulk_insert_mappings(FacetValueCount, [
+            {"field": field, "value": value, "count": count}
+            for (field, value), count in counts.items()
+        ])
+        stats = {
+            "status": "built",
+            "fields": fields,
+            "built_at": now.isoformat(),
+            "packages": sum(1 for values in values_by_package.values() if values),
+            "values": len(counts),
+            "failed": failed,
+        }
+        # Commits the swap together with the state
+        set_system_info(STATE_KEY, json.dumps(stats))
+    except Exception:
+        session.rollback()
+        raise
+
+    stats["seconds"] = round(time.monotonic() - start, 2)
+    return stats
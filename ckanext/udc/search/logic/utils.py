@@ -3,9 +3,18 @@ from __future__ import annotations
 import cProfile
 import pstats
 import io
+import json
+import logging
+import threading
 import time
+import uuid
+from collections import OrderedDict
 from functools import wraps
-from typing import Any
+from typing import Any, Optional
+
+from redis.exceptions import RedisError
+
+log = logging.getLogger(__name__)
 
 
 def profile_func(func):
@@ -27,11 +36,165 @@ def profile_func(func):
     return wrapper
 
 
-def cache_for(seconds, key_func=None):
-    """Cache function results for ``seconds`` based on an optional key."""
+class TTLCache:
+    """
+    Bounded LRU cache with a TTL and single-flight recomputation.
+
+    Concurrent misses on the same key wait for the first caller instead of all
+    recomputing. With `udc.cache.backend = redis` the entries are stored in
+    Redis (JSON encoded) so every CKAN process shares them, and a Redis lock
+    keeps the recomputation single-flight across processes as well.
+    Otherwise they are kept in this process, evicted in LRU order after
+    `maxsize` keys.
+    """
+
+    # How long a process waits for another one to fill the Redis entry
+    REDIS_WAIT_SECONDS = 30
+
+    def __init__(self, name: str, seconds: float, maxsize: int = 128):
+        self.name = name
+        self.seconds = seconds
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: dict[Any, threading.Lock] = {}
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if time.monotonic() - entry[0] > self.seconds:
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                if len(self._key_locks) > 2 * self.maxsize:
+                    # Forget the locks of evicted keys
+                    for k in [k for k, l in self._key_locks.items() if k not in self._entries and not l.locked()]:
+                        del self._key_locks[k]
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _generation(self, redis) -> str:
+        generation = redis.get(f"udc:cache:{self.name}:generation") or b"0"
+        if isinstance(generation, bytes):
+            generation = generation.decode()
+        return generation
+
+    def _get_or_compute_redis(self, redis, key, compute):
+        generation = self._generation(redis)
+        redis_key = f"udc:cache:{self.name}:{generation}:{key}"
+        raw = redis.get(redis_key)
+        if raw is not None:
+            return json.loads(raw)
+
+        lock_key = redis_key + ":lock"
+        token = uuid.uuid4().hex
+        if redis.set(lock_key, token, nx=True, px=int(self.REDIS_WAIT_SECONDS * 1000)):
+            try:
+                value = compute()
+                # Invalidated while computing: the value may predate the change, do not share it
+                if self._generation(redis) == generation:
+                    redis.set(redis_key, json.dumps(value), ex=max(int(self.seconds), 1))
+            finally:
+                # After a slow compute the lock may have expired and be another process's
+                redis.eval(_RELEASE_LOCK, 1, lock_key, token)
+            return value
+
+        # Another process is computing it
+        deadline = time.monotonic() + self.REDIS_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            raw = redis.get(redis_key)
+            if raw is not None:
+                return json.loads(raw)
+        return compute()
+
+    def get_or_compute(self, key, compute):
+        redis = _get_cache_redis()
+        if redis is None:
+            value = self._get_local(key)
+            if value is not _MISSING:
+                return value
+
+        with self._key_lock(key):
+            if redis is not None:
+                try:
+                    return self._get_or_compute_redis(redis, key, compute)
+                except RedisError as e:
+                    log.warning(f"Cache {self.name}: Redis unavailable, not caching: {e}")
+                    return compute()
+            # Filled by the thread we waited for
+            value = self._get_local(key)
+            if value is _MISSING:
+                value = compute()
+                self._set_local(key, value)
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+        redis = _get_cache_redis()
+        if redis is not None:
+            try:
+                # Old entries are left to expire
+                redis.incr(f"udc:cache:{self.name}:generation")
+            except RedisError as e:
+                log.warning(f"Cache {self.name}: cannot invalidate the Redis entries: {e}")
+
+
+_MISSING = object()
+# Delete the lock only if it still holds our token
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# name -> TTLCache of every cache_for() function
+_caches: dict[str, TTLCache] = {}
+
+
+def _get_cache_redis():
+    """Redis connection when `udc.cache.backend = redis`, otherwise None."""
+    import ckan.plugins.toolkit as tk
+
+    if tk.config.get("udc.cache.backend", "memory") != "redis":
+        return None
+    from ckan.lib.redis import connect_to_redis
+
+    # Lazy connection, errors surface on first use
+    return connect_to_redis()
+
+
+def invalidate_cache(name: Optional[str] = None):
+    """Invalidate the cache_for() cache called `name`, or all of them."""
+    for cache_name, cache in _caches.items():
+        if name is None or cache_name == name:
+            cache.invalidate()
+
+
+def cache_for(seconds, key_func=None, maxsize=128, name=None):
+    """
+    Cache function results for ``seconds`` based on an optional key.
+    See TTLCache; `name` (default: the function name) is used by invalidate_cache().
+    """
 
     def decorator(func):
-        cached: dict[Any, dict[str, Any]] = {}
+        cache = _caches[name or func.__name__] = TTLCache(name or func.__name__, seconds, maxsize=maxsize)
 
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -46,12 +209,10 @@ def cache_for(seconds, key_func=None):
             if cache_key is None:
                 cache_key = "__default__"
 
-            now = time.time()
-            entry = cached.get(cache_key)
-            if not entry or now - entry["time"] > seconds:
-                cached[cache_key] = {"time": now, "result": func(*args, **kwargs)}
-            return cached[cache_key]["result"]
+            return cache.get_or_compute(cache_key, lambda: func(*args, **kwargs))
 
+        wrapper.cache = cache
+        wrapper.invalidate = cache.invalidate
         return wrapper
 
     return decorator
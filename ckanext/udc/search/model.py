@@ -0,0 +1,37 @@
+from sqlalchemy import Column
+from sqlalchemy import types
+from sqlalchemy.ext.declarative import declarative_base
+
+import ckan.model as model
+import datetime
+
+log = __import__('logging').getLogger(__name__)
+
+Base = declarative_base()
+
+
+class FacetPackageValues(Base):
+    """
+    The facet values one package contributes to the facet counts.
+
+    `values` is a JSON object {solr field: [values]}; it is empty for packages
+    that are private or not active, which do not count.
+    """
+    __tablename__ = 'udc_facet_package_values'
+
+    package_id = Column(types.UnicodeText, primary_key=True)
+    values = Column(types.UnicodeText, nullable=False, default='{}')
+    updated_at = Column(types.DateTime, default=datetime.datetime.utcnow)
+
+
+class FacetValueCount(Base):
+    """Number of public, active packages with `value` in the Solr facet field `field`."""
+    __tablename__ = 'udc_facet_value_count'
+
+    field = Column(types.UnicodeText, primary_key=True)
+    value = Column(types.UnicodeText, primary_key=True)
+    count = Column(types.Integer, nullable=False, default=0)
+
+
+def init_tables():
+    Base.metadata.create_all(model.meta.engine)
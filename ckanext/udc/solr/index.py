@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Union, Any
+from typing import NamedTuple, Union, Any
 import json
 import logging
 import ckan.plugins.toolkit as tk
@@ -9,6 +9,35 @@ from .config import get_udc_langs
 log = logging.getLogger(__name__)
 
 
+class IndexSettings(NamedTuple):
+    """The per-config lookups used for every indexed document."""
+    langs: tuple[str, ...]
+    text_fields: tuple[str, ...]
+    multiple_select_fields: tuple[str, ...]
+    # Log the original and the indexed document (udc.solr.debug_index_documents)
+    debug: bool
+
+
+def get_index_settings() -> IndexSettings:
+    """
+    Return the index settings, computed once per loaded config.
+
+    They are kept on the plugin instance, which drops them in reload_config(),
+    so a bulk reindex does not redo the lookups for every document.
+    """
+    udcPlugin = plugins.get_plugin('udc')
+    settings = getattr(udcPlugin, "index_settings", None)
+    if settings is None:
+        settings = IndexSettings(
+            langs=tuple(get_udc_langs()),
+            text_fields=tuple(udcPlugin.text_fields or []),
+            multiple_select_fields=tuple(udcPlugin.multiple_select_fields or []),
+            debug=tk.asbool(tk.config.get("udc.solr.debug_index_documents", False)),
+        )
+        udcPlugin.index_settings = settings
+    return settings
+
+
 def _jsonish(v):
     if isinstance(v, dict):
         return v
@@ -98,25 +127,23 @@ def _extract_version_list(raw: Any) -> list[dict[str, Any]]:
     return items
 
 
-def before_dataset_index(pkg_dict: dict[str, Any]) -> dict[str, Any]:
-    
-    log.info("Running before_dataset_index hook")
-    log.info("Original document: %s", json.dumps(pkg_dict, indent=2, ensure_ascii=True))
+def before_dataset_index(pkg_dict: dict[str, Any], settings: IndexSettings | None = None) -> dict[str, Any]:
+    settings = settings or get_index_settings()
+    debug = settings.debug and log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("Original document: %s", json.dumps(pkg_dict, indent=2, ensure_ascii=True, default=str))
 
-    # Get the UDC plugin instance
-    udcPlugin = plugins.get_plugin('udc')
-    
     # Make a shallow copy so we don't mutate CKAN's original
     index = dict(pkg_dict)
     
     # Do not index related packages
     index.pop("related_packages", None)
 
-    langs = get_udc_langs()
+    langs = settings.langs
     default_lang = langs[0]
 
     # multiple_select -> extras_<name> (array)
-    for field in udcPlugin.multiple_select_fields or []:
+    for field in settings.multiple_select_fields:
         if field in index and isinstance(index[field], str):
             index["extras_" + field] = [v for v in index[field].split(",") if v.strip()]
 
@@ -156,7 +183,7 @@ def before_dataset_index(pkg_dict: dict[str, Any]) -> dict[str, Any]:
 
     # maturity model TEXT fields (multilingual JSON in-place)
 
-    for name in udcPlugin.text_fields:
+    for name in settings.text_fields:
         raw = index.get(name)
         if raw is None and f"extras_{name}" in index:
             raw = index.get(f"extras_{name}")
@@ -239,6 +266,7 @@ def before_dataset_index(pkg_dict: dict[str, Any]) -> dict[str, Any]:
 
 
     # Pretty-print the final indexed document for debugging
-    log.info("Indexed document: %s", json.dumps(index, indent=2, ensure_ascii=True))
+    if debug:
+        log.debug("Indexed document: %s", json.dumps(index, indent=2, ensure_ascii=True, default=str))
 
     return index
@@ -0,0 +1,193 @@
+"""
+Parallel Solr reindex of the packages (`ckan udc reindex`).
+
+Package ids are read from Postgres in keyset pages (shards). A process pool
+builds the Solr documents of each shard with CKAN's own PackageSearchIndex,
+so every IPackageController.before_dataset_index hook (our multilingual
+fields included) runs as in `ckan search-index rebuild`; in the workers the
+Solr connection is replaced by a DocumentCollector that keeps the documents
+instead of sending them. The parent sends them to Solr in large batched adds
+and commits once at the end.
+
+With `since`, only the packages modified at or after that time are reindexed,
+including the ones deleted since, which CKAN removes from the index when
+`ckan.search.remove_deleted_packages` is on (the default).
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+import multiprocessing
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import pysolr
+
+import ckan.logic as logic
+import ckan.model as model
+import ckan.plugins.toolkit as tk
+import ckan.lib.search.index as search_index
+from ckan.lib.search.common import make_connection
+
+from .index import get_index_settings
+
+log = logging.getLogger(__name__)
+
+
+class DocumentCollector:
+    """Stands in for the pysolr connection in the pool workers."""
+
+    def __init__(self):
+        self.docs: List[dict] = []
+        self.delete_queries: List[str] = []
+
+    def add(self, docs, commit=False, **kwargs):
+        self.docs.extend(docs)
+
+    def delete(self, q=None, commit=False, **kwargs):
+        self.delete_queries.append(q)
+
+    def take(self) -> Tuple[List[dict], List[str]]:
+        docs, queries = self.docs, self.delete_queries
+        self.docs, self.delete_queries = [], []
+        return docs, queries
+
+
+def _package_query(since: Optional[datetime.datetime] = None):
+    query = model.Session.query(model.Package.id)
+    if since is not None:
+        query = query.filter(model.Package.metadata_modified >= since)
+    elif tk.config.get("ckan.search.remove_deleted_packages"):
+        query = query.filter(model.Package.state != "deleted")
+    return query
+
+
+def count_packages(since: Optional[datetime.datetime] = None) -> int:
+    return _package_query(since).count()
+
+
+def iter_package_id_shards(shard_size: int, since: Optional[datetime.datetime] = None) -> Iterator[List[str]]:
+    """Yield the package ids in id order, `shard_size` at a time."""
+    after_id = None
+    while True:
+        query = _package_query(since)
+        if after_id:
+            query = query.filter(model.Package.id > after_id)
+        ids = [row[0] for row in query.order_by(model.Package.id).limit(shard_size)]
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+def send_batch(conn, docs: List[dict]) -> List[Tuple[str, str]]:
+    """
+    Add `docs` to Solr without committing. If Solr rejects the batch, the
+    documents are sent one by one so only the bad ones fail.
+    Returns [(package id, error)].
+    """
+    if not docs:
+        return []
+    try:
+        conn.add(docs=docs, commit=False)
+        return []
+    except pysolr.SolrError as e:
+        log.warning("Solr rejected a batch of %s documents (%s), sending them one by one", len(docs), e)
+    failed = []
+    for doc in docs:
+        try:
+            conn.add(docs=[doc], commit=False)
+        except pysolr.SolrError as e:
+            failed.append((doc.get("id"), str(e)[:1000]))
+    return failed
+
+
+# State of a pool worker, set by _init_worker()
+_worker = {}
+
+
+def _init_worker():
+    # Do not share the database connections inherited from the parent process
+    model.Session.remove()
+    model.meta.engine.dispose(close=False)
+    collector = _worker["collector"] = DocumentCollector()
+    # PackageSearchIndex.index_package() sends through this connection
+    search_index.make_connection = lambda *args, **kwargs: collector
+
+
+def _build_shard(ids: List[str]):
+    package_show = logic.get_action("package_show")
+    package_index = search_index.PackageSearchIndex()
+    collector = _worker["collector"]
+    failed = []
+    for package_id in ids:
+        try:
+            context = {"ignore_auth": True, "validate": False, "use_cache": False}
+            package_index.update_dict(package_show(context, {"id": package_id}), defer_commit=True)
+        except Exception as e:
+            failed.append((package_id, repr(e)))
+    model.Session.remove()
+    docs, delete_queries = collector.take()
+    return len(ids), docs, delete_queries, failed
+
+
+def reindex(workers: int = 4, shard_size: int = 100, batch_size: int = 1000,
+            since: Optional[datetime.datetime] = None,
+            echo: Callable[[str], None] = log.info) -> dict:
+    """Reindex the packages; see the module docstring."""
+    total = count_packages(since)
+    echo(f"Indexing {total} packages with {workers} workers.")
+
+    # Computed once here and inherited by the forked workers
+    get_index_settings()
+    conn = make_connection()
+    shards = iter_package_id_shards(shard_size, since)
+    # fork: the workers inherit the loaded CKAN app and config
+    pool = multiprocessing.get_context("fork").Pool(workers, initializer=_init_worker)
+    start = time.monotonic()
+    done = 0
+    sent = 0
+    deleted = 0
+    failed: List[Tuple[str, str]] = []
+    rejected = 0
+    pending: List[dict] = []
+    try:
+        for count, docs, delete_queries, shard_failed in pool.imap_unordered(_build_shard, shards):
+            done += count
+            failed.extend(shard_failed)
+            for query in delete_queries:
+                conn.delete(q=query, commit=False)
+            deleted += len(delete_queries)
+            pending.extend(docs)
+            if len(pending) >= batch_size:
+                batch_failed = send_batch(conn, pending)
+                failed.extend(batch_failed)
+                rejected += len(batch_failed)
+                sent += len(pending)
+                pending = []
+
+            rate = done / max(time.monotonic() - start, 1e-6)
+            echo(f"{done}/{total} packages, {rate:.1f} packages/sec, {len(failed)} failed")
+    finally:
+        pool.terminate()
+        pool.join()
+
+    batch_failed = send_batch(conn, pending)
+    failed.extend(batch_failed)
+    rejected += len(batch_failed)
+    sent += len(pending)
+    echo("Committing the Solr index.")
+    conn.commit(waitSearcher=False)
+
+    for package_id, error in failed:
+        log.error(f"Cannot index package {package_id}: {error}")
+
+    elapsed = time.monotonic() - start
+    return {
+        "packages": done,
+        "documents": sent - rejected,
+        "deleted": deleted,
+        "failed": [package_id for package_id, _error in failed],
+        "seconds": round(elapsed, 1),
+        "packages_per_second": round(done / max(elapsed, 1e-6), 1),
+    }
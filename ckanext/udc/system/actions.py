@@ -1,5 +1,6 @@
 import subprocess
 import ckan.authz as authz
+import ckan.plugins as plugins
 from ckan.types import Context
 import ckan.logic as logic
 from ckan.types import Context
@@ -51,3 +52,40 @@ def get_system_stats(context: Context, data: dict) -> dict:
         "memory_usage": memory_usage,
         "disk_usage": disk_usage,
     }
+
+
+def _sparql_client(context: Context):
+    # Check admin
+    if not authz.is_sysadmin(context.get("user")):
+        raise logic.NotAuthorized(_("You are not authorized to view this page"))
+
+    udc_plugin = plugins.get_plugin("udc")
+    client = getattr(udc_plugin, "sparql_client", None)
+    if udc_plugin.disable_graphdb:
+        return None
+    return client
+
+
+@logic.side_effect_free
+def get_sparql_stats(context: Context, data: dict) -> dict:
+    """
+    Latency histograms of the GraphDB requests made by this CKAN process,
+    per query type (select/update/construct). See reset_sparql_stats to start over.
+    """
+    client = _sparql_client(context)
+    if client is None:
+        return {"enabled": False}
+    return {"enabled": True, **client.metrics.snapshot()}
+
+
+def reset_sparql_stats(context: Context, data: dict) -> dict:
+    """
+    Start the SPARQL latency histograms of this CKAN process over (POST only).
+    Returns the stats collected until now.
+    """
+    client = _sparql_client(context)
+    if client is None:
+        return {"enabled": False}
+    stats = client.metrics.snapshot()
+    client.metrics.reset()
+    return {"enabled": True, **stats}
@@ -0,0 +1,145 @@
+"""
+Tests for graph/template.py - CompiledTemplate, the cached form of the mapping template.
+
+`CompiledTemplate.render()` must give the same result as `compile_template()`;
+the benchmark compares the per-package cost of both on the example config.
+"""
+import json
+import sys
+import time
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+from pyld import jsonld
+
+from ckanext.udc.graph.template import CompiledTemplate, compile_template
+from ckanext.udc.graph.mapping_helpers import all_helpers
+from ckanext.udc.graph.ckan_field import prepare_data_dict
+
+CONFIG_PATH = Path(__file__).resolve().parents[2] / "config.example.json"
+# generate_uuid() mints a random URI on every call
+HELPERS = {**all_helpers, "generate_uuid": lambda key=None: f"uuid-{key}"}
+
+
+def _load_config():
+    with CONFIG_PATH.open("r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _text_fields(config):
+    return [
+        field["name"]
+        for level in config["maturity_model"]
+        for field in level["fields"]
+        if field.get("name") and field.get("type") in ("text", None)
+    ]
+
+
+def _package(config, n):
+    """A catalogue entry with every maturity model field filled in."""
+    package = {
+        "id": f"pkg-{n}",
+        "name": f"pkg-{n}",
+        "title_translated": {"en": f"Dataset {n}", "fr": f"Jeu de données {n}"},
+        "description_translated": {"en": "Housing starts by ward", "fr": "Mises en chantier"},
+        "tags_translated": {"en": ["housing", "ward"], "fr": ["logement"]},
+        "license_id": "odc-odbl",
+        "author": "City of Toronto",
+        "author_email": "open@toronto.ca",
+        "url": "https://open.toronto.ca/dataset/housing",
+        "version": "1.0",
+    }
+    for level in config["maturity_model"]:
+        for field in level["fields"]:
+            name, field_type = field.get("name"), field.get("type")
+            if not name:
+                continue
+            if field_type == "date":
+                package[name] = "2024-01-15"
+            elif field_type == "number":
+                package[name] = str(n + 42)
+            elif field_type in ("single_select", "multiple_select"):
+                package[name] = "yes"
+            elif field_type in ("text", None):
+                package[name] = f"{name} {n}"
+    return package
+
+
+@pytest.fixture(autouse=True)
+def mock_udc_plugin():
+    """Mock the UDC plugin for all tests."""
+    with patch('ckanext.udc.graph.template.get_plugin') as mock_get_plugin:
+        mock_plugin = Mock()
+        mock_plugin.text_fields = _text_fields(_load_config())
+        mock_get_plugin.return_value = mock_plugin
+        yield mock_plugin
+
+
+class TestCompiledTemplate:
+    """Test that the compiled template renders like compile_template()."""
+
+    @pytest.mark.parametrize("template, data", [
+        ({"@id": "http://example.org/{id}", "name": "{title}"}, {"id": "1", "title": "T"}),
+        ({"@id": "http://example.org/{id}", "name": "{missing}"}, {"id": "1"}),
+        ([{"@value": "eval(count)"}], {"count": ""}),
+        ({"p": [{"@value": "eval(to_integer(n))", "@type": "xsd:integer"}]}, {"n": "5"}),
+        ({"p": [{"@id": "eval(split_to_uris(uris))"}], "q": ["{a}", "{b}"]}, {"uris": "x,y", "a": "Alpha", "b": ""}),
+        ({"p": {"q": {"@value": "{empty}"}}}, {"empty": ""}),
+    ])
+    def test_matches_compile_template(self, template, data):
+        expected = compile_template(template, all_helpers, dict(data))
+        assert CompiledTemplate(template).render(all_helpers, dict(data)) == expected
+
+    def test_text_fields_map_to_multiple_languages(self, mock_udc_plugin):
+        mock_udc_plugin.text_fields = ["theme"]
+        template = {"p": [{"@value": "eval(theme)"}]}
+        data = {"theme": {"en": "Housing", "fr": "Logement"}}
+
+        result = CompiledTemplate(template).render(all_helpers, data)
+
+        assert result == compile_template(template, all_helpers, data)
+        assert result["p"] == [{"@language": "en", "@value": "Housing"},
+                               {"@language": "fr", "@value": "Logement"}]
+
+    def test_syntax_error_drops_the_attribute(self):
+        template = {"@id": "http://example.org/{id}", "bad": 'eval(id +)'}
+        compiled = CompiledTemplate(template)
+
+        for _ in range(2):
+            assert compiled.render(all_helpers, {"id": "1"}) == {"@id": "http://example.org/1"}
+
+    def test_example_config(self):
+        config = _load_config()
+        expanded = jsonld.expand(config["mappings"])
+        compiled = CompiledTemplate(expanded)
+
+        for n in range(3):
+            prepared = prepare_data_dict(_package(config, n))
+            assert compiled.render(HELPERS, prepared) == compile_template(expanded, HELPERS, prepared)
+
+
+@pytest.mark.benchmark
+class TestCompiledTemplateBenchmark:
+    """Micro-benchmark: per-package compile time of the example maturity model."""
+
+    def test_per_package_compile_time(self):
+        config = _load_config()
+        packages = [prepare_data_dict(_package(config, n)) for n in range(20)]
+
+        # Before: expand the mappings and interpret the template for every package
+        start = time.perf_counter()
+        for prepared in packages:
+            compile_template(jsonld.expand(config["mappings"]), all_helpers, prepared)
+        before = (time.perf_counter() - start) / len(packages)
+
+        # After: expand and compile once, then only evaluate the code objects
+        compiled = CompiledTemplate(jsonld.expand(config["mappings"]))
+        start = time.perf_counter()
+        for prepared in packages:
+            compiled.render(all_helpers, prepared)
+        after = (time.perf_counter() - start) / len(packages)
+
+        print(f"\nmapping compile per package: before {before * 1000:.2f} ms, "
+              f"after {after * 1000:.2f} ms ({before / after:.1f}x)", file=sys.stderr)
+        assert after < before
@@ -0,0 +1,189 @@
+"""
+Tests for graph/diff.py - batched knowledge graph diff for catalogue updates.
+
+A fake SPARQL client stands in for GraphDB: it answers the subgraph SELECT and
+the reference-count SELECT from an in-memory set of triples and records every
+request so the tests can assert on round trips.
+"""
+from rdflib import Graph, Literal, URIRef, RDF
+
+from ckanext.udc.graph.diff import (
+    build_subgraph_query,
+    build_update_query,
+    sync_catalogue_graph,
+    template_paths,
+)
+
+CUDR = "http://data.urbandatacentre.ca/"
+DCT = "http://purl.org/dc/terms/"
+FOAF = "http://xmlns.com/foaf/0.1/"
+CATALOGUE = URIRef(CUDR + "catalogue/pkg-1")
+
+MAPPINGS = [{
+    "@id": CUDR + "catalogue/{id}",
+    "@type": [CUDR + "catalogue"],
+    DCT + "title": [{"@value": "{title}"}],
+    DCT + "publisher": [{
+        "@id": CUDR + "publisher/{generate_uuid()}",
+        "@type": [FOAF + "Agent"],
+        FOAF + "name": [{"@value": "{publisher}"}],
+    }],
+    DCT + "license": [{"@id": "eval(mapFromCKANLicense(license_id))"}],
+}]
+
+
+def _term_binding(term):
+    if isinstance(term, URIRef):
+        return {"type": "uri", "value": str(term)}
+    binding = {"type": "literal", "value": str(term)}
+    if term.language:
+        binding["xml:lang"] = term.language
+    if term.datatype:
+        binding["datatype"] = str(term.datatype)
+    return binding
+
+
+class FakeClient:
+    """Answers the two diff queries from a triple set and records updates."""
+
+    def __init__(self, triples, ref_counts=None):
+        self.triples = set(triples)
+        self.ref_counts = ref_counts
+        self.queries = []
+        self.updates = []
+
+    def execute_sparql(self, query, method=None):
+        self.queries.append(query)
+        if method == "update":
+            self.updates.append(query)
+            return None
+        if "COUNT" in query:
+            counts = self.ref_counts
+            if counts is None:
+                counts = {}
+                for _, _, o in self.triples:
+                    counts[str(o)] = counts.get(str(o), 0) + 1
+            rows = [{"o": {"type": "uri", "value": uri}, "cnt": {"type": "literal", "value": str(cnt)}}
+                    for uri, cnt in counts.items() if f"<{uri}>" in query]
+            return {"results": {"bindings": rows}}
+        # Subgraph: catalogue triples and triples of the nodes it links to
+        linked = {o for s, p, o in self.triples if s == CATALOGUE and p != RDF.type}
+        rows = [{"s": _term_binding(s), "p": _term_binding(p), "o": _term_binding(o)}
+                for s, p, o in self.triples if s == CATALOGUE or s in linked]
+        return {"results": {"bindings": rows}}
+
+
+def _stored(publisher_uri, title="Housing", publisher="City"):
+    return {
+        (CATALOGUE, RDF.type, URIRef(CUDR + "catalogue")),
+        (CATALOGUE, URIRef(DCT + "title"), Literal(title)),
+        (CATALOGUE, URIRef(DCT + "publisher"), publisher_uri),
+        (publisher_uri, RDF.type, URIRef(FOAF + "Agent")),
+        (publisher_uri, URIRef(FOAF + "name"), Literal(publisher)),
+        (CATALOGUE, URIRef(DCT + "license"), URIRef("http://opendatacommons.org/licenses/odbl/")),
+    }
+
+
+def _graph(triples):
+    g = Graph()
+    for t in triples:
+        g.add(t)
+    return g
+
+
+class TestTemplatePaths:
+    """Test discovery of nested instance paths in the expanded template."""
+
+    def test_nested_and_minted_paths(self):
+        subject_paths, minted_paths = template_paths(MAPPINGS)
+        assert subject_paths == {(DCT + "publisher",)}
+        assert minted_paths == {(DCT + "publisher",)}
+
+    def test_value_objects_are_not_instances(self):
+        subject_paths, _ = template_paths([{DCT + "issued": [{"@type": "xsd:date", "@value": "{d}"}]}])
+        assert subject_paths == set()
+
+
+class TestSubgraphQuery:
+    """Test the batched subgraph SELECT."""
+
+    def test_query_has_one_branch_per_level(self):
+        query = build_subgraph_query(str(CATALOGUE), 2)
+        assert query.count("UNION") == 2
+        assert f"<{CATALOGUE}>" in query
+
+
+class TestSyncCatalogueGraph:
+    """Test the end-to-end diff against a fake GraphDB."""
+
+    def test_unchanged_catalogue_sends_no_update(self):
+        """A re-save with a freshly minted publisher URI is a no-op."""
+        client = FakeClient(_stored(URIRef(CUDR + "publisher/old")))
+        new_graph = _graph(_stored(URIRef(CUDR + "publisher/new")))
+
+        stats = sync_catalogue_graph(client, str(CATALOGUE), new_graph, MAPPINGS)
+
+        assert client.updates == []
+        assert stats["round_trips"] == 2
+        assert stats["deleted"] == 0 and stats["inserted"] == 0
+        assert stats["round_trips_saved"] == stats["legacy_round_trips"] - 2
+
+    def test_changed_literal_only_touches_that_triple(self):
+        client = FakeClient(_stored(URIRef(CUDR + "publisher/old")))
+        new_graph = _graph(_stored(URIRef(CUDR + "publisher/new"), title="Transit"))
+
+        stats = sync_catalogue_graph(client, str(CATALOGUE), new_graph, MAPPINGS)
+
+        assert len(client.updates) == 1
+        update = client.updates[0]
+        assert '"Housing"' in update and '"Transit"' in update
+        assert "publisher/new" not in update
+        assert stats["deleted"] == 1 and stats["inserted"] == 1
+        assert stats["round_trips"] == 3
+
+    def test_shared_instance_keeps_its_triples(self):
+        """An instance referenced by another catalogue is unlinked, not deleted."""
+        shared = URIRef(CUDR + "publisher/shared")
+        other = URIRef(CUDR + "catalogue/pkg-2")
+        client = FakeClient(_stored(shared) | {(other, URIRef(DCT + "publisher"), shared)})
+        new_graph = _graph(_stored(URIRef(CUDR + "publisher/new"), publisher="Province"))
+
+        sync_catalogue_graph(client, str(CATALOGUE), new_graph, MAPPINGS)
+
+        update = client.updates[0]
+        delete_part = update.split("INSERT DATA")[0]
+        assert f"<{CATALOGUE}> <{DCT}publisher> <{shared}>" in delete_part
+        assert f"<{shared}> <{FOAF}name>" not in delete_part
+        assert f"<{CUDR}publisher/new>" in update.split("INSERT DATA")[1]
+
+    def test_delete_removes_owned_instances(self):
+        publisher = URIRef(CUDR + "publisher/old")
+        client = FakeClient(_stored(publisher))
+
+        stats = sync_catalogue_graph(client, str(CATALOGUE), None, MAPPINGS)
+
+        assert len(client.updates) == 1
+        assert "INSERT DATA" not in client.updates[0]
+        assert stats["deleted"] == len(_stored(publisher))
+
+
+class TestBuildUpdateQuery:
+    """Test serialization of the single update request."""
+
+    def test_nothing_to_do(self):
+        assert build_update_query(set(), set(), set()) is None
+
+    def test_update_is_valid_sparql(self):
+        """Quotes and newlines in literals must survive serialization."""
+        title = Literal('a "quoted"\ntitle"', lang="en")
+        publisher = URIRef(CUDR + "publisher/old")
+        query = build_update_query(
+            {(CATALOGUE, URIRef(DCT + "title"), Literal("old"))},
+            {(CATALOGUE, URIRef(DCT + "title"), title)},
+            {(publisher, URIRef(FOAF + "name"))},
+        )
+
+        g = Graph()
+        g.add((CATALOGUE, URIRef(DCT + "title"), Literal("old")))
+        g.update(query)
+        assert list(g.objects(CATALOGUE, URIRef(DCT + "title"))) == [title]
@@ -0,0 +1,93 @@
+"""
+Tests for graph/export_cache.py and the cached catalogue graph export in graph/logic.py.
+"""
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.udc.graph import logic as graph_logic
+from ckanext.udc.graph import sync as graph_sync
+from ckanext.udc.graph.export_cache import LRUSizeCache
+
+
+class TestLRUSizeCache:
+    """Test the size-capped LRU cache."""
+
+    def test_evicts_least_recently_used_over_size_cap(self):
+        cache = LRUSizeCache(max_bytes=10)
+        cache.set("a", "aaaa", 4)
+        cache.set("b", "bbbb", 4)
+        cache.get("a")
+        cache.set("c", "cccc", 4)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == "aaaa" and cache.get("c") == "cccc"
+        assert cache.size == 8
+
+    def test_oversized_value_is_not_cached(self):
+        cache = LRUSizeCache(max_bytes=10)
+        cache.set("a", "x" * 11, 11)
+
+        assert cache.get("a") is None
+        assert cache.size == 0
+
+    def test_entries_expire(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr("ckanext.udc.graph.export_cache.time.monotonic", lambda: now[0])
+        cache = LRUSizeCache(max_bytes=10, ttl=60)
+        cache.set("a", "aaaa", 4)
+
+        now[0] += 61
+
+        assert cache.get("a") is None
+        assert cache.stats()["entries"] == 0
+
+
+class TestCatalogueGraphExport:
+    """Test that exports are served from the cache until the package changes."""
+
+    @pytest.fixture
+    def export_env(self, monkeypatch):
+        env = SimpleNamespace(
+            package=SimpleNamespace(id="pkg-1", metadata_modified=datetime.datetime(2024, 1, 1)),
+            pending=None,
+            builds=[],
+            cache=LRUSizeCache(max_bytes=1024),
+        )
+
+        def build(package_id, format):
+            env.builds.append((package_id, format))
+            return f"graph {len(env.builds)}"
+
+        monkeypatch.setattr(graph_logic.model.Package, "get", lambda ref: env.package)
+        monkeypatch.setattr(graph_logic.GraphSyncOutbox, "get", lambda package_id: env.pending)
+        monkeypatch.setattr(graph_sync, "is_async_sync", lambda: True)
+        monkeypatch.setattr(graph_logic, "get_graph_export_cache", lambda: env.cache)
+        monkeypatch.setattr(graph_logic, "_build_catalogue_graph", build)
+        return env
+
+    def test_second_request_is_cached(self, export_env):
+        first = graph_logic.get_catalogue_graph_export("pkg-1", "turtle")
+        second = graph_logic.get_catalogue_graph_export("pkg-1", "turtle")
+
+        assert first == second
+        assert first["last_modified"] == export_env.package.metadata_modified
+        assert len(export_env.builds) == 1
+
+    def test_formats_and_modifications_are_separate_entries(self, export_env):
+        ttl = graph_logic.get_catalogue_graph_export("pkg-1", "turtle")
+        graph_logic.get_catalogue_graph_export("pkg-1", "nt")
+        export_env.package.metadata_modified = datetime.datetime(2024, 2, 1)
+        changed = graph_logic.get_catalogue_graph_export("pkg-1", "turtle")
+
+        assert len(export_env.builds) == 3
+        assert changed["etag"] != ttl["etag"]
+
+    def test_pending_sync_is_not_cached(self, export_env):
+        export_env.pending = object()
+
+        graph_logic.get_catalogue_graph_export("pkg-1", "turtle")
+        graph_logic.get_catalogue_graph_export("pkg-1", "turtle")
+
+        assert len(export_env.builds) == 2
@@ -0,0 +1,143 @@
+"""
+Tests for graph/rebuild.py - bulk rebuild of the knowledge graph.
+
+The staging graph inserts are applied to an in-memory rdflib Dataset.
+"""
+import pytest
+from rdflib import Dataset, Literal, URIRef
+
+from ckanext.udc.graph import rebuild
+from ckanext.udc.graph.rebuild import (
+    BACKUP_GRAPH,
+    STAGING_GRAPH,
+    build_insert_query,
+    build_swap_query,
+    compile_packages_to_ntriples,
+    load_checkpoint,
+    save_checkpoint,
+)
+from ckanext.udc.graph.template import CompiledTemplate
+
+DCT_TITLE = URIRef("http://purl.org/dc/terms/title")
+TEMPLATE = [{
+    "@id": "http://data.urbandatacentre.ca/catalogue/{id}",
+    "@type": ["http://data.urbandatacentre.ca/catalogue"],
+    "http://purl.org/dc/terms/title": [{"@value": "{title}"}],
+}]
+
+
+class TestCompilePackages:
+    """Test turning package dicts into N-Triples."""
+
+    def test_packages_become_ntriples(self):
+        template = CompiledTemplate(TEMPLATE, text_fields=[])
+        ntriples, triples, failed = compile_packages_to_ntriples(
+            template, [{"id": "a", "title": "Housing"}, {"id": "b", "title": "Transit"}])
+
+        assert failed == []
+        assert triples == 4
+        assert '<http://data.urbandatacentre.ca/catalogue/a> <http://purl.org/dc/terms/title> "Housing" .' in ntriples
+
+    def test_failing_package_is_reported(self):
+        template = CompiledTemplate([{"@id": "{missing}"}, "{missing}"], text_fields=[])
+        _, triples, failed = compile_packages_to_ntriples(template, [{"id": "a"}])
+
+        assert triples == 0
+        assert [package_id for package_id, _ in failed] == ["a"]
+
+
+class TestSwap:
+    """Test the staging graph load and the swap."""
+
+    def test_chunk_is_inserted_into_staging_graph(self):
+        ds = Dataset(default_union=False)
+        template = CompiledTemplate(TEMPLATE, text_fields=[])
+        ntriples, _, _ = compile_packages_to_ntriples(template, [{"id": "new", "title": 'A "New" one'}])
+
+        ds.update(build_insert_query(STAGING_GRAPH, ntriples))
+
+        assert len(ds.default_context) == 0
+        assert set(ds.graph(URIRef(STAGING_GRAPH)).objects(None, DCT_TITLE)) == {Literal('A "New" one')}
+
+    def test_swap_is_one_request_keeping_a_backup(self):
+        query = build_swap_query(STAGING_GRAPH, BACKUP_GRAPH)
+        operations = query.split(" ;\n")
+
+        assert operations == [
+            f"COPY SILENT DEFAULT TO GRAPH <{BACKUP_GRAPH}>",
+            f"MOVE GRAPH <{STAGING_GRAPH}> TO DEFAULT",
+        ]
+        assert build_swap_query(STAGING_GRAPH) == operations[1]
+
+
+class TestCheckpoint:
+    """Test the checkpoint file."""
+
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / "rebuild.json")
+        assert load_checkpoint(path) is None
+
+        save_checkpoint(path, {"last_id": "abc", "packages": 10})
+
+        assert load_checkpoint(path) == {"last_id": "abc", "packages": 10}
+
+
+class RecordingClient:
+    def __init__(self, staging_triples=True):
+        self.staging_triples = staging_triples
+        self.updates = []
+
+    def execute_sparql(self, query, method=None):
+        if query.startswith("ASK"):
+            return {"boolean": self.staging_triples}
+        self.updates.append(query)
+
+
+class TestRebuildGraph:
+    """Test the swap step and resuming around it."""
+
+    @pytest.fixture
+    def rebuild_env(self, monkeypatch):
+        requeued = []
+        monkeypatch.setattr(rebuild, "_load_staging", lambda client, state, *args: 0)
+        monkeypatch.setattr(rebuild, "requeue_changed_packages",
+                            lambda since, failed: requeued.append(since) or 0)
+        return requeued
+
+    def test_swap_is_recorded_before_requeueing(self, tmp_path, rebuild_env, monkeypatch):
+        path = str(tmp_path / "rebuild.json")
+        client = RecordingClient()
+
+        def interrupted(since, failed):
+            raise RuntimeError("worker killed")
+        monkeypatch.setattr(rebuild, "requeue_changed_packages", interrupted)
+
+        with pytest.raises(RuntimeError):
+            rebuild.rebuild_graph(client, path, backup=False)
+
+        assert client.updates[-1] == build_swap_query(STAGING_GRAPH)
+        assert load_checkpoint(path)["swapped"] is True
+
+    def test_resume_after_swap_only_requeues(self, tmp_path, rebuild_env):
+        path = str(tmp_path / "rebuild.json")
+        save_checkpoint(path, {"started_at": "2024-01-01T00:00:00", "last_id": "z", "packages": 3,
+                               "triples": 9, "failed": [], "swapped": True})
+        client = RecordingClient(staging_triples=False)
+
+        result = rebuild.rebuild_graph(client, path, resume=True)
+
+        assert client.updates == []
+        assert rebuild_env == ["2024-01-01T00:00:00"]
+        assert load_checkpoint(path) is None
+        assert result["packages"] == 3
+
+    def test_empty_staging_graph_is_not_swapped(self, tmp_path, rebuild_env):
+        path = str(tmp_path / "rebuild.json")
+        client = RecordingClient(staging_triples=False)
+
+        with pytest.raises(RuntimeError, match="no triples"):
+            rebuild.rebuild_graph(client, path)
+
+        assert not any("MOVE GRAPH" in query for query in client.updates)
+        assert rebuild_env == []
+        assert load_checkpoint(path)["swapped"] is False
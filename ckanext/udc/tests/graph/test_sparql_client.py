@@ -0,0 +1,157 @@
+"""
+Tests for graph/sparql_client.py - thread-safe pooled SPARQL client.
+
+The HTTP session is replaced by a fake that echoes the posted query back, so
+concurrent requests can be checked for cross-talk without a GraphDB server.
+"""
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.udc.graph.sparql_client import SparqlClient, SparqlMetrics, sparql_client_options
+from ckanext.udc.system import actions as system_actions
+
+
+class EchoSession:
+    """Answers every request with the query it received."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.timeouts = set()
+
+    def request(self, method, url, data=None, headers=None, auth=None, timeout=None, params=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.timeouts.add(timeout)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        query = urllib.parse.unquote(data.split("&")[0].split("=", 1)[1])
+        return SimpleNamespace(status_code=200, text=query, json=lambda: {"query": query})
+
+
+def _client(session, **options):
+    client = SparqlClient("http://graphdb/repositories/udc", **options)
+    for wrapper in (client.query_client, client.update_client, client.graph_client):
+        wrapper.session = session
+    return client
+
+
+class TestSparqlClient:
+    """Test concurrency and timeouts."""
+
+    def test_concurrent_queries_do_not_share_state(self):
+        client = _client(EchoSession(delay=0.005))
+        queries = [f"SELECT * WHERE {{ ?s ?p {n} }}" for n in range(40)]
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda q: client.execute_sparql(q)["query"], queries))
+
+        assert results == queries
+
+    def test_in_flight_queries_are_limited(self):
+        session = EchoSession(delay=0.01)
+        client = _client(session, max_concurrent_queries=3)
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            list(pool.map(lambda n: client.execute_sparql("SELECT * WHERE { ?s ?p ?o }"), range(30)))
+
+        assert session.max_in_flight <= 3
+        assert client.metrics.snapshot()["max_in_flight"] <= 3
+
+    def test_timeouts_are_passed_to_requests(self):
+        session = EchoSession()
+        client = _client(session, connect_timeout=2, read_timeout=30)
+
+        client.execute_sparql("SELECT * WHERE { ?s ?p ?o }")
+
+        assert session.timeouts == {(2, 30)}
+
+    def test_options_from_config(self):
+        options = sparql_client_options({"udc.sparql.max_concurrent_queries": "4", "udc.sparql.read_timeout": "15"})
+
+        assert options["max_concurrent_queries"] == 4
+        assert options["read_timeout"] == 15.0
+
+
+class TestSparqlMetrics:
+    """Test the per query type latency histograms."""
+
+    def test_metrics_per_query_type(self):
+        client = _client(EchoSession())
+
+        client.execute_sparql("SELECT * WHERE { ?s ?p ?o }")
+        client.execute_sparql("INSERT DATA { <a:b> <a:c> <a:d> }")
+        client.execute_sparql("CONSTRUCT { ?s ?p ?o } WHERE { ?s ?p ?o }")
+
+        snapshot = client.metrics.snapshot()
+        assert set(snapshot["query_types"]) == {"select", "update", "construct"}
+        assert all(stats["count"] == 1 for stats in snapshot["query_types"].values())
+        assert snapshot["in_flight"] == 0
+
+    def test_errors_are_counted(self):
+        client = _client(SimpleNamespace(request=lambda *args, **kwargs: SimpleNamespace(status_code=500, text="down")))
+
+        with pytest.raises(ValueError):
+            client.execute_sparql("SELECT * WHERE { ?s ?p ?o }")
+
+        assert client.metrics.snapshot()["query_types"]["select"]["errors"] == 1
+
+    def test_histogram_buckets(self):
+        metrics = SparqlMetrics()
+        for seconds in (0.001, 0.2, 60):
+            metrics.started()
+            metrics.finished("select", seconds)
+
+        histogram = metrics.snapshot()["query_types"]["select"]["histogram"]
+        assert histogram["<=5ms"] == 1
+        assert histogram["<=250ms"] == 1
+        assert histogram[">30000ms"] == 1
+
+    def test_reset_keeps_requests_in_flight(self):
+        metrics = SparqlMetrics()
+        metrics.started()
+        metrics.started()
+        metrics.finished("select", 0.01)
+
+        metrics.reset()
+        assert metrics.snapshot() == {"in_flight": 1, "max_in_flight": 1, "query_types": {}}
+
+        metrics.finished("select", 0.01)
+        assert metrics.snapshot()["in_flight"] == 0
+
+
+class TestSparqlStatsActions:
+    """Test that reading the stats never resets them."""
+
+    @pytest.fixture
+    def metrics(self, monkeypatch):
+        metrics = SparqlMetrics()
+        metrics.started()
+        metrics.finished("select", 0.01)
+        plugin = SimpleNamespace(disable_graphdb=False, sparql_client=SimpleNamespace(metrics=metrics))
+        monkeypatch.setattr(system_actions.authz, "is_sysadmin", lambda user: True)
+        monkeypatch.setattr(system_actions.plugins, "get_plugin", lambda name: plugin)
+        return metrics
+
+    def test_get_is_read_only(self, metrics):
+        stats = system_actions.get_sparql_stats({"user": "admin"}, {"reset": "true"})
+
+        assert stats["query_types"]["select"]["count"] == 1
+        assert metrics.snapshot()["query_types"]["select"]["count"] == 1
+
+    def test_reset_is_a_post_only_action(self, metrics):
+        stats = system_actions.reset_sparql_stats({"user": "admin"}, {})
+
+        assert stats["query_types"]["select"]["count"] == 1
+        assert metrics.snapshot()["query_types"] == {}
+        assert getattr(system_actions.get_sparql_stats, "side_effect_free", False)
+        assert not getattr(system_actions.reset_sparql_stats, "side_effect_free", False)
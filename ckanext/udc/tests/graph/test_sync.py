@@ -0,0 +1,258 @@
+"""
+Tests for graph/sync.py - the queued knowledge graph sync worker.
+
+The outbox bookkeeping (`_finish` / `_fail`) and the GraphDB client are
+replaced with recorders so the batching and retry logic can be tested without
+a database or a triple store.
+"""
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from rdflib import Graph, Literal, URIRef, RDF
+
+from ckanext.udc.graph import sync
+from ckanext.udc.graph.diff import sync_catalogue_graph
+
+
+class RecordingClient:
+    def __init__(self, fail_on=()):
+        self.fail_on = fail_on
+        self.updates = []
+
+    def execute_sparql(self, query, method=None):
+        if any(marker in query for marker in self.fail_on):
+            raise RuntimeError("rejected")
+        self.updates.append(query)
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    state = SimpleNamespace(client=RecordingClient(), finished=[], failed=[])
+    monkeypatch.setattr(sync, "get_client", lambda: state.client)
+    monkeypatch.setattr(sync, "_prepare", lambda context, pid, op: {"update_query": f"INSERT DATA {{ {pid} }}"})
+    monkeypatch.setattr(sync, "_finish", lambda pid, version: state.finished.append((pid, version)))
+    monkeypatch.setattr(sync, "_fail", lambda pid, version, attempts, e: state.failed.append((pid, attempts)))
+    monkeypatch.setattr(sync.model.Session, "commit", lambda: None)
+    return state
+
+
+class TestSyncBatch:
+    """Test applying a claimed batch."""
+
+    def test_batch_is_sent_in_one_request(self, worker):
+        result = sync.sync_batch({}, [("a", "update", 1, 0), ("b", "delete", 3, 0)])
+
+        assert len(worker.client.updates) == 1
+        assert "{ a }" in worker.client.updates[0] and "{ b }" in worker.client.updates[0]
+        assert worker.finished == [("a", 1), ("b", 3)]
+        assert result == {"synced": 2, "failed": 0}
+
+    def test_failing_package_does_not_block_the_batch(self, worker):
+        worker.client = RecordingClient(fail_on=["{ b }"])
+
+        result = sync.sync_batch({}, [("a", "update", 1, 0), ("b", "update", 1, 2)])
+
+        assert worker.finished == [("a", 1)]
+        assert worker.failed == [("b", 2)]
+        assert result == {"synced": 1, "failed": 1}
+
+
+class TestDeleteCatalogues:
+    """Test removing the catalogues of packages deleted in bulk."""
+
+    @pytest.fixture
+    def queued(self, worker, monkeypatch):
+        queued = []
+        monkeypatch.setattr(sync, "enqueue_graph_sync", lambda context, pid, op: queued.append((pid, op)))
+        return queued
+
+    def test_deletes_are_sent_in_one_request(self, worker, queued):
+        result = sync.delete_catalogues({}, ["a", "b", "c"])
+
+        assert len(worker.client.updates) == 1
+        assert all(f"{{ {pid} }}" in worker.client.updates[0] for pid in "abc")
+        assert queued == []
+        assert result == {"deleted": 3, "queued": 0}
+
+    def test_failed_request_queues_the_packages(self, worker, queued):
+        worker.client = RecordingClient(fail_on=["{ b }"])
+
+        result = sync.delete_catalogues({}, ["a", "b"])
+
+        assert queued == [("a", "delete"), ("b", "delete")]
+        assert result == {"deleted": 0, "queued": 2}
+
+
+CUDR = "http://data.urbandatacentre.ca/"
+DCT = "http://purl.org/dc/terms/"
+FOAF = "http://xmlns.com/foaf/0.1/"
+SHARED = URIRef(CUDR + "publisher/shared")
+MAPPINGS = [{
+    "@id": CUDR + "catalogue/{id}",
+    "@type": [CUDR + "catalogue"],
+    DCT + "title": [{"@value": "{title}"}],
+    DCT + "publisher": [{
+        "@id": CUDR + "publisher/{generate_uuid()}",
+        "@type": [FOAF + "Agent"],
+        FOAF + "name": [{"@value": "{publisher}"}],
+    }],
+}]
+
+
+class GraphClient:
+    """GraphDB stand-in: runs the queries against an in-memory rdflib graph."""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def execute_sparql(self, query, method=None):
+        if method == "update":
+            self.graph.update(query)
+            return None
+        result = self.graph.query(query)
+        rows = []
+        for row in result:
+            binding = {}
+            for var in result.vars:
+                term = row[var]
+                if term is not None:
+                    kind = "uri" if isinstance(term, URIRef) else "literal"
+                    binding[str(var)] = {"type": kind, "value": str(term)}
+            rows.append(binding)
+        return {"results": {"bindings": rows}}
+
+
+def _catalogue(graph, package_id, publisher=SHARED, name="City"):
+    catalogue = URIRef(CUDR + "catalogue/" + package_id)
+    graph.add((catalogue, RDF.type, URIRef(CUDR + "catalogue")))
+    graph.add((catalogue, URIRef(DCT + "title"), Literal(package_id)))
+    graph.add((catalogue, URIRef(DCT + "publisher"), publisher))
+    graph.add((publisher, RDF.type, URIRef(FOAF + "Agent")))
+    graph.add((publisher, URIRef(FOAF + "name"), Literal(name)))
+    return graph
+
+
+@pytest.fixture
+def graphdb(worker, monkeypatch):
+    graph = Graph()
+    worker.client = GraphClient(graph)
+
+    def prepare(context, package_id, operation):
+        new_graph = None
+        if operation == "update":
+            # Moved to a publisher of its own
+            new_graph = _catalogue(Graph(), package_id, URIRef(CUDR + "publisher/" + package_id), "Province")
+        return sync_catalogue_graph(worker.client, CUDR + "catalogue/" + package_id, new_graph, MAPPINGS,
+                                    apply=False)
+    monkeypatch.setattr(sync, "_prepare", prepare)
+    monkeypatch.setattr(sync, "enqueue_graph_sync", lambda context, pid, op: None)
+    return graph
+
+
+class TestSharedInstances:
+    """Test instances shared by several catalogues of one batch."""
+
+    def test_delete_removes_an_instance_shared_only_by_the_batch(self, graphdb):
+        _catalogue(graphdb, "a")
+        _catalogue(graphdb, "b")
+
+        sync.delete_catalogues({}, ["a", "b"])
+
+        assert len(graphdb) == 0
+
+    def test_delete_keeps_an_instance_still_referenced(self, graphdb):
+        for package_id in "abc":
+            _catalogue(graphdb, package_id)
+
+        sync.delete_catalogues({}, ["a", "b"])
+
+        assert (SHARED, URIRef(FOAF + "name"), Literal("City")) in graphdb
+        assert set(graphdb.subjects(URIRef(DCT + "publisher"), SHARED)) == {URIRef(CUDR + "catalogue/c")}
+
+    def test_queued_batch_removes_an_instance_it_released(self, graphdb):
+        _catalogue(graphdb, "a")
+        _catalogue(graphdb, "b")
+
+        result = sync.sync_batch({}, [("a", "delete", 1, 0), ("b", "update", 1, 0)])
+
+        assert result == {"synced": 2, "failed": 0}
+        assert (SHARED, None, None) not in graphdb
+        assert set(graphdb.objects(URIRef(CUDR + "catalogue/b"), URIRef(DCT + "publisher"))) == {
+            URIRef(CUDR + "publisher/b")
+        }
+
+
+class TestRetryDelay:
+    """Test the exponential backoff."""
+
+    def test_backoff_doubles_and_is_capped(self, monkeypatch):
+        monkeypatch.setattr(sync.tk, "config", {"udc.sparql.sync_max_backoff": "60"})
+
+        delays = [sync._retry_delay(n) for n in range(1, 6)]
+
+        assert delays[:3] == [datetime.timedelta(seconds=s) for s in (10, 20, 40)]
+        assert delays[3] == delays[4] == datetime.timedelta(seconds=60)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value = self.values.get(key)
+        return None if value is None else str(value).encode()
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class TestScheduling:
+    """Test that delayed retries and fresh saves are scheduled independently."""
+
+    @pytest.fixture
+    def queue(self, monkeypatch):
+        state = SimpleNamespace(redis=FakeRedis(), now=[], retries=[])
+        monkeypatch.setattr(sync, "connect_to_redis", lambda: state.redis)
+        monkeypatch.setattr(sync.jobs, "enqueue", lambda fn, title=None: state.now.append(fn))
+        monkeypatch.setattr(sync, "_enqueue_retry", lambda delay, due: state.retries.append(delay))
+        return state
+
+    def test_pending_retry_does_not_block_a_save(self, queue):
+        sync.schedule_graph_sync_job(datetime.timedelta(seconds=600))
+        sync.schedule_graph_sync_job()
+        sync.schedule_graph_sync_job()
+
+        assert queue.retries == [datetime.timedelta(seconds=600)]
+        assert len(queue.now) == 1
+
+    def test_deferred_commit_schedules_after_the_commit(self, queue, monkeypatch):
+        session = SimpleNamespace(info={}, execute=lambda stmt: None)
+        monkeypatch.setattr(sync.model, "Session", session)
+
+        sync.enqueue_graph_sync({"defer_commit": True}, "a", "update")
+        assert queue.now == []
+
+        sync._schedule_after_commit(session)
+        sync._schedule_after_commit(session)
+        assert len(queue.now) == 1
+
+    def test_rollback_cancels_the_scheduling(self, queue):
+        session = SimpleNamespace(info={sync.SCHEDULE_ON_COMMIT: True})
+
+        sync._cancel_scheduling(session)
+        sync._schedule_after_commit(session)
+
+        assert queue.now == []
+
+    def test_only_a_sooner_retry_is_scheduled_again(self, queue):
+        for seconds in (600, 900, 60):
+            sync.schedule_graph_sync_job(datetime.timedelta(seconds=seconds))
+
+        assert queue.retries == [datetime.timedelta(seconds=s) for s in (600, 60)]
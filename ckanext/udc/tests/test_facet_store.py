@@ -0,0 +1,202 @@
+"""
+Tests for search/facet_store.py - facet counts maintained from the package hooks.
+"""
+import random
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.udc.search import facet_store
+from ckanext.udc.search.logic import actions as facet_actions
+from ckanext.udc.search.logic import utils as cache_utils
+from ckanext.udc.solr import config as solr_config
+from ckanext.udc.solr import index as solr_index
+
+FIELDS = ["tags_en_f", "tags_fr_f", "theme_en_f", "extras_access_category", "organization", "res_format"]
+
+
+class DummyConfig:
+    def __init__(self, values):
+        self._values = values
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+
+@pytest.fixture(autouse=True)
+def udc_plugin(monkeypatch):
+    monkeypatch.setattr(solr_config, "config", DummyConfig({"ckan.locale_default": "en",
+                                                            "udc.multilingual.languages": "en fr"}))
+    plugin = SimpleNamespace(multiple_select_fields=["access_category"], text_fields=["theme"],
+                             dropdown_options={})
+    monkeypatch.setattr(solr_index.plugins, "get_plugin", lambda name: plugin)
+    return plugin
+
+
+def _package(**overrides):
+    pkg = {
+        "id": "pkg-1",
+        "state": "active",
+        "private": False,
+        "title": "Housing starts",
+        "tags": [{"name": "housing"}, {"name": "starts"}],
+        "organization": {"name": "city"},
+        "resources": [{"format": "CSV"}, {"format": "CSV"}],
+        "extras": [
+            {"key": "theme", "value": '{"en": "Housing", "fr": "Logement"}'},
+            {"key": "access_category", "value": "open,restricted"},
+        ],
+    }
+    pkg.update(overrides)
+    return pkg
+
+
+class TestPackageFacetValues:
+    """Test the facet values a package contributes."""
+
+    def test_values_match_the_index_document(self):
+        values = facet_store.package_facet_values(_package(), FIELDS)
+
+        assert values == {
+            "tags_en_f": ["housing", "starts"],
+            "theme_en_f": ["Housing"],
+            "extras_access_category": ["open", "restricted"],
+            "organization": ["city"],
+            "res_format": ["CSV"],
+        }
+
+    @pytest.mark.parametrize("overrides", [{"private": True}, {"state": "deleted"}, {"state": "draft"}])
+    def test_only_public_active_packages_count(self, overrides):
+        assert facet_store.package_facet_values(_package(**overrides), FIELDS) == {}
+
+
+class TestFacetDeltas:
+    """Test that applying the deltas of each change gives the counts of a full rebuild."""
+
+    def test_deltas(self):
+        old = {"tags_en_f": ["housing", "starts"], "organization": ["city"]}
+        new = {"tags_en_f": ["housing", "permits"]}
+
+        assert facet_store.facet_deltas(old, new) == {
+            ("tags_en_f", "permits"): 1,
+            ("tags_en_f", "starts"): -1,
+            ("organization", "city"): -1,
+        }
+        assert facet_store.facet_deltas(new, new) == {}
+
+    def test_incremental_counts_equal_rebuild(self):
+        rng = random.Random(7)
+        vocabulary = [f"tag{n}" for n in range(15)]
+        stored = {}
+        counts = Counter()
+        for _ in range(500):
+            package_id = f"pkg-{rng.randrange(40)}"
+            if rng.random() < 0.15:
+                new = {}
+            else:
+                new = {"tags_en_f": sorted(set(rng.sample(vocabulary, rng.randrange(4))))}
+            counts.update(facet_store.facet_deltas(stored.get(package_id, {}), new))
+            stored[package_id] = new
+
+        rebuilt = Counter((f, v) for values in stored.values() for f, vs in values.items() for v in vs)
+        assert +counts == rebuilt
+
+    def test_removal_deltas_match_deleting_one_by_one(self):
+        stored = [
+            {"tags_en_f": ["housing", "starts"], "organization": ["city"]},
+            {"tags_en_f": ["housing"], "organization": ["city"]},
+            {},
+        ]
+
+        one_by_one = Counter()
+        for values in stored:
+            one_by_one.update(facet_store.facet_deltas(values, {}))
+
+        assert facet_store.removal_deltas(stored) == dict(one_by_one) == {
+            ("tags_en_f", "housing"): -2,
+            ("tags_en_f", "starts"): -1,
+            ("organization", "city"): -2,
+        }
+
+
+class TestPurgedPackages:
+    """Test taking a purged package out of the counts."""
+
+    @pytest.fixture
+    def savepoint(self, monkeypatch):
+        state = SimpleNamespace(savepoints=0, removed=[])
+
+        class Savepoint:
+            def __enter__(self):
+                state.savepoints += 1
+
+            def __exit__(self, *exc):
+                return False
+
+        monkeypatch.setattr(facet_store, "get_facet_store_state", lambda: {"status": "built", "fields": FIELDS})
+        monkeypatch.setattr(facet_store.model, "Session", SimpleNamespace(begin_nested=Savepoint))
+        monkeypatch.setattr(facet_store, "remove_packages_facet_values", state.removed.append)
+        return state
+
+    def test_purged_package_is_removed_in_a_savepoint(self, savepoint):
+        facet_store.remove_package_facets("pkg-1")
+
+        assert savepoint.removed == [["pkg-1"]]
+        assert savepoint.savepoints == 1
+
+    def test_failure_does_not_fail_the_purge(self, savepoint, monkeypatch):
+        def fail(package_ids):
+            raise RuntimeError("lock timeout")
+        monkeypatch.setattr(facet_store, "remove_packages_facet_values", fail)
+
+        facet_store.remove_package_facets("pkg-1")
+
+
+class TestStoreFacets:
+    """Test serving the facet payload from the store."""
+
+    def test_search_facets_format(self):
+        facets = facet_store.build_search_facets({"tags_en_f": {"housing": 3, "transit": 5}, "res_format": {}})
+
+        assert facets == {
+            "tags_en_f": {"title": "tags_en_f", "items": [
+                {"name": "transit", "display_name": "transit", "count": 5},
+                {"name": "housing", "display_name": "housing", "count": 3},
+            ]},
+            "res_format": {"title": "res_format", "items": []},
+        }
+
+    @pytest.mark.parametrize("state", [
+        None,
+        {"status": "building", "fields": FIELDS},
+        {"status": "built", "fields": ["tags_en_f"]},
+    ])
+    def test_store_does_not_answer_until_built_with_all_fields(self, monkeypatch, state):
+        monkeypatch.setattr(facet_store, "get_facet_store_state", lambda: state)
+
+        assert facet_store.get_store_facets(["tags_en_f", "organization"]) is None
+
+    def test_filter_facets_get_does_not_query_solr(self, monkeypatch):
+        monkeypatch.setattr(cache_utils, "_get_cache_redis", lambda: None)
+        cache_utils.invalidate_cache("filter_facets")
+        monkeypatch.setattr(facet_actions, "filter_facet_aliases",
+                            lambda lang: OrderedDict([("tags", f"tags_{lang}_f"), ("theme", f"theme_{lang}_f")]))
+        requested = []
+
+        def store(fields):
+            requested.append(fields)
+            return facet_store.build_search_facets({field: {"housing": 2} for field in fields})
+
+        def no_solr(name):
+            raise AssertionError(f"{name} called")
+
+        monkeypatch.setattr(facet_actions, "get_store_facets", store)
+        monkeypatch.setattr(facet_actions.logic, "get_action", no_solr)
+
+        facets = facet_actions._filter_facets_get({"lang": "fr"})
+        cache_utils.invalidate_cache("filter_facets")
+
+        assert requested == [["tags_fr_f", "theme_fr_f"]]
+        assert set(facets) == {"tags", "theme"}
+        assert facets["theme"]["items"][0]["count"] == 2
@@ -0,0 +1,152 @@
+"""
+Tests for organization/bulk.py - set-based removal of an organization's packages.
+
+The SQL statements, Solr and GraphDB are replaced with recorders so the
+batching, the single delete-by-query and the interrupted purge can be tested
+without a database.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.udc.organization import bulk
+
+ORG_ID = "org-1"
+
+
+class FakeQuery:
+    def __init__(self, session):
+        self.session = session
+
+    def filter(self, *criteria):
+        return self
+
+    def update(self, values, synchronize_session=None):
+        self.session.statements.append(("update", values))
+
+    def delete(self, synchronize_session=None):
+        self.session.statements.append(("delete",))
+
+
+class FakeSession:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+        self.statements = []
+
+    def query(self, *entities):
+        return FakeQuery(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def org(monkeypatch):
+    state = SimpleNamespace(
+        package_ids=[f"pkg-{n:02}" for n in range(7)],
+        purged_chunks=[],
+        graph_chunks=[],
+        index_deletes=[],
+        fail_on=None,
+        session=FakeSession(),
+        invalidated=0,
+    )
+
+    def package_ids(organization_id, package_ids=None):
+        remaining = [pid for pid in state.package_ids if pid not in sum(state.purged_chunks, [])]
+        return remaining if package_ids is None else [pid for pid in remaining if pid in package_ids]
+
+    def purge_rows(chunk):
+        if state.fail_on in chunk:
+            raise RuntimeError("database error")
+        state.purged_chunks.append(list(chunk))
+
+    def invalidate():
+        state.invalidated += 1
+
+    monkeypatch.setattr(bulk.model, "Session", state.session)
+    monkeypatch.setattr(bulk, "organization_package_ids", package_ids)
+    monkeypatch.setattr(bulk, "_purge_rows", purge_rows)
+    monkeypatch.setattr(bulk, "remove_packages_facet_values", lambda chunk: None)
+    monkeypatch.setattr(bulk, "_graphdb_enabled", lambda: True)
+    monkeypatch.setattr(bulk, "delete_catalogues", lambda context, chunk: (
+        state.graph_chunks.append(list(chunk)) or {"deleted": len(chunk), "queued": 0}))
+    monkeypatch.setattr(bulk, "_delete_from_index", lambda org_id, ids=None, batch_size=500: (
+        state.index_deletes.append(ids)))
+    monkeypatch.setattr(bulk, "invalidate_related_packages", invalidate)
+    return state
+
+
+class TestPurgeOrganizationPackages:
+    """Test the batched purge job."""
+
+    def test_purges_in_batches_with_one_index_delete(self, org):
+        progress = []
+
+        result = bulk.purge_organization_packages({}, ORG_ID, batch_size=3, cb=progress.append)
+
+        assert org.purged_chunks == [org.package_ids[0:3], org.package_ids[3:6], org.package_ids[6:]]
+        assert org.graph_chunks == org.purged_chunks
+        assert org.session.commits == 3
+        # The whole organization goes with one delete-by-query
+        assert org.index_deletes == [None]
+        assert org.invalidated == 1
+        assert result == {"total": 7, "purged": 7, "graph": {"deleted": 7, "queued": 0}}
+        assert progress[0] == "7 packages to purge"
+        assert "Purged 7/7 packages" in progress
+
+    def test_interrupted_purge_only_unindexes_purged_packages(self, org):
+        org.fail_on = "pkg-04"
+
+        with pytest.raises(RuntimeError):
+            bulk.purge_organization_packages({}, ORG_ID, batch_size=3)
+
+        assert org.purged_chunks == [org.package_ids[0:3]]
+        assert org.session.rollbacks == 1
+        assert org.index_deletes == [org.package_ids[0:3]]
+
+    def test_graphdb_disabled(self, org, monkeypatch):
+        monkeypatch.setattr(bulk, "_graphdb_enabled", lambda: False)
+
+        result = bulk.purge_organization_packages({}, ORG_ID, batch_size=5)
+
+        assert org.graph_chunks == []
+        assert result["purged"] == 7
+
+    def test_empty_organization(self, org):
+        org.package_ids = []
+
+        result = bulk.purge_organization_packages({}, ORG_ID)
+
+        assert org.index_deletes == [] and org.session.commits == 0
+        assert result == {"total": 0, "purged": 0, "graph": {"deleted": 0, "queued": 0}}
+
+
+class TestDeletePackages:
+    """Test the batched soft delete of selected packages."""
+
+    def test_bulk_deletes_selected_packages(self, org, monkeypatch):
+        calls = []
+
+        def bulk_update_delete(context, data_dict):
+            if "pkg-05" in data_dict["datasets"]:
+                raise RuntimeError("not allowed")
+            calls.append(data_dict)
+
+        monkeypatch.setattr(bulk.tk, "get_action", lambda name: bulk_update_delete)
+
+        result = bulk.delete_packages({}, ORG_ID, ["pkg-00", "pkg-01", "other", "pkg-05", "pkg-00"], batch_size=2)
+
+        assert calls == [{"datasets": ["pkg-00", "pkg-01"], "org_id": ORG_ID}]
+        assert result["deleted"] == ["pkg-00", "pkg-01"]
+        assert result["errors"] == [
+            {"id": "other", "error": "Package not found in this organization."},
+            {"id": "pkg-05", "error": "not allowed"},
+        ]
+        assert org.graph_chunks == [["pkg-00", "pkg-01"]]
+        assert org.session.rollbacks == 1
+        assert org.invalidated == 1
@@ -60,9 +60,22 @@ def _bootstrap_test_ckan():
 def stub_udc_plugin(monkeypatch):
     plugin = types.SimpleNamespace(disable_graphdb=False)
     monkeypatch.setattr(helpers.plugins, "get_plugin", lambda name: plugin)
+    # The tests below exercise the synchronous graph update (udc.sparql.sync_mode = sync)
+    monkeypatch.setattr(helpers, "is_async_sync", lambda: False)
     return plugin
 
 
+@pytest.fixture
+def queued_graph_sync(monkeypatch, stub_udc_plugin):
+    queued = []
+    monkeypatch.setattr(helpers, "is_async_sync", lambda: True)
+    monkeypatch.setattr(
+        helpers, "enqueue_graph_sync",
+        lambda context, package_id, operation: queued.append((package_id, operation)),
+    )
+    return queued
+
+
 @pytest.fixture
 def udc_config():
     with CONFIG_PATH.open("r", encoding="utf-8") as fh:
@@ -215,6 +228,34 @@ def test_package_delete_skips_graph_when_disabled(monkeypatch, stub_udc_plugin):
     assert result == {"id": "pkg"}
 
 
+def test_package_update_queues_graph_sync(monkeypatch, queued_graph_sync):
+    monkeypatch.setattr(helpers, "before_package_update_for_file_format", lambda *_: None)
+
+    def fail(*_):
+        raise AssertionError("graph should be updated by the sync job")
+
+    monkeypatch.setattr(helpers, "onUpdateCatalogue", fail)
+
+    result = helpers.package_update(lambda context, data_dict: {"id": "pkg"}, {}, {"id": "pkg"})
+
+    assert result == {"id": "pkg"}
+    assert queued_graph_sync == [("pkg", "update")]
+
+
+def test_package_delete_queues_graph_sync(monkeypatch, queued_graph_sync):
+    monkeypatch.setattr(helpers.model.Package, "get", lambda ref: types.SimpleNamespace(id="pkg-id"))
+
+    def fail(*_):
+        raise AssertionError("graph should be updated by the sync job")
+
+    monkeypatch.setattr(helpers, "onDeleteCatalogue", fail)
+
+    result = helpers.package_delete(lambda context, data_dict: None, {}, {"id": "pkg-name"})
+
+    assert result is None
+    assert queued_graph_sync == [("pkg-id", "delete")]
+
+
 pytestmark = pytest.mark.ckan_config("udc.multilingual.languages", "en fr")
 
 
@@ -0,0 +1,116 @@
+"""
+Tests for related_packages.py - related packages resolved per batch and cached.
+"""
+import pytest
+
+from ckanext.udc import related_packages as related
+from ckanext.udc.search.logic import utils as cache_utils
+
+PACKAGES = {
+    "u1": ("Unified roads", "unified-roads"),
+    "u2": ("Unified parks", "unified-parks"),
+    "a": ("Roads A", "roads-a"),
+    "b": ("Roads B", "roads-b"),
+    "c": ("Roads and parks C", "roads-c"),
+    "d": ("Parks D", "parks-d"),
+}
+# unified package -> packages it was deduplicated from
+RELATIONSHIPS = {"u1": ["a", "b", "c"], "u2": ["c", "d"]}
+
+
+class FakeGraph:
+    """The rows of the two joined queries, counting the queries."""
+
+    def __init__(self):
+        self.queries = 0
+
+    def unified_rows(self, package_ids):
+        self.queries += 1
+        return [(unified, child, *PACKAGES[child])
+                for unified in package_ids for child in RELATIONSHIPS.get(unified, [])]
+
+    def sibling_rows(self, package_ids):
+        self.queries += 1
+        rows = []
+        for package_id in package_ids:
+            for unified, children in RELATIONSHIPS.items():
+                if package_id not in children:
+                    continue
+                siblings = [child for child in children if child != package_id]
+                for sibling in siblings or [None]:
+                    sibling_cols = (sibling, *PACKAGES[sibling]) if sibling else (None, None, None)
+                    rows.append((package_id, unified, *PACKAGES[unified], *sibling_cols))
+        return rows
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    graph = FakeGraph()
+    monkeypatch.setattr(related, "_unified_rows", graph.unified_rows)
+    monkeypatch.setattr(related, "_sibling_rows", graph.sibling_rows)
+    monkeypatch.setattr(cache_utils, "_get_cache_redis", lambda: None)
+    related.invalidate_related_packages()
+    yield graph
+    related.invalidate_related_packages()
+
+
+def _ids(entries):
+    return [entry["id"] for entry in entries]
+
+
+class TestResolveRelatedPackages:
+    """Test the related packages of unified and deduplicated packages."""
+
+    def test_unified_package_lists_its_packages(self, graph):
+        result = related.resolve_related_packages({"u1": True})
+
+        assert result["u1"] == [
+            {"title": "Roads A", "id": "a", "name": "roads-a"},
+            {"title": "Roads B", "id": "b", "name": "roads-b"},
+            {"title": "Roads and parks C", "id": "c", "name": "roads-c"},
+        ]
+
+    def test_package_lists_each_unified_package_then_its_siblings(self, graph):
+        result = related.resolve_related_packages({"c": False, "d": False, "a": False})
+
+        assert _ids(result["c"]) == ["u1", "a", "b", "u2", "d"]
+        assert _ids(result["d"]) == ["u2", "c"]
+        assert _ids(result["a"]) == ["u1", "b", "c"]
+
+    def test_batch_takes_one_query_per_package_kind(self, graph):
+        result = related.resolve_related_packages({"u1": True, "u2": True, "a": False, "d": False, "x": False})
+
+        assert graph.queries == 2
+        assert result["x"] == []
+        assert _ids(result["u2"]) == ["c", "d"]
+
+    def test_search_results_are_refreshed_in_one_batch(self, graph):
+        results = [{"id": "a", "related_packages": []}, {"id": "u2", "is_unified": True, "related_packages": []}]
+
+        related.add_related_packages(results)
+
+        assert graph.queries == 2
+        assert _ids(results[0]["related_packages"]) == ["u1", "b", "c"]
+        assert _ids(results[1]["related_packages"]) == ["c", "d"]
+
+
+class TestRelatedPackagesCache:
+    """Test the cache of package_show and its invalidation."""
+
+    def test_repeated_show_is_served_from_the_cache(self, graph):
+        first = related.get_related_packages("a", False)
+        first.append({"id": "mutated"})
+
+        assert _ids(related.get_related_packages("a", False)) == ["u1", "b", "c"]
+        assert graph.queries == 1
+
+    def test_relationship_changes_invalidate_the_cache(self, graph, monkeypatch):
+        related.get_related_packages("d", False)
+        monkeypatch.setitem(RELATIONSHIPS, "u2", ["c", "d", "e"])
+        monkeypatch.setitem(PACKAGES, "e", ("Parks E", "parks-e"))
+
+        related.package_relationship_create(lambda context, data_dict: data_dict, {},
+                                            {"subject": "u2", "object": "e"})
+
+        assert _ids(related.get_related_packages("d", False)) == ["u2", "c", "e"]
+        assert graph.queries == 2
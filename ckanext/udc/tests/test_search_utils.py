@@ -0,0 +1,164 @@
+import threading
+import time
+
+import pytest
+
+from ckanext.udc.search.logic import utils
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, b"0")) + 1).encode()
+
+    def eval(self, script, numkeys, key, token):
+        # utils._RELEASE_LOCK: compare-and-delete
+        if self.data.get(key) == token.encode():
+            del self.data[key]
+            return 1
+        return 0
+
+
+@pytest.fixture
+def memory_backend(monkeypatch):
+    monkeypatch.setattr(utils, "_get_cache_redis", lambda: None)
+
+
+@pytest.fixture
+def redis_backend(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(utils, "_get_cache_redis", lambda: redis)
+    return redis
+
+
+def test_cache_for_returns_cached_value_until_ttl(memory_backend, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: now[0])
+    calls = []
+
+    @utils.cache_for(60, name="test_ttl")
+    def compute(x):
+        calls.append(x)
+        return x * 2
+
+    assert compute(2) == 4
+    assert compute(2) == 4
+    now[0] += 61
+    assert compute(2) == 4
+    assert calls == [2, 2]
+
+
+def test_cache_for_evicts_least_recently_used(memory_backend):
+    calls = []
+
+    @utils.cache_for(60, maxsize=2, name="test_lru")
+    def compute(x):
+        calls.append(x)
+        return x
+
+    compute(1)
+    compute(2)
+    compute(1)
+    compute(3)  # evicts 2
+    compute(1)
+    compute(2)
+
+    assert calls == [1, 2, 3, 2]
+
+
+def test_cache_for_is_single_flight(memory_backend):
+    calls = []
+    release = threading.Event()
+
+    @utils.cache_for(60, name="test_single_flight")
+    def compute():
+        calls.append(1)
+        release.wait(1)
+        return "facets"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(compute())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert calls == [1]
+    assert results == ["facets"] * 8
+
+
+def test_invalidate_cache_by_name(memory_backend):
+    calls = []
+
+    @utils.cache_for(60, name="test_invalidate")
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert compute() == 1
+    utils.invalidate_cache("test_invalidate")
+    assert compute() == 2
+
+
+def test_redis_backend_is_shared_and_invalidated(redis_backend):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"tags": {"items": [{"name": "housing", "count": len(calls)}]}}
+
+    worker_a = utils.cache_for(60, name="test_redis")(compute)
+    # Another process: its own in-memory state, same Redis
+    worker_b = utils.cache_for(60, name="test_redis")(compute)
+
+    assert worker_a() == worker_b()
+    assert len(calls) == 1
+
+    worker_a.invalidate()
+    assert worker_b()["tags"]["items"][0]["count"] == 2
+
+
+def test_redis_lock_is_only_released_by_its_owner(redis_backend):
+    lock_key = "udc:cache:test_lock_owner:0:__default__:lock"
+
+    def slow_compute():
+        # Our lock expired and another process took it
+        redis_backend.data[lock_key] = b"other-token"
+        return 1
+
+    assert utils.cache_for(60, name="test_lock_owner")(slow_compute)() == 1
+    assert redis_backend.data[lock_key] == b"other-token"
+
+
+def test_redis_value_is_not_stored_if_invalidated_while_computing(redis_backend):
+    calls = []
+
+    @utils.cache_for(60, name="test_invalidated_compute")
+    def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            utils.invalidate_cache("test_invalidated_compute")
+        return len(calls)
+
+    assert compute() == 1
+    # Processes waiting on the old generation do not get the stale value
+    assert "udc:cache:test_invalidated_compute:0:__default__" not in redis_backend.data
+    assert compute() == 2
+    assert compute() == 2
+    assert not any(key.endswith(":lock") for key in redis_backend.data)
@@ -0,0 +1,116 @@
+"""
+Tests for solr/index.py - index settings cache, debug logging and a reindex benchmark.
+
+The benchmark indexes a synthetic corpus with the per-document debug dumps
+(what every `search-index rebuild` used to do) and without, and reports
+documents per second.
+"""
+import json
+import logging
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.udc.solr import index as udc_index
+
+TEXT_FIELDS = ["theme", "description_document", "unique_identifier"]
+
+
+@pytest.fixture
+def udc_plugin(monkeypatch):
+    plugin = SimpleNamespace(multiple_select_fields=["access_category"], text_fields=list(TEXT_FIELDS))
+    monkeypatch.setattr(udc_index.plugins, "get_plugin", lambda _name: plugin)
+    monkeypatch.setattr(udc_index, "get_udc_langs", lambda: ["en", "fr"])
+    return plugin
+
+
+def _corpus(size):
+    return [
+        {
+            "id": f"pkg-{n}",
+            "name": f"dataset-{n}",
+            "title": f"Dataset {n}",
+            "notes": "Synthetic package " * 20,
+            "title_translated": json.dumps({"en": f"Dataset {n}", "fr": f"Jeu de données {n}"}),
+            "tags": [{"name": f"tag{n % 50}"}, {"name": f"tag{n % 7}"}],
+            "access_category": "open,restricted",
+            "theme": json.dumps({"en": "Housing", "fr": "Logement"}),
+            "description_document": "A plain text value",
+            "unique_identifier": str(n),
+            "dataset_versions": json.dumps([{"url": f"https://example.org/{n}/v1", "title": "v1"}]),
+            "resources": [{"url": f"https://example.org/{n}.csv", "format": "CSV"}] * 5,
+        }
+        for n in range(size)
+    ]
+
+
+class TestIndexSettings:
+    """Test the per-config lookups."""
+
+    def test_settings_are_computed_once_per_config(self, udc_plugin):
+        settings = udc_index.get_index_settings()
+        udc_plugin.text_fields.append("new_field")
+
+        assert udc_index.get_index_settings() is settings
+
+        udc_plugin.index_settings = None  # reload_config()
+        assert "new_field" in udc_index.get_index_settings().text_fields
+
+    def test_indexed_document(self, udc_plugin):
+        doc = udc_index.before_dataset_index(_corpus(1)[0])
+
+        assert doc["extras_access_category"] == ["open", "restricted"]
+        assert doc["theme_fr_f"] == ["Logement"]
+        assert doc["tags_en_f"] == ["tag0", "tag0"]
+        assert doc["dataset_versions_url"] == ["https://example.org/0/v1"]
+
+
+class TestDebugDumps:
+    """Test that documents are only serialized for the log when asked to."""
+
+    def test_no_dumps_by_default(self, udc_plugin, caplog, monkeypatch):
+        pkg_dict = _corpus(1)[0]
+        dumps = []
+        monkeypatch.setattr(udc_index.json, "dumps", lambda *args, **kwargs: dumps.append(1) or "")
+
+        with caplog.at_level(logging.DEBUG, logger=udc_index.log.name):
+            udc_index.before_dataset_index(pkg_dict)
+
+        assert dumps == []
+        assert caplog.records == []
+
+    def test_dumps_with_debug_flag(self, udc_plugin, caplog):
+        settings = udc_index.get_index_settings()._replace(debug=True)
+
+        with caplog.at_level(logging.DEBUG, logger=udc_index.log.name):
+            udc_index.before_dataset_index(_corpus(1)[0], settings)
+
+        assert [r.getMessage().split(":")[0] for r in caplog.records] == ["Original document", "Indexed document"]
+
+
+@pytest.mark.benchmark
+class TestReindexBenchmark:
+    """Benchmark: documents per second through before_dataset_index."""
+
+    def test_documents_per_second(self, udc_plugin, caplog):
+        corpus = _corpus(2000)
+        settings = udc_index.get_index_settings()
+
+        # Before: both documents pretty-printed for every package
+        with caplog.at_level(logging.DEBUG, logger=udc_index.log.name):
+            start = time.perf_counter()
+            for pkg_dict in corpus:
+                udc_index.before_dataset_index(pkg_dict, settings._replace(debug=True))
+            before = len(corpus) / (time.perf_counter() - start)
+        caplog.clear()
+
+        start = time.perf_counter()
+        for pkg_dict in corpus:
+            udc_index.before_dataset_index(pkg_dict)
+        after = len(corpus) / (time.perf_counter() - start)
+
+        print(f"\nbefore_dataset_index: with debug dumps {before:.0f} docs/s, "
+              f"without {after:.0f} docs/s ({after / before:.1f}x)", file=sys.stderr)
+        assert after > before
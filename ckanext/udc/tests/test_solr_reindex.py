@@ -0,0 +1,53 @@
+"""
+Tests for solr/reindex.py - batched Solr adds of the parallel reindex.
+"""
+import pysolr
+
+from ckanext.udc.solr.reindex import DocumentCollector, send_batch
+
+
+class FakeSolr:
+    """Rejects any add request containing a document with a bad field."""
+
+    def __init__(self):
+        self.requests = []
+        self.docs = []
+
+    def add(self, docs, commit=False):
+        self.requests.append((len(docs), commit))
+        if any("bad" in doc for doc in docs):
+            raise pysolr.SolrError("unknown field 'bad'")
+        self.docs.extend(docs)
+
+
+class TestSendBatch:
+    """Test the batched adds."""
+
+    def test_batch_is_one_request_without_commit(self):
+        solr = FakeSolr()
+
+        failed = send_batch(solr, [{"id": str(n)} for n in range(500)])
+
+        assert failed == []
+        assert solr.requests == [(500, False)]
+
+    def test_rejected_batch_only_fails_the_bad_documents(self):
+        solr = FakeSolr()
+        docs = [{"id": "a"}, {"id": "b", "bad": 1}, {"id": "c"}]
+
+        failed = send_batch(solr, docs)
+
+        assert [package_id for package_id, _error in failed] == ["b"]
+        assert [doc["id"] for doc in solr.docs] == ["a", "c"]
+
+
+class TestDocumentCollector:
+    """Test the connection used by the pool workers."""
+
+    def test_keeps_documents_and_deletes_until_taken(self):
+        collector = DocumentCollector()
+        collector.add(docs=[{"id": "a"}], commit=True)
+        collector.delete(q='+id:"b"', commit=True)
+
+        assert collector.take() == ([{"id": "a"}], ['+id:"b"'])
+        assert collector.take() == ([], [])
@@ -6,7 +6,7 @@ from datetime import datetime
 from collections import OrderedDict
 from functools import partial
 from typing import Any, Iterable, Optional, Union, cast
-from ckanext.udc.graph.logic import get_catalogue_graph
+from ckanext.udc.graph.logic import get_catalogue_graph_export
 from werkzeug.datastructures import MultiDict
 
 from flask import Blueprint
@@ -639,7 +639,7 @@ def package_graph(package_id, format=None):
     
     # Get the graph
     try:
-        graph_data = get_catalogue_graph(package_id, format)
+        export = get_catalogue_graph_export(package_id, format)
     except ValueError as e:
         log.error(f"Error retrieving graph for package {package_id}: {str(e)}")
         abort(404, description=str(e))
@@ -659,4 +659,8 @@ def package_graph(package_id, format=None):
     
     content_type = content_types.get(format, 'text/plain; charset=utf-8')
     
-    return Response(graph_data, mimetype=content_type)
+    response = Response(export["data"], mimetype=content_type)
+    response.set_etag(export["etag"])
+    response.last_modified = export["last_modified"]
+    # Answers 304 Not Modified to If-None-Match / If-Modified-Since
+    return response.make_conditional(request)
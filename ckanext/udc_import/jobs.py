@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import zipfile
+from datetime import datetime
+from typing import Any, Dict, List, cast
+
+import ckan.lib.uploader as uploader
+import ckan.logic as logic
+import ckan.model as model
+from ckan.common import config
+from ckan.types import Context
+
+from ckanext.udc_import.logic.import_data import (
+    ChunkCleaner,
+    count_titles,
+    file_mappings,
+    iter_data_chunks,
+    load_chunk_to_ckan,
+    read_import_files,
+)
+
+log = logging.getLogger(__name__)
+
+# Rows that failed, kept in the status file
+MAX_ERRORS = 100
+
+
+def job_directory(job_id: str) -> str:
+    return os.path.join(uploader.get_storage_path(), "udc_import", job_id)
+
+
+def read_status(job_id: str) -> Dict[str, Any]:
+    with open(os.path.join(job_directory(job_id), "status.json")) as f:
+        return json.load(f)
+
+
+def write_status(job_id: str, status: Dict[str, Any]):
+    # Heartbeat: a running job updates its status after every chunk
+    status["updated_at"] = datetime.utcnow().isoformat()
+    path = os.path.join(job_directory(job_id), "status.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(status, f)
+    os.replace(path + ".tmp", path)
+
+
+def is_stale(status: Dict[str, Any]) -> bool:
+    """
+    Whether a running job stopped updating its status for longer than
+    `ckanext.udc_import.stale_after` seconds (default 1800), e.g. because its
+    worker died.
+    """
+    if status.get("state") != "running" or not status.get("updated_at"):
+        return False
+    age = datetime.utcnow() - datetime.fromisoformat(status["updated_at"])
+    return age.total_seconds() > int(config.get("ckanext.udc_import.stale_after", 1800))
+
+
+def append_results(job_id: str, logs: List[list]):
+    """Created entries ([title, package name, resource id]) as JSON lines."""
+    with open(os.path.join(job_directory(job_id), "results.jsonl"), "a") as f:
+        for row in logs:
+            f.write(json.dumps(row) + "\n")
+
+
+def read_results(job_id: str, start: int = 0, limit: int = 500) -> List[list]:
+    path = os.path.join(job_directory(job_id), "results.jsonl")
+    if not os.path.exists(path):
+        return []
+    result = []
+    with open(path) as f:
+        for n, line in enumerate(f):
+            if n >= start + limit:
+                break
+            if n >= start:
+                result.append(json.loads(line))
+    return result
+
+
+def job_udc_import(job_id: str, zip_path: str, user_id: str):
+    """
+    Import the catalogue entries of an uploaded zip, `ckanext.udc_import.chunk_size`
+    rows at a time, recording the progress in the job's status.json.
+    """
+    chunk_size = int(config.get("ckanext.udc_import.chunk_size", 1000))
+    userobj = model.User.get(user_id)
+
+    def _context():
+        # Use a new context for each catalogue entry
+        return cast(Context, {
+            "model": model,
+            "session": model.Session,
+            "user": userobj.name,
+            "auth_user_obj": userobj,
+        })
+
+    status = read_status(job_id)
+    try:
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            mappings_df, default_values, data_file_names = read_import_files(zip_ref)
+            mappings = file_mappings(mappings_df, data_file_names)
+            title_counts = count_titles(zip_ref.open, mappings, chunk_size)
+            status.update(state="running", total=int(title_counts.sum()))
+            write_status(job_id, status)
+
+            cleaner = ChunkCleaner(title_counts)
+            for data_df in iter_data_chunks(zip_ref.open, mappings, chunk_size):
+                cleaned_df, errors = cleaner.clean(data_df)
+                logs, load_errors = load_chunk_to_ckan(_context, cleaned_df, default_values)
+                errors += load_errors
+                append_results(job_id, logs)
+                status["processed"] += len(data_df)
+                status["created"] += len(logs)
+                status["error_count"] += len(errors)
+                status["errors"] = (status["errors"] + errors)[-MAX_ERRORS:]
+                write_status(job_id, status)
+        status["state"] = "complete"
+    except logic.ValidationError as e:
+        status.update(state="error", message=str(e.error_summary))
+    except Exception as e:
+        log.exception(e)
+        status.update(state="error", message=str(e))
+    finally:
+        write_status(job_id, status)
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
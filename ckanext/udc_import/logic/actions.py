@@ -4,8 +4,7 @@ import os
 import io
 import zipfile
 import uuid
-import json
-import pandas as pd
+from datetime import datetime
 from typing import Any, cast, Dict
 
 from urllib.parse import urljoin
@@ -15,9 +14,12 @@ import ckan.lib.helpers as h
 import ckan.logic as logic
 import ckan.plugins as p
 import ckan.lib.uploader as uploader
+import ckan.lib.jobs as jobs
+import ckan.model as model
 from ckan.common import config
 from .utils import read_csv
-from .import_data import load_data_to_ckan
+from .import_data import check_data_files, file_mappings, read_import_files
+from ckanext.udc_import.jobs import is_stale, job_udc_import, read_results, read_status, write_status
 
 
 log = logging.getLogger(__name__)
@@ -47,42 +49,63 @@ def udc_import_submit(context: Context, data_dict: Dict[str, Any]):
             upload.upload_file.close()
 
     try:
-        filename2data = {} # data file filename -> data df
-        # Unzip
+        # Check the zip before queuing it, reading the data file headers only
         with zipfile.ZipFile(tmp_filepath, 'r') as zip_ref:
-            try:
-                with zip_ref.open('mapping.csv') as f:
-                    mappings_df = pd.read_csv(f)
-            except:
-                raise logic.ValidationError(["Missing `mapping.csv`"])
-            
-            try:
-                with zip_ref.open('default.json') as f:
-                    default_values = json.load(f)
-            except:
-                raise logic.ValidationError(["Missing `default.json`"])
-            
-            try:
-                with zip_ref.open('data_files.txt') as f:
-                    data_file_names = [line.decode('UTF-8').strip() for line in f.readlines()]
-            except:
-                raise logic.ValidationError(["Missing `data_files.txt`"])
-
-            for data_file_name in data_file_names:
-                with zip_ref.open(data_file_name) as f:
-                    filename2data[data_file_name] = pd.read_csv(f)
-            
-        # Import
-        logs = load_data_to_ckan(filename2data, mappings_df, default_values)
-
+            mappings_df, default_values, data_file_names = read_import_files(zip_ref)
+            check_data_files(zip_ref, file_mappings(mappings_df, data_file_names))
+    except zipfile.BadZipFile:
         os.remove(tmp_filepath)
-        return logs
-
+        raise logic.ValidationError(["The upload is not a zip file"])
     except:
         # Remove the upload
         os.remove(tmp_filepath)
         raise
-        
+
+    job_id = os.path.basename(directory)
+    userobj = model.User.get(context['user'])
+    write_status(job_id, {
+        "state": "pending",
+        "file": tmp_filename,
+        "user_id": userobj.id,
+        "submitted_at": datetime.utcnow().isoformat(),
+        "total": None,
+        "processed": 0,
+        "created": 0,
+        "error_count": 0,
+        "errors": [],
+    })
+    jobs.enqueue(job_udc_import, [job_id, tmp_filepath, userobj.id], title=f"udc_import {tmp_filename}")
+
+    return {"job_id": job_id}
+
+
+@logic.side_effect_free
+def udc_import_status(context: Context, data_dict: Dict[str, Any]):
+    """
+    Progress of a bulk upload.
+
+    :param id: the job id returned by udc_import_submit
+    :param start: first created entry to return (default 0)
+    :param limit: number of created entries to return (default 500)
+    :returns: the job status with `results`: [[title, package name, resource id], ...]
+        and `stale`: true if the job is running but stopped updating its status
+    """
+    p.toolkit.check_access('udc_import_view', context, data_dict)
+    job_id = str(data_dict.get('id') or '')
+    try:
+        uuid.UUID(job_id)
+        status = read_status(job_id)
+    except (ValueError, OSError):
+        raise logic.NotFound(f"Import job {job_id} not found")
+
+    userobj = model.User.get(context['user'])
+    if not userobj or (userobj.id != status.get("user_id") and not userobj.sysadmin):
+        raise logic.NotAuthorized("Not authorized to see this import job")
+
+    start = int(data_dict.get('start', 0))
+    limit = min(int(data_dict.get('limit', 500)), 5000)
+    return {**status, "id": job_id, "stale": is_stale(status),
+            "results": read_results(job_id, start, limit)}
 
 
 def check_permission(context: Context, data_dict: Dict[str, Any]):
@@ -1,3 +1,4 @@
+import logging
 import re
 import pandas as pd
 import json as js
@@ -9,7 +10,9 @@ import ckan.logic as logic
 import ckan.model as model
 from ckan.common import current_user
 
-from typing import List, Dict, cast
+from typing import List, Dict, Tuple, cast
+
+log = logging.getLogger(__name__)
 
 
 class DataPreprocessor:
@@ -72,84 +75,255 @@ class DataPreprocessor:
         df[column_name] = df.apply(append_numbers, axis=1)
 
 
-def load_data_to_ckan(data_dicts: Dict[str, pd.DataFrame], mappings_df, default_values: dict):
-    logs = []
+class ChunkCleaner:
+    """
+    The DataPreprocessor rules applied to whole columns of a chunk.
 
-    # file_name -> [ [data_file_field_name, cudr_field_name], ... ]
-    data_df = pd.DataFrame()
+    :param title_counts: occurrences of each title in the whole file, duplicated
+        titles get a running number that continues across chunks.
+    """
 
-    data_preprocessor = DataPreprocessor()
+    def __init__(self, title_counts: pd.Series):
+        self.title_counts = title_counts
+        self.seen = pd.Series(dtype="int64")
 
-    for file_name in data_dicts:
-        file_mapping = mappings_df[mappings_df['file_name'] == file_name]
-        current_data = data_dicts[file_name]
+    @staticmethod
+    def clean_titles(titles: pd.Series, max_length=100) -> pd.Series:
+        return (
+            titles.astype(str)
+            .str.replace(r"[^\w]+", "-", regex=True)
+            .str.replace(r"[^\w]+$", "", regex=True)
+            .str.lower()
+            .str[:max_length]
+        )
 
-        for _, row in file_mapping.iterrows():
-            data_file_field = row['data_file_field_names']
-            cudr_field = row['cudr_field_names']
+    @staticmethod
+    def clean_tags(values: pd.Series) -> pd.Series:
+        words = values.astype(str).str.findall(r"\w+(?:\.\w+)*")
+        return pd.Series(
+            [[{"name": word.capitalize()} for word in ws if len(word) > 1] for ws in words],
+            index=values.index,
+            dtype=object,
+        )
 
-            if data_file_field not in current_data:
-                raise logic.ValidationError([f'Cannot find field `{data_file_field}` in `{file_name}`'])
-            else:
-                data_df[cudr_field] = current_data[data_file_field]
+    @staticmethod
+    def clean_geo_span(values: pd.Series) -> pd.Series:
+        return (
+            values.astype(str).where(values.notna())
+            .str.findall(r"\w+")
+            .str.join(", ")
+            .str.lower()
+            .str.replace(r"(^|, )(\w)", lambda m: m.group(1) + m.group(2).upper(), regex=True)
+        )
+
+    @staticmethod
+    def invalid_years(values: pd.Series) -> pd.Series:
+        """True where a value is given but is not a year between 1 and 9999."""
+        years = pd.to_numeric(values, errors="coerce")
+        return values.notna() & ~years.between(1, 9999)
+
+    @staticmethod
+    def clean_dates(values: pd.Series, month_day: str) -> pd.Series:
+        """Years to dates; the values that are not a year (see invalid_years) are left empty."""
+        years = pd.to_numeric(values, errors="coerce")
+        years = years.where(years.between(1, 9999))
+        cleaned = years.dropna().astype("int64").astype(str).str.zfill(4) + month_day
+        return cleaned.reindex(values.index)
 
-            data_df['accessed_date'] = pd.Timestamp.today().strftime('%Y-%m-%d')
+    def append_numbers(self, data_df: pd.DataFrame):
+        titles = data_df["title"]
+        labels = titles.astype(str) + " (" + data_df["name"].astype(str) + ")"
+        duplicated = titles.map(self.title_counts).fillna(0) > 1
+        number = titles.groupby(titles, dropna=False).cumcount() + 1 + titles.map(self.seen).fillna(0).astype("int64")
+        data_df["title"] = labels.where(~duplicated, labels + " - " + number.astype(str))
+        self.seen = self.seen.add(titles.value_counts(dropna=False), fill_value=0).astype("int64")
 
-    data_preprocessor.clean_and_append_numbers(data_df, 'title')
+    def clean(self, data_df: pd.DataFrame) -> Tuple[pd.DataFrame, List[dict]]:
+        """
+        :returns: (cleaned rows, errors): the rows with an invalid year are
+            left out and reported as {"index", "title", "error"}, like
+            load_chunk_to_ckan reports the rows it cannot create.
+        """
+        data_df["accessed_date"] = pd.Timestamp.today().strftime("%Y-%m-%d")
+        self.append_numbers(data_df)
+        data_df["name"] = self.clean_titles(data_df["title"])
+        if "tags" in data_df.columns:
+            data_df["tags"] = self.clean_tags(data_df["tags"])
+        if "geo_span" in data_df.columns:
+            data_df["geo_span"] = self.clean_geo_span(data_df["geo_span"])
+        errors = []
+        for field, month_day in (("time_span_start", "-01-01"), ("time_span_end", "-12-31")):
+            if field not in data_df.columns:
+                continue
+            invalid = self.invalid_years(data_df[field])
+            for index in invalid[invalid].index:
+                errors.append({
+                    "index": int(index),
+                    "title": data_df.at[index, "title"],
+                    "error": {field: f"Invalid year `{data_df.at[index, field]}`"},
+                })
+            data_df[field] = self.clean_dates(data_df[field], month_day)
+        if errors:
+            data_df = data_df.drop(index=sorted({error["index"] for error in errors}))
+        return data_df, errors
 
-    if 'title' in data_df.columns:
-        data_df['name'] = data_df['title'].apply(data_preprocessor.clean_title)
 
-    if 'tags' in data_df.columns:
-        data_df['tags'] = data_df['tags'].apply(data_preprocessor.clean_tags)
+def read_import_files(zip_ref):
+    """(mappings_df, default_values, data_file_names) of an uploaded zip."""
+    try:
+        with zip_ref.open('mapping.csv') as f:
+            mappings_df = pd.read_csv(f)
+    except:
+        raise logic.ValidationError(["Missing `mapping.csv`"])
 
-    if 'geo_span' in data_df.columns:
-        data_df['geo_span'] = data_df['geo_span'].apply(
-            data_preprocessor.clean_geo_span)
+    try:
+        with zip_ref.open('default.json') as f:
+            default_values = js.load(f)
+    except:
+        raise logic.ValidationError(["Missing `default.json`"])
 
-    if 'time_span_start' in data_df.columns:
-        data_df['time_span_start'] = data_df['time_span_start'].apply(
-            data_preprocessor.clean_min_date)
+    try:
+        with zip_ref.open('data_files.txt') as f:
+            data_file_names = [line.decode('UTF-8').strip() for line in f.readlines()]
+    except:
+        raise logic.ValidationError(["Missing `data_files.txt`"])
 
-    if 'time_span_end' in data_df.columns:
-        data_df['time_span_end'] = data_df['time_span_end'].apply(
-            data_preprocessor.clean_max_date)
+    return mappings_df, default_values, [name for name in data_file_names if name]
 
-    result_list = data_df.to_dict(orient='records')
 
-    # if the key does not exist in the datafile, populate it with the default value
-    for d in result_list:
-        for key, value in default_values.items():
-            if key not in d:
-                d[key] = value
+def check_data_files(zip_ref, mappings: Dict[str, List[tuple]]):
+    """Make sure every data file exists and has its mapped fields, reading the headers only."""
+    names = set(zip_ref.namelist())
+    for file_name, fields in mappings.items():
+        if file_name not in names:
+            raise logic.ValidationError([f"Missing data file `{file_name}`"])
+        with zip_ref.open(file_name) as f:
+            columns = pd.read_csv(f, nrows=0).columns
+        for data_file_field, _ in fields:
+            if data_file_field not in columns:
+                raise logic.ValidationError([f"Cannot find field `{data_file_field}` in `{file_name}`"])
+
+
+def file_mappings(mappings_df: pd.DataFrame, data_file_names: List[str]) -> Dict[str, List[tuple]]:
+    """file name -> [(data file field, cudr field), ...] for the data files with mappings."""
+    result = {}
+    for file_name in data_file_names:
+        rows = mappings_df[mappings_df["file_name"] == file_name]
+        if len(rows):
+            result[file_name] = list(zip(rows["data_file_field_names"], rows["cudr_field_names"]))
+    mapped = {cudr for fields in result.values() for _, cudr in fields}
+    # Duplicated titles are told apart by the name (see ChunkCleaner.append_numbers)
+    for required in ("title", "name"):
+        if required not in mapped:
+            raise logic.ValidationError([f"`mapping.csv` has no field mapped to `{required}`"])
+    return result
+
 
-    # loading datasets into CKAN iteratively
-    for i, data in enumerate(result_list):
+def title_source(mappings: Dict[str, List[tuple]]) -> tuple:
+    for file_name, fields in mappings.items():
+        for data_file_field, cudr_field in fields:
+            if cudr_field == "title":
+                return file_name, data_file_field
+
+
+def iter_data_chunks(open_file, mappings: Dict[str, List[tuple]], chunk_size: int = 1000):
+    """
+    Read the data files in step, `chunk_size` rows at a time, and yield the
+    mapped columns. Rows are aligned by position on the file holding the titles.
+
+    :param open_file: returns a binary file object for a data file name.
+    """
+    title_file = title_source(mappings)[0]
+    files = {name: open_file(name) for name in mappings}
+    try:
+        readers = {name: pd.read_csv(f, chunksize=chunk_size) for name, f in files.items()}
+        for chunk in readers[title_file]:
+            data_df = pd.DataFrame(index=chunk.index)
+            for file_name, fields in mappings.items():
+                current = chunk if file_name == title_file else next(readers[file_name], pd.DataFrame())
+                for data_file_field, cudr_field in fields:
+                    # A shorter data file leaves the remaining rows empty
+                    data_df[cudr_field] = current[data_file_field] if data_file_field in current else float("nan")
+            yield data_df
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def count_titles(open_file, mappings: Dict[str, List[tuple]], chunk_size: int = 1000) -> pd.Series:
+    """Occurrences of each title, reading only the title column."""
+    file_name, field = title_source(mappings)
+    counts = pd.Series(dtype="int64")
+    with open_file(file_name) as f:
+        for chunk in pd.read_csv(f, usecols=[field], chunksize=chunk_size):
+            counts = counts.add(chunk[field].value_counts(dropna=False), fill_value=0)
+    return counts.astype("int64")
+
+
+def load_chunk_to_ckan(context_factory, data_df: pd.DataFrame, default_values: dict):
+    """
+    Create one catalogue entry (with its resource) per row.
+
+    :returns: (logs, errors): [[title, package name, resource id], ...] and
+        [{"index", "title", "error"}, ...] for the rows that failed. A failing
+        row is rolled back and recorded; the next rows are still imported.
+    """
+    logs, errors = [], []
+    for index, data in zip(data_df.index, data_df.to_dict(orient="records")):
+        # if the key does not exist in the datafile, populate it with the default value
+        for key, value in default_values.items():
+            if key not in data:
+                data[key] = value
+        data["type"] = "catalogue"
+        # The associated resource of the metadata, created with the package
+        data["resources"] = [{
+            "url": data.get("url", ""),
+            "name": data.get("title", ""),
+            "description": data.get("description", ""),
+            "format": data.get("format", ""),
+        }]
         try:
-            data['type'] = 'catalogue'
-
-            # Create a new context for each catalogue entry creation
-            context = cast(Context, {
-                'model': model,
-                'session': model.Session,
-                'user': current_user.name,
-                'auth_user_obj': current_user
-            })
-            created_package = toolkit.get_action("package_create")(context, data)
-
-            # loading the associated resource for the metadata
-            resource = {
-                'package_id': created_package['id'],
-                'url': data.get('url', ''),
-                'name': data.get('title', ''),
-                'description': data.get('description', ''),
-                'format': data.get('format', '')
-            }
-            resource = toolkit.get_action("resource_create")(context, resource)
-            logs.append([data.get('title'), created_package["name"], resource["id"]])
+            created_package = toolkit.get_action("package_create")(context_factory(), data)
+            logs.append([data.get("title"), created_package["name"], created_package["resources"][0]["id"]])
         except logic.ValidationError as e:
-            e.error_dict['Error when importing'] = [
-                f'title="{data.get("title", "")}", index={i}']
-            raise e
+            model.Session.rollback()
+            errors.append({"index": int(index), "title": data.get("title", ""), "error": e.error_summary})
+        except Exception as e:
+            # e.g. NotAuthorized, or an IntegrityError when another upload took the name
+            log.exception(e)
+            model.Session.rollback()
+            errors.append({"index": int(index), "title": data.get("title", ""), "error": str(e) or type(e).__name__})
+    return logs, errors
+
+
+def load_data_to_ckan(data_dicts: Dict[str, pd.DataFrame], mappings_df, default_values: dict):
+    """Import data frames that are already in memory (uploads go through jobs.job_udc_import)."""
+    mappings = file_mappings(mappings_df, list(data_dicts))
+    for file_name, fields in mappings.items():
+        for data_file_field, _ in fields:
+            if data_file_field not in data_dicts[file_name]:
+                raise logic.ValidationError([f"Cannot find field `{data_file_field}` in `{file_name}`"])
+
+    file_name, field = title_source(mappings)
+    data_df = pd.DataFrame(index=data_dicts[file_name].index)
+    for file_name, fields in mappings.items():
+        for data_file_field, cudr_field in fields:
+            data_df[cudr_field] = data_dicts[file_name][data_file_field]
+    cleaner = ChunkCleaner(data_df["title"].value_counts(dropna=False))
+
+    def _context():
+        return cast(Context, {
+            'model': model,
+            'session': model.Session,
+            'user': current_user.name,
+            'auth_user_obj': current_user
+        })
 
+    data_df, errors = cleaner.clean(data_df)
+    logs, load_errors = load_chunk_to_ckan(_context, data_df, default_values)
+    errors += load_errors
+    if errors:
+        raise logic.ValidationError({
+            'Error when importing': [f'title="{e["title"]}", index={e["index"]}: {e["error"]}' for e in errors]
+        })
     return logs
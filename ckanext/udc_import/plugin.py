@@ -31,6 +31,7 @@ class UdcImportPlugin(plugins.SingletonPlugin):
     def get_actions(self) -> Dict[str, Action]:
         return {
             'udc_import_submit': action.udc_import_submit,
+            'udc_import_status': action.udc_import_status,
             'udc_import_check_permission': action.check_permission,
         }
     
@@ -0,0 +1,111 @@
+"""
+Tests for the chunked import pipeline in logic/import_data.py.
+
+The vectorized cleaners must give the same values as the DataPreprocessor rules.
+"""
+import io
+
+import pandas as pd
+
+import ckan.logic as logic
+from ckanext.udc_import.logic import import_data
+from ckanext.udc_import.logic.import_data import (
+    ChunkCleaner,
+    DataPreprocessor,
+    count_titles,
+    iter_data_chunks,
+    load_chunk_to_ckan,
+)
+
+
+MAPPINGS = {
+    "a.csv": [("Title", "title"), ("Id", "name"), ("Keywords", "tags")],
+    "b.csv": [("Region", "geo_span"), ("From", "time_span_start"), ("To", "time_span_end")],
+}
+FILES = {
+    "a.csv": b"Title,Id,Keywords\nRoads,r1,road; traffic.v2\nParks,p1,x green\nRoads,r2,\nRoads,r3,road\n",
+    "b.csv": b"Region,From,To\nold  toronto,2001,2005\nGTA,1999,2000\nyork,2010,2011\n",
+}
+
+
+def _open(name):
+    return io.BytesIO(FILES[name])
+
+
+def test_cleaners_match_data_preprocessor():
+    titles = pd.Series(["Road Closures: 2024!", "Parks & Rec", "a/b/c"])
+    assert list(ChunkCleaner.clean_titles(titles)) == [DataPreprocessor.clean_title(t) for t in titles]
+
+    tags = pd.Series(["road; traffic.v2", "a bb", 2024])
+    assert list(ChunkCleaner.clean_tags(tags)) == [DataPreprocessor.clean_tags(t) for t in tags]
+
+    regions = pd.Series(["old  toronto", "GTA", "north-york east"])
+    assert list(ChunkCleaner.clean_geo_span(regions)) == [DataPreprocessor.clean_geo_span(r) for r in regions]
+
+    years = pd.Series([2001, 1999])
+    assert list(ChunkCleaner.clean_dates(years, "-01-01")) == [DataPreprocessor.clean_min_date(y) for y in years]
+    assert list(ChunkCleaner.clean_dates(years, "-12-31")) == [DataPreprocessor.clean_max_date(y) for y in years]
+
+
+def test_chunks_are_aligned_and_numbered_across_chunks():
+    counts = count_titles(_open, MAPPINGS, chunk_size=2)
+    assert counts.to_dict() == {"Roads": 3, "Parks": 1}
+
+    cleaner = ChunkCleaner(counts)
+    chunks = [cleaner.clean(df) for df in iter_data_chunks(_open, MAPPINGS, chunk_size=2)]
+    assert all(errors == [] for _, errors in chunks)
+    data = pd.concat(df for df, _ in chunks)
+
+    assert list(data["title"]) == ["Roads (r1) - 1", "Parks (p1)", "Roads (r2) - 2", "Roads (r3) - 3"]
+    assert list(data["name"]) == ["roads-r1-1", "parks-p1", "roads-r2-2", "roads-r3-3"]
+    assert list(data["geo_span"].iloc[:3]) == ["Old, Toronto", "Gta", "York"]
+    # b.csv is one row shorter
+    assert pd.isna(data["geo_span"].iloc[3])
+    assert list(data["time_span_end"].iloc[:3]) == ["2005-12-31", "2000-12-31", "2011-12-31"]
+
+
+def test_invalid_years_are_row_errors():
+    data_df = pd.DataFrame({
+        "title": ["Roads", "Parks", "Trails"],
+        "name": ["r1", "p1", "t1"],
+        "time_span_start": ["2001", "20O1", None],
+        "time_span_end": ["2005", "2005", "0"],
+    }, index=[10, 11, 12])
+    cleaner = ChunkCleaner(data_df["title"].value_counts())
+
+    cleaned, errors = cleaner.clean(data_df)
+
+    assert list(cleaned.index) == [10]
+    assert list(cleaned["time_span_start"]) == ["2001-01-01"]
+    assert errors == [
+        {"index": 11, "title": "Parks (p1)", "error": {"time_span_start": "Invalid year `20O1`"}},
+        {"index": 12, "title": "Trails (t1)", "error": {"time_span_end": "Invalid year `0`"}},
+    ]
+
+
+def test_any_failing_row_is_recorded_and_the_chunk_goes_on(monkeypatch):
+    failures = {
+        "p1": logic.ValidationError({"name": ["That URL is already in use."]}),
+        "t1": logic.NotAuthorized("User cannot create packages"),
+        "b1": RuntimeError("duplicate key value violates unique constraint"),
+    }
+    rollbacks = []
+
+    def package_create(context, data):
+        if data["name"] in failures:
+            raise failures[data["name"]]
+        return {"name": data["name"], "resources": [{"id": "res-" + data["name"]}]}
+
+    monkeypatch.setattr(import_data.toolkit, "get_action", lambda name: package_create)
+    monkeypatch.setattr(import_data.model.Session, "rollback", lambda: rollbacks.append(1))
+    data_df = pd.DataFrame({"title": ["Roads", "Parks", "Trails", "Bridges", "Lanes"],
+                            "name": ["r1", "p1", "t1", "b1", "l1"]})
+
+    logs, errors = load_chunk_to_ckan(dict, data_df, {})
+
+    assert logs == [["Roads", "r1", "res-r1"], ["Lanes", "l1", "res-l1"]]
+    assert [(e["index"], e["title"]) for e in errors] == [(1, "Parks"), (2, "Trails"), (3, "Bridges")]
+    assert errors[0]["error"] == {"Name": "That URL is already in use."}
+    assert errors[1]["error"] == "User cannot create packages"
+    assert errors[2]["error"] == "duplicate key value violates unique constraint"
+    assert len(rollbacks) == 3
@@ -0,0 +1,27 @@
+"""
+Tests for the status file of the bulk upload job (jobs.py).
+"""
+from datetime import datetime, timedelta
+
+from ckanext.udc_import import jobs
+
+
+def test_a_running_job_without_heartbeat_is_stale(monkeypatch):
+    monkeypatch.setattr(jobs, "config", {"ckanext.udc_import.stale_after": "60"})
+    recent = datetime.utcnow().isoformat()
+    old = (datetime.utcnow() - timedelta(minutes=5)).isoformat()
+
+    assert not jobs.is_stale({"state": "running", "updated_at": recent})
+    assert jobs.is_stale({"state": "running", "updated_at": old})
+    assert not jobs.is_stale({"state": "complete", "updated_at": old})
+    assert not jobs.is_stale({"state": "pending", "updated_at": old})
+
+
+def test_writing_the_status_records_a_heartbeat(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, "job_directory", lambda job_id: str(tmp_path))
+
+    jobs.write_status("job", {"state": "running", "processed": 10})
+
+    status = jobs.read_status("job")
+    assert status["processed"] == 10
+    assert datetime.utcnow() - datetime.fromisoformat(status["updated_at"]) < timedelta(minutes=1)
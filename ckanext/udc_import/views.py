@@ -39,7 +39,6 @@ class ImportView(MethodView):
             'user': current_user.name,
             'auth_user_obj': current_user
         })
-        result = []
         try:
             result = toolkit.get_action(u'udc_import_submit')(context, data)
         except logic.NotAuthorized:
@@ -48,14 +47,9 @@ class ImportView(MethodView):
             errors = e.error_dict
             error_summary = e.error_summary
             return self.get(errors, error_summary)
-        
-        side_panel_text = model.system_info.get_system_info(
-            "ckanext.udc_import.side_panel_text")
-        
-        return base.render(
-            u'udc_import/import_status.html',
-            extra_vars={"result": result, "side_panel_text": side_panel_text}
-        )
+
+        # The import runs as a background job
+        return core_helpers.redirect_to(u'udc_import.status', job_id=result["job_id"])
 
     def get(self, 
             errors: Optional[Dict[str, Any]] = None,
@@ -75,7 +69,38 @@ class ImportView(MethodView):
         )
 
 
+def import_status(job_id: str):
+    context = cast(Context, {
+        'model': model,
+        'session': model.Session,
+        'user': current_user.name,
+        'auth_user_obj': current_user
+    })
+    start = request.args.get('start', 0, type=int)
+    try:
+        status = toolkit.get_action(u'udc_import_status')(
+            context, {'id': job_id, 'start': start, 'limit': 500})
+    except logic.NotAuthorized:
+        base.abort(403, _(u'Not authorized to see this page'))
+    except logic.NotFound:
+        base.abort(404, _(u'Import job not found'))
+
+    side_panel_text = model.system_info.get_system_info(
+        "ckanext.udc_import.side_panel_text")
+
+    return base.render(
+        u'udc_import/import_status.html',
+        extra_vars={"status": status, "result": status["results"], "start": start,
+                    "side_panel_text": side_panel_text}
+    )
+
+
 udc_import.add_url_rule(
     '/udc/import',
     view_func=ImportView.as_view('submit')
 )
+udc_import.add_url_rule(
+    '/udc/import/status/<job_id>',
+    view_func=import_status,
+    endpoint='status'
+)
@@ -0,0 +1,144 @@
+"""
+Checkpoints of import jobs, so a job re-queued after a worker restart resumes
+where it stopped instead of refetching and reprocessing everything.
+
+A checkpoint has two parts:
+
+- a snapshot of what was fetched from the remote: JSON documents saved with
+  save() and the stream of remote packages recorded by record(), both gzip
+  files next to the job log;
+- the state, persisted in CUDCImportJob.other_data["checkpoint"] together with
+  the imported_id_map: which snapshot parts are complete and which positions
+  (in the order iterate_imports() yields the packages) are finished. Positions
+  are kept as a cursor (everything below is finished) plus the finished
+  positions above it, which are at most the size of the work queue.
+"""
+import gzip
+import json
+import os
+import threading
+from typing import Any, Iterable, Iterator, Optional
+
+from ckan.plugins.toolkit import config
+
+
+def job_checkpoint_prefix(job_id: str) -> str:
+    """Snapshot files of an import job checkpoint: <ckan.storage_path>/udc_import_logs/<job_id>.snapshot.*.gz"""
+    storage_path = config.get("ckan.storage_path") or "./"
+    return os.path.join(storage_path, "udc_import_logs", f"{job_id}.snapshot")
+
+
+class ImportCheckpoint:
+
+    def __init__(self, path_prefix: str, state: Optional[dict] = None):
+        self.path_prefix = path_prefix
+        state = state or {}
+        self.saved = list(state.get("saved") or [])
+        self.recorded = state.get("recorded") or 0
+        self.record_complete = bool(state.get("record_complete"))
+        self.cursor = state.get("cursor") or 0
+        self.ahead = set(state.get("ahead") or [])
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "saved": list(self.saved),
+                "recorded": self.recorded,
+                "record_complete": self.record_complete,
+                "cursor": self.cursor,
+                "ahead": sorted(self.ahead),
+            }
+
+    @property
+    def finished_count(self) -> int:
+        return self.cursor + len(self.ahead)
+
+    def _path(self, name: str) -> str:
+        return f"{self.path_prefix}.{name}.gz"
+
+    def save(self, name: str, value: Any) -> None:
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(path + ".tmp", path)
+        if name not in self.saved:
+            self.saved.append(name)
+
+    def load(self, name: str, default=None):
+        if name not in self.saved or not os.path.exists(self._path(name)):
+            return default
+        with gzip.open(self._path(name), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def replay(self) -> Iterator[dict]:
+        """The packages recorded so far (complete or not, see record_complete)."""
+        path = self._path("packages")
+        if not self.recorded or not os.path.exists(path):
+            return
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for n, line in enumerate(f):
+                if n >= self.recorded:
+                    # Written after the last persisted state, recorded again
+                    break
+                yield json.loads(line)
+
+    def record(self, items: Iterable[dict], chunk: int = 500) -> Iterator[dict]:
+        """
+        Pass the items through, appending them to the snapshot in gzip members
+        of `chunk` items; record_complete is set once `items` is exhausted.
+        """
+        path = self._path("packages")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            # Drop what was written after the last persisted state before appending
+            with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+                for item in self.replay():
+                    f.write(json.dumps(item) + "\n")
+            os.replace(path + ".tmp", path)
+        self._pending = []
+        try:
+            for item in items:
+                self._pending.append(item)
+                if len(self._pending) >= chunk:
+                    self.flush()
+                yield item
+            self.flush()
+            self.record_complete = True
+        finally:
+            # A consumer that stops early keeps what was yielded
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the recorded items that are still buffered; call before persisting the state."""
+        pending, self._pending = self._pending, []
+        if pending:
+            data = "".join(json.dumps(item) + "\n" for item in pending)
+            with open(self._path("packages"), "ab") as f:
+                f.write(gzip.compress(data.encode("utf-8")))
+            self.recorded += len(pending)
+
+    def is_finished(self, position: int) -> bool:
+        with self._lock:
+            return position < self.cursor or position in self.ahead
+
+    def finished(self, position: int) -> None:
+        with self._lock:
+            if position < self.cursor:
+                return
+            self.ahead.add(position)
+            while self.cursor in self.ahead:
+                self.ahead.remove(self.cursor)
+                self.cursor += 1
+
+    def clear(self) -> None:
+        """Remove the snapshot files; the job finished."""
+        for name in [*self.saved, "packages"]:
+            for path in (self._path(name), self._path(name) + ".tmp"):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.saved, self.recorded, self.record_complete = [], 0, False
+        self.cursor, self.ahead = 0, set()
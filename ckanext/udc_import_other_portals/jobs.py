@@ -1,20 +1,24 @@
-from typing import Any, List, Dict, Optional, cast
+import os
+from typing import List, cast
 from datetime import datetime
 
-from ckanext.udc_import_other_portals.logger import ImportLogger
-from ckanext.udc_import_other_portals.logic.base import (
-    delete_package,
-    get_package,
-    get_package_ids_by_import_config_id,
-    purge_package,
+from rq import get_current_job
+
+from ckanext.udc_import_other_portals.logger import ImportLogger, job_log_path
+from ckanext.udc_import_other_portals.logic.arcgis_based.refresh import (
+    fetch_upstream_source_last_updated,
+    plan_refresh,
+    read_import_extras,
+    write_import_extras,
 )
-from ckanext.udc_import_other_portals.logic.arcgis_based.api import get_dataset
 
 from ckan.types import Context
 import ckan.logic as logic
 import ckan.model as model
+import ckan.plugins.toolkit as toolkit
 
 from ckanext.udc_import_other_portals.model import CUDCImportConfig, CUDCImportJob
+from ckanext.udc.organization.bulk import purge_organization_packages
 
 
 def _build_context_for_user(user_id: str) -> Context:
@@ -32,21 +36,12 @@ def _build_context_for_user(user_id: str) -> Context:
     )
 
 
-def _source_last_updated_iso(attributes: Dict[str, Any]) -> Optional[str]:
-    """Convert upstream ArcGIS modified fields to the ISO format used in extras."""
-    # ArcGIS uses either itemModified or modified depending on item type.
-    modified_ms = (attributes or {}).get("itemModified") or (attributes or {}).get("modified")
-    if not modified_ms:
-        return None
-    return datetime.utcfromtimestamp(modified_ms / 1000).isoformat()
-
-
-def _update_import_extra(extras: List[Dict[str, Any]], key: str, value: str) -> List[Dict[str, Any]]:
-    """Replace or append a single key/value pair inside the import extras list."""
-    # Replace any existing key so package_patch stays idempotent across refreshes.
-    updated = [item for item in extras if item.get("key") != key]
-    updated.append({"key": key, "value": value})
-    return updated
+def _truncation_note(logger: ImportLogger) -> List[str]:
+    """A line pointing at the job log file when earlier entries are no longer in memory."""
+    earlier = logger.buffer.total - len(logger.logs)
+    if earlier <= 0:
+        return []
+    return [f"... {earlier} earlier log entries are in the job log file (cudc_import_log_range_get)."]
 
 
 def job_run_import(import_config_id: str, run_by: str, job_id: str):
@@ -76,6 +71,17 @@ def job_run_import(import_config_id: str, run_by: str, job_id: str):
 
         import_log = CUDCImportJob.get(job_id)
         run_flags = (import_log.other_data or {}) if import_log else {}
+        rq_job = get_current_job()
+        if import_log and rq_job and run_flags.get("rq_job_id") != rq_job.id:
+            # Scheduled runs are not enqueued with a known id
+            import_log = CUDCImportJob.get_for_update(job_id)
+            import_log.other_data = {**(import_log.other_data or {}), "rq_job_id": rq_job.id}
+            model.Session.add(import_log)
+            model.Session.commit()
+            run_flags = import_log.other_data
+        if run_flags.get("checkpoint") and os.path.exists(job_log_path(job_id)):
+            # The resumed run numbers its log entries from 0 again, start a new log file
+            os.remove(job_log_path(job_id))
         import_config._delete_previously_imported_for_run = bool(
             run_flags.get("delete_previously_imported_once")
         )
@@ -124,7 +130,10 @@ def job_run_import(import_config_id: str, run_by: str, job_id: str):
         raise logger.exception(e)
     finally:
         # Finished
-        import_log = CUDCImportJob.get(job_id)
+        if import_instance:
+            import_instance.logger.close()
+        # Merge into other_data as stored now: the Socket.IO server writes "finished" concurrently
+        import_log = CUDCImportJob.get_for_update(job_id)
         import_log.is_running = False
         if import_instance and import_instance.import_config:
             import_instance.import_config.is_running = False
@@ -136,11 +145,16 @@ def job_run_import(import_config_id: str, run_by: str, job_id: str):
                 model.Session.add(config)
 
         if import_instance:
-            import_log.has_error = logger.has_error or import_instance.logger.has_error
+            instance_logger = import_instance.logger
+            import_log.has_error = logger.has_error or instance_logger.has_error
             import_log.has_warning = (
-                logger.has_warning or import_instance.logger.has_warning
+                logger.has_warning or instance_logger.has_warning
             )
-            import_log.logs = "\n".join([*logger.logs, *import_instance.logger.logs])
+            import_log.logs = "\n".join([*logger.logs, *_truncation_note(instance_logger), *instance_logger.logs])
+            import_log.other_data = {
+                **(import_log.other_data or {}),
+                **instance_logger.summary(),
+            }
         else:
             import_log.has_error = logger.has_error
             import_log.has_warning = logger.has_warning
@@ -173,52 +187,22 @@ def job_refresh_arcgis_source_last_updated(import_config_id: str, run_by: str, j
         if not base_api:
             raise logger.exception(logic.ValidationError("base_api is required in import configuration."))
 
-        context = _build_context_for_user(run_by)
-        package_ids = get_package_ids_by_import_config_id(context, import_config_id)
-        refreshed = 0
-        skipped = 0
-
-        for package_id in package_ids:
-            package = get_package(context, package_id=package_id)
-            remote_id = package.get("cudc_import_remote_id")
-            if not remote_id:
-                skipped += 1
-                logger.warning(f"Skip package {package_id}: missing cudc_import_remote_id")
-                continue
-
-            dataset = get_dataset(remote_id, base_api)
-            if not dataset:
-                skipped += 1
-                logger.warning(f"Skip package {package_id}: upstream dataset not found ({remote_id})")
-                continue
-
-            source_last_updated = _source_last_updated_iso(dataset.get("attributes") or {})
-            if not source_last_updated:
-                skipped += 1
-                logger.warning(f"Skip package {package_id}: upstream dataset has no modified timestamp ({remote_id})")
-                continue
-
-            import_extras = package.get("udc_import_extras") or []
-            if not isinstance(import_extras, list):
-                import_extras = []
-            # Keep the existing import extras payload intact and only replace this one key.
-            updated_import_extras = _update_import_extra(
-                import_extras,
-                "source_last_updated",
-                source_last_updated,
-            )
+        upstream = fetch_upstream_source_last_updated(base_api, cb=logger.info)
+        rows = read_import_extras(import_config_id)
+        changes, skipped_packages, unchanged = plan_refresh(rows, upstream)
+        for package_id, reason in skipped_packages:
+            logger.warning(f"Skip package {package_id}: {reason}")
+        skipped = len(skipped_packages)
+        logger.info(
+            f"{len(rows)} packages, {len(upstream)} upstream datasets: "
+            f"{len(changes)} changed, {unchanged} unchanged, {skipped} skipped"
+        )
 
-            logic.get_action("package_patch")(
-                context,
-                {
-                    "id": package_id,
-                    "udc_import_extras": updated_import_extras,
-                },
-            )
-            refreshed += 1
+        batch_size = int(toolkit.config.get("ckanext.udc.import.refresh_batch_size", 500))
+        refreshed = len(write_import_extras(changes, batch_size=batch_size, cb=logger.info))
 
         logger.info(
-            f"Source last updated refresh finished for config {import_config_id}: refreshed={refreshed}, skipped={skipped}"
+            f"Source last updated refresh finished for config {import_config_id}: refreshed={refreshed}, skipped={skipped}, unchanged={unchanged}"
         )
         import_log.has_error = logger.has_error
         import_log.has_warning = logger.has_warning
@@ -228,6 +212,7 @@ def job_refresh_arcgis_source_last_updated(import_config_id: str, run_by: str, j
             "task_type": "source_last_updated_refresh",
             "refreshed": refreshed,
             "skipped": skipped,
+            "unchanged": unchanged,
         }
     except Exception as e:
         logger.exception(e)
@@ -250,33 +235,25 @@ def job_refresh_arcgis_source_last_updated(import_config_id: str, run_by: str, j
 
 def delete_organization_packages(userid: str, organization_id: str):
     """
-    Delete all packages for the given organization.
+    Purge all packages of the given organization, in set-based batches.
     """
+    logger = ImportLogger()
+    organization = model.Group.get(organization_id)
+    if not organization or not organization.is_organization:
+        raise logger.exception(logic.NotFound(f"Organization not found: {organization_id}"))
 
-    userobj = model.User.get(userid)
-
-    context = cast(
-        Context,
-        {
-            "model": model,
-            "session": model.Session,
-            "user": userobj.name,
-            "auth_user_obj": userobj,
-        },
-    )
-
-    packages = logic.get_action("package_search")(
-        context, {"q": f"organization:{organization_id}", "rows": 50000}
-    )
-    print("number of packages to delete", len(packages["results"]))
-    while len(packages["results"]) > 0:
-        number_of_packages = len(packages["results"])
-        print("number of packages to delete", number_of_packages)
-        for package in packages["results"]:
-            print(f"Deleting package {package['id']} - {package['title']}")
-            # delete_package(context, package["id"])
-            purge_package(context, package["id"])
-
-        packages = logic.get_action("package_search")(
-            context, {"q": f"organization:{organization_id}", "rows": 50000}
+    logger.info(f"Purging the packages of organization {organization.name}")
+    try:
+        result = purge_organization_packages(
+            _build_context_for_user(userid), organization.id, cb=logger.info
+        )
+        graph = result["graph"]
+        logger.info(
+            f"Purged {result['purged']}/{result['total']} packages of organization {organization.name}, "
+            f"knowledge graph: {graph['deleted']} removed, {graph['queued']} queued for retry"
         )
+        return result
+    except Exception as e:
+        raise logger.exception(e)
+    finally:
+        logger.close()
@@ -0,0 +1,98 @@
+"""
+Bounded log storage for ImportLogger.
+
+The newest `capacity` entries are kept in memory. Older entries are spilled to
+a gzip file in chunks of `spill_chunk` entries, each appended as its own gzip
+member, so the file stays readable while the job is still writing it. One
+entry is one JSON string per line (tracebacks span several lines otherwise).
+Entries are addressed by their index over the whole run: read(start, limit)
+combines the spilled entries and the in-memory tail.
+"""
+import gzip
+import json
+import os
+import threading
+from collections import Counter, deque
+from itertools import islice
+from typing import Optional
+
+
+class LogBuffer:
+
+    def __init__(self, capacity: int = 1000, spill_path: Optional[str] = None, spill_chunk: int = 1000):
+        self.capacity = max(int(capacity), 1)
+        self.spill_path = spill_path
+        self.spill_chunk = max(int(spill_chunk), 1)
+        self.counts = Counter()
+        self.total = 0
+        # Entries written to the spill file, or dropped when there is no spill file
+        self.spilled = 0
+        self._tail = deque()
+        self._pending = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def append(self, level: str, entry: str) -> None:
+        with self._lock:
+            self.counts[level] += 1
+            self.total += 1
+            self._tail.append(entry)
+            if len(self._tail) > self.capacity:
+                evicted = self._tail.popleft()
+                if self.spill_path and not self._closed:
+                    self._pending.append(evicted)
+                    if len(self._pending) >= self.spill_chunk:
+                        self._write(self._pending)
+                        self._pending = []
+                else:
+                    self.spilled += 1
+
+    def _write(self, entries) -> None:
+        if not entries:
+            return
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        data = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with open(self.spill_path, "ab") as f:
+            f.write(gzip.compress(data.encode("utf-8")))
+        self.spilled += len(entries)
+
+    def close(self) -> None:
+        """
+        Write the remaining entries to the spill file so that it holds the whole run.
+        The in-memory tail is kept for tail().
+        """
+        with self._lock:
+            if not self.spill_path or self._closed:
+                return
+            self._write([*self._pending, *self._tail])
+            self._pending = []
+            self._closed = True
+
+    def tail(self) -> list:
+        """The newest entries, at most capacity + spill_chunk of them."""
+        with self._lock:
+            return [*self._pending, *self._tail]
+
+    def read(self, start: int = 0, limit: Optional[int] = None) -> list:
+        """Entries [start, start + limit) of the run, or every entry from start when limit is None."""
+        with self._lock:
+            start = max(int(start), 0)
+            end = self.total if limit is None else min(start + max(int(limit), 0), self.total)
+            entries = []
+            if start < min(end, self.spilled) and self.spill_path:
+                entries = read_spill_file(self.spill_path, start, min(end, self.spilled) - start)
+            if not self._closed:
+                first = self.spilled
+                memory = [*self._pending, *self._tail]
+                entries.extend(memory[max(start - first, 0):max(end - first, 0)])
+            return entries
+
+
+def read_spill_file(path: str, start: int = 0, limit: Optional[int] = None) -> list:
+    """Entries [start, start + limit) of a spill file."""
+    if not path or not os.path.exists(path):
+        return []
+    start = max(int(start), 0)
+    stop = None if limit is None else start + max(int(limit), 0)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in islice(f, start, stop)]
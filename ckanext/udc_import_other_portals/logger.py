@@ -1,6 +1,11 @@
 import logging
+import os
 import traceback
+from typing import Optional
 
+from ckan.plugins.toolkit import config
+
+from ckanext.udc_import_other_portals.log_buffer import LogBuffer
 from ckanext.udc_import_other_portals.worker.socketio_client import SocketClient
 
 
@@ -11,23 +16,63 @@ def generate_trace(e):
     return f"Exception: {trace}"
 
 
+def job_log_path(job_id: str) -> str:
+    """Spill file of an import job: <ckan.storage_path>/udc_import_logs/<job_id>.jsonl.gz"""
+    storage_path = config.get("ckan.storage_path") or "./"
+    return os.path.join(storage_path, "udc_import_logs", f"{job_id}.jsonl.gz")
+
+
 class ImportLogger:
-    """Log to file and memory."""
+    """
+    Log to file and memory.
+
+    Only the newest `capacity` entries (ckanext.udc.import.log_capacity,
+    default 1000) stay in memory; older ones are spilled to `log_file`
+    (dropped without one). `counts` has the number of entries per level.
+    """
     total = 0
     current = 0
     finished = []
 
-    def __init__(self, base_logger=log, total=0, socket_client: SocketClient = None):
+    def __init__(self, base_logger=log, total=0, socket_client: SocketClient = None,
+                 capacity: Optional[int] = None, log_file: Optional[str] = None):
         self.base_logger = base_logger
-        self.logs = []
+        if capacity is None:
+            capacity = int(config.get("ckanext.udc.import.log_capacity", 1000))
+        self.buffer = LogBuffer(capacity, spill_path=log_file)
         self.has_error = False
         self.has_warning = False
         self.socket_client = socket_client
         self.total = total
 
+    @property
+    def logs(self) -> list:
+        """The newest log entries; earlier ones are in the log file."""
+        return self.buffer.tail()
+
+    @property
+    def counts(self) -> dict:
+        return dict(self.buffer.counts)
+
+    @property
+    def log_file(self) -> Optional[str]:
+        return self.buffer.spill_path
+
+    def close(self):
+        """Write the remaining entries to the log file, which then holds the whole run."""
+        self.buffer.close()
+
+    def summary(self) -> dict:
+        """Per-level counts and where the full log is, for CUDCImportJob.other_data."""
+        return {
+            "log_counts": self.counts,
+            "log_total": self.buffer.total,
+            "log_file": self.log_file,
+        }
+
     def exception(self, e):
         trace = generate_trace(e)
-        self.logs.append(trace)
+        self.buffer.append("exception", trace)
         self.base_logger.exception(e)
         self.has_error = True
         if self.socket_client:
@@ -35,21 +80,21 @@ class ImportLogger:
         return e
 
     def warning(self, s):
-        self.logs.append(f"Warning: {s}")
+        self.buffer.append("warning", f"Warning: {s}")
         self.base_logger.warning(s)
         self.has_error = True
         if self.socket_client:
             self.socket_client.send_message("warning", s)
 
     def error(self, s):
-        self.logs.append(f"Error: {s}")
+        self.buffer.append("error", f"Error: {s}")
         self.base_logger.error(s)
         self.has_warning = True
         if self.socket_client:
             self.socket_client.send_message("error", s)
 
     def info(self, s):
-        self.logs.append(f"Info: {s}")
+        self.buffer.append("info", f"Info: {s}")
         self.base_logger.info(s)
         if self.socket_client:
             self.socket_client.send_message("info", s)
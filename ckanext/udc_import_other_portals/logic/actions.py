@@ -1,4 +1,5 @@
 import logging
+import os
 import uuid
 from datetime import datetime
 from typing import Any, List, Dict, Optional
@@ -6,6 +7,9 @@ from typing import Any, List, Dict, Optional
 import requests
 from ckanext.udc_import_other_portals.model import CUDCImportConfig, CUDCImportJob
 from ckanext.udc_import_other_portals.jobs import job_run_import, delete_organization_packages
+from ckanext.udc_import_other_portals.log_buffer import read_spill_file
+from ckanext.udc_import_other_portals.logger import job_log_path
+from ckanext.udc_import_other_portals.checkpoint import ImportCheckpoint, job_checkpoint_prefix
 
 from ckan.types import Context
 import ckan.logic as logic
@@ -395,6 +399,8 @@ def cudc_import_run(context: Context, data: Dict[str, Any]):
 
     # Init the import log instance
     job_uuid = str(uuid.uuid4())
+    # Id of the RQ job, to tell whether the run is still alive (see _job_alive)
+    rq_job_id = str(uuid.uuid4())
     import_log_data = {
         "import_config_id": config_uuid,
         "run_at": datetime.utcnow(),
@@ -405,6 +411,7 @@ def cudc_import_run(context: Context, data: Dict[str, Any]):
             "task_type": "import",
             "run_mode": "manual",
             "delete_previously_imported_once": delete_previously_imported_once,
+            "rq_job_id": rq_job_id,
         },
     }
     import_log = CUDCImportJob(**import_log_data)
@@ -412,11 +419,82 @@ def cudc_import_run(context: Context, data: Dict[str, Any]):
     model.Session.commit()
 
     # Submit the job
-    jobs.enqueue(job_run_import, [config_uuid, userobj.id, job_uuid])
+    jobs.enqueue(job_run_import, [config_uuid, userobj.id, job_uuid], rq_kwargs={"job_id": rq_job_id})
 
     return {"success": True, "message": "Job submitted."}
 
 
+def _job_alive(job: CUDCImportJob) -> bool:
+    """Whether the job is queued or running on a worker, not only flagged as running."""
+    if not job.is_running:
+        return False
+    rq_job_id = (job.other_data or {}).get("rq_job_id")
+    if not rq_job_id:
+        # Cannot tell: trust the flag
+        return True
+    try:
+        rq_job = jobs.job_from_id(rq_job_id)
+    except KeyError:
+        return False
+    # A job whose worker died is moved to the failed registry
+    return rq_job.get_status() in ("queued", "started", "deferred", "scheduled")
+
+
+def cudc_import_job_resume(context: Context, data: Dict[str, Any]):
+    """
+    Re-queue an import job that was interrupted (e.g. by a worker restart).
+    It resumes from its checkpoint: the remote listing is not fetched again
+    and finished packages are not processed again.
+    {
+        "id": "job-uuid"
+    }
+
+    Raises:
+        logic.NotAuthorized
+        logic.ValidationError
+    """
+    model = context["model"]
+    user = context["user"]
+
+    # If not sysadmin.
+    if not authz.is_sysadmin(user):
+        raise logic.NotAuthorized("Not authorized.")
+
+    job_id = data.get("id")
+    if not job_id:
+        raise logic.ValidationError("id should be provided.")
+
+    job = CUDCImportJob.get_for_update(job_id)
+    if not job:
+        raise logic.ValidationError("import job does not exists.")
+    if not (job.other_data or {}).get("checkpoint"):
+        raise logic.ValidationError("The import job has no checkpoint to resume from.")
+
+    current_config = CUDCImportConfig.get(job.import_config_id)
+    if not current_config:
+        raise logic.ValidationError("import config does not exists.")
+
+    if _job_alive(job):
+        raise logic.ValidationError("The import job is still running.")
+    if current_config.is_running and any(
+        _job_alive(running) for running in CUDCImportJob.get_running_jobs_by_config_id(current_config.id)
+    ):
+        raise logic.ValidationError("Another import of this config is running.")
+
+    rq_job_id = str(uuid.uuid4())
+    current_config.is_running = True
+    job.is_running = True
+    job.finished_at = None
+    job.other_data = {**(job.other_data or {}), "rq_job_id": rq_job_id}
+    model.Session.add(current_config)
+    model.Session.add(job)
+    model.Session.commit()
+
+    jobs.enqueue(job_run_import, [job.import_config_id, job.run_by, job_id], rq_kwargs={"job_id": rq_job_id})
+
+    return {"success": True, "message": "Job resumed."}
+
+
 @logic.side_effect_free
 def cudc_import_logs_get(context: Context, data_dict):
     """
@@ -454,6 +532,53 @@ def cudc_import_logs_get(context: Context, data_dict):
 
 
 
+@logic.side_effect_free
+def cudc_import_log_range_get(context: Context, data_dict):
+    """
+    Get a range of entries from the full log file of an import job.
+    {
+        "id": "job-uuid",
+        "start": 0,
+        "limit": 500
+    }
+    Returns {"entries": [str], "start": int, "total": int | None, "counts": {level: int}}.
+
+    Raises:
+        logic.NotAuthorized
+        logic.ValidationError
+    """
+    user = context["user"]
+
+    # If not sysadmin.
+    if not authz.is_sysadmin(user):
+        raise logic.NotAuthorized("Not authorized.")
+
+    if not isinstance(data_dict, dict):
+        raise logic.ValidationError("Input should be a dict.")
+
+    job_id = data_dict.get("id")
+    if not job_id:
+        raise logic.ValidationError("id should be provided.")
+
+    try:
+        start = max(int(data_dict.get("start", 0)), 0)
+        limit = min(max(int(data_dict.get("limit", 500)), 0), 5000)
+    except (TypeError, ValueError):
+        raise logic.ValidationError("start and limit should be integers.")
+
+    job = CUDCImportJob.get(job_id)
+    if not job:
+        raise logic.ValidationError(f"Import job not found: {job_id}")
+
+    other_data = job.other_data or {}
+    return {
+        "entries": read_spill_file(other_data.get("log_file") or job_log_path(job_id), start, limit),
+        "start": start,
+        "total": other_data.get("log_total"),
+        "counts": other_data.get("log_counts") or {},
+    }
+
+
 def cudc_import_log_delete(context: Context, data: Dict[str, Any]):
     """
     Delete an import config log.
@@ -478,9 +603,16 @@ def cudc_import_log_delete(context: Context, data: Dict[str, Any]):
     if not id_to_delete:
         raise logic.ValidationError("id missing.")
 
+    job = CUDCImportJob.get(id_to_delete)
+    log_file = (job.other_data or {}).get("log_file") if job else None
     CUDCImportJob.delete_by_id(id_to_delete)
     model.Session.commit()
 
+    for path in {log_file, job_log_path(id_to_delete)} - {None}:
+        if os.path.exists(path):
+            os.remove(path)
+    ImportCheckpoint(job_checkpoint_prefix(id_to_delete), (job.other_data or {}).get("checkpoint") if job else None).clear()
+
 def cudc_clear_organization(context: Context, data: Dict[str, Any]):
     """
     Clear all packages for a specific organization
@@ -2,12 +2,13 @@
 ArcGIS Hub API client utilities
 """
 import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 
 import requests
-from requests.adapters import HTTPAdapter, Retry
 
-from .http_utils import get_with_fast_fail
+from .http_client import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -30,26 +31,13 @@ def get_site_scope_group_ids(base_api, timeout=10):
     :param timeout: Request timeout in seconds (int) or (connect, read) tuple
     :return: List of group IDs that define the site scope
     """
-    session = requests.Session()
-    retries = Retry(
-        total=6,
-        connect=0,
-        read=3,
-        backoff_factor=1,
-        status_forcelist=[104, 502, 503, 504],
-    )
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    
     base = _normalize_base_api(base_api)
     url = f"{base}/api/search/v1/catalog"
     
     try:
         logger.info(f"Fetching site scope from catalog: {url}")
         request_timeout = timeout if isinstance(timeout, tuple) else (5, timeout)
-        response = get_with_fast_fail(session.get, url, timeout=request_timeout)
-        response.raise_for_status()
-        catalog = response.json()
+        catalog = get_client().get_json(url, timeout=request_timeout)
         
         # Extract group IDs from scopes.item.filters[].predicates[].group
         group_ids = []
@@ -83,101 +71,86 @@ def get_site_scope_group_ids(base_api, timeout=10):
         raise ValueError(f"Failed to get site scope group IDs from {url}: {e}")
 
 
-def get_all_datasets(base_api, page_size=100, max_results=None, cb=None):
+def get_all_datasets(base_api, page_size=100, max_results=None, cb=None, fields=None):
     """
     Retrieve all datasets from an ArcGIS Hub API within the site scope.
     
     This correctly filters datasets using the site's group IDs to avoid
     fetching datasets from other organizations.
+
+    Once the first page reports the total count, the remaining pages are
+    fetched concurrently (up to the client's per-host limit).
     
     :param base_api: The base URL of the ArcGIS Hub instance (e.g., "https://geohub.lio.gov.on.ca")
     :param page_size: Number of results per page (default: 100)
     :param max_results: Maximum number of datasets to retrieve (None for all)
     :param cb: Callback function for progress updates
+    :param fields: Comma separated dataset attributes to return (None for all)
     :return: A list of all datasets within the site scope
+    :raises requests.RequestException: when a page cannot be fetched, instead of
+        returning a partial listing (the missing datasets would be purged as stale).
     """
-    session = requests.Session()
-    retries = Retry(
-        total=10,
-        connect=0,
-        backoff_factor=1,
-        status_forcelist=[104, 502, 503, 504]
-    )
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    
+    client = get_client()
     base = _normalize_base_api(base_api)
     # First, get the site scope group IDs
     group_ids = get_site_scope_group_ids(base)
     
     datasets = []
-    page_number = 1
+    url = f"{base}/api/v3/datasets"
+    params = {'page[size]': page_size}
+    if fields:
+        params['fields[datasets]'] = fields
     
     # Build filter parameter for group IDs
-    filter_param = None
     if group_ids:
         # Use filter[groupIds]=any(id1,id2,id3,...) to filter by site scope
         group_ids_str = ','.join(group_ids)
-        filter_param = f"any({group_ids_str})"
+        params['filter[groupIds]'] = f"any({group_ids_str})"
         logger.info(f"Filtering datasets by {len(group_ids)} group IDs (site scope)")
-    
-    while True:
-        # Construct the API request URL
-        url = f"{base}/api/v3/datasets"
-        params = {
-            'page[size]': page_size,
-            'page[number]': page_number
-        }
-        
-        # Add group ID filter if available
-        if filter_param:
-            params['filter[groupIds]'] = filter_param
-        
+
+    def fetch_page(page_number):
         logger.info(f"Fetching datasets page {page_number}, size={page_size}")
+        return client.get_json(url, params={**params, 'page[number]': page_number})
+
+    data = fetch_page(1)
+
+    # Log total count if available
+    total_count = data.get('meta', {}).get('stats', {}).get('totalCount') or data.get('meta', {}).get('total')
+    if total_count:
+        logger.info(f"Total datasets in site scope: {total_count}")
         if cb:
-            cb(f"Fetching datasets: page {page_number} (total so far: {len(datasets)})")
-        
-        try:
-            # Make the API request
-            response = get_with_fast_fail(session.get, url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Log total count if available
-            total_count = data.get('meta', {}).get('stats', {}).get('totalCount') or data.get('meta', {}).get('total')
-            if total_count and page_number == 1:
-                logger.info(f"Total datasets in site scope: {total_count}")
+            cb(f"Total datasets in site scope: {total_count}")
+    datasets.extend(data.get('data', []))
+
+    wanted = min(total_count, max_results) if total_count and max_results else (total_count or max_results)
+    if total_count and data.get('data'):
+        # Numbered pages: fetch the rest concurrently, keeping their order
+        last_page = math.ceil(wanted / page_size)
+        with ThreadPoolExecutor(max_workers=client.per_host_limit) as executor:
+            pages = executor.map(fetch_page, range(2, last_page + 1))
+            for page_number, page in enumerate(pages, start=2):
                 if cb:
-                    cb(f"Total datasets in site scope: {total_count}")
-            
-            # Extract the results
-            result_datasets = data.get('data', [])
-            
-            if not result_datasets:
-                break  # Stop if no more datasets are returned
-            
-            datasets.extend(result_datasets)
-            
-            # Check if we've reached the maximum
-            if max_results and len(datasets) >= max_results:
-                datasets = datasets[:max_results]
-                break
-            
-            # Check if there's a next page (recommended way)
-            next_link = data.get('links', {}).get('next')
-            if not next_link:
-                break
-            
-            # Follow the next link (already has all parameters encoded)
-            # Use urljoin to handle both absolute and relative URLs
-            url = urljoin(base, next_link)
+                    cb(f"Fetching datasets: page {page_number} (total so far: {len(datasets)})")
+                result_datasets = page.get('data', [])
+                if not result_datasets:
+                    break
+                datasets.extend(result_datasets)
+    else:
+        # No total count: follow the next links
+        next_link = data.get('links', {}).get('next')
+        page_number = 1
+        while next_link and data.get('data') and not (max_results and len(datasets) >= max_results):
             page_number += 1
-            # Clear params since next_link already contains them
-            params = {}
-            
-        except requests.RequestException as e:
-            logger.error(f"Request failed: {e}")
-            break
+            if cb:
+                cb(f"Fetching datasets: page {page_number} (total so far: {len(datasets)})")
+            # The next link already has all parameters encoded
+            # Use urljoin to handle both absolute and relative URLs
+            data = client.get_json(urljoin(base, next_link))
+            datasets.extend(data.get('data', []))
+            next_link = data.get('links', {}).get('next')
+
+    if max_results:
+        datasets = datasets[:max_results]
     
     logger.info(f"Retrieved {len(datasets)} datasets total from site scope")
     return datasets
@@ -191,23 +164,12 @@ def get_dataset(dataset_id, base_api):
     :param base_api: The base URL of the ArcGIS Hub instance
     :return: Dataset details
     """
-    session = requests.Session()
-    retries = Retry(
-        total=10,
-        connect=0,
-        backoff_factor=1,
-        status_forcelist=[104, 502, 503, 504]
-    )
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    
     base = _normalize_base_api(base_api)
     url = f"{base}/api/v3/datasets/{dataset_id}"
     
     try:
-        response = get_with_fast_fail(session.get, url)
-        response.raise_for_status()
-        data = response.json()
+        # Unchanged items are answered with 304 and served from the client cache
+        data = get_client().get_json(url)
         return data.get('data')
     except requests.RequestException as e:
         logger.error(f"Failed to get dataset {dataset_id}: {e}")
@@ -224,12 +186,14 @@ def check_site_alive(base_api):
     try:
         # Check catalog endpoint first (more reliable)
         base = _normalize_base_api(base_api)
-        response = get_with_fast_fail(requests.get, f"{base}/api/search/v1/catalog", timeout=10)
-        if response.status_code == 200:
+        client = get_client()
+        try:
+            client.get(f"{base}/api/search/v1/catalog", timeout=10, conditional=False, max_attempts=1)
+            return True
+        except requests.RequestException:
+            # Fallback to datasets endpoint
+            client.get(f"{base}/api/v3/datasets?page[size]=1", timeout=10, conditional=False, max_attempts=1)
             return True
-        # Fallback to datasets endpoint
-        response = get_with_fast_fail(requests.get, f"{base}/api/v3/datasets?page[size]=1", timeout=10)
-        return response.status_code == 200
     except ValueError:
         return False
     except Exception:
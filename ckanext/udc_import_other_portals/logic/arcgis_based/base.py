@@ -15,18 +15,20 @@ from typing import List, Optional, Set
 
 from ckanext.udc_import_other_portals.model import CUDCImportConfig
 from ckanext.udc_import_other_portals.worker.socketio_client import SocketClient
-from ckanext.udc_import_other_portals.logger import ImportLogger
+from ckanext.udc_import_other_portals.logger import ImportLogger, job_log_path
 from ckanext.udc_import_other_portals.logic.arcgis_based.api import (
     get_all_datasets,
     check_site_alive
 )
+from ckanext.udc_import_other_portals.logic.arcgis_based.http_client import get_client
+from ckanext.udc_import_other_portals.logic.arcgis_based.refresh import read_source_last_updated
 from ckanext.udc_import_other_portals.logic.base import (
     BaseImport,
-    purge_package,
     get_package as get_self_package,
-    get_package_ids_by_import_config_id,
     ensure_license,
+    import_workers,
 )
+from ckanext.udc_import_other_portals.logic.imported_id_map import ImportedIdMap
 from ckan import model
 
 
@@ -47,6 +49,8 @@ class ArcGISBasedImport(BaseImport):
         self.base_api = other_config.get("base_api")
         self.source_portal = getattr(self, "source_portal", "") or ""
         self.language = other_config.get("language") or getattr(self, "language", None)
+        # package id -> (name, title, source_last_updated), loaded by run_imports()
+        self.source_last_updated_snapshot = None
         
         # Validate that base_api is provided
         if not self.base_api:
@@ -327,6 +331,20 @@ class ArcGISBasedImport(BaseImport):
                     return value
         return None
 
+    def _existing_source_last_updated(self, mapped_id: str) -> Optional[tuple]:
+        """(name, title, source_last_updated) of an imported package, None if it does not exist."""
+        if self.source_last_updated_snapshot is not None:
+            return self.source_last_updated_snapshot.get(mapped_id)
+        try:
+            existing_package = get_self_package(self.build_context(), mapped_id)
+        except Exception:
+            return None
+        return (
+            existing_package.get("name"),
+            existing_package.get("title"),
+            self._source_last_updated_from_package(existing_package),
+        )
+
     def _should_skip_existing_package(self, src: dict, mapped_id: Optional[str]) -> bool:
         if not mapped_id:
             return False
@@ -335,18 +353,16 @@ class ArcGISBasedImport(BaseImport):
         if not current_source_last_updated:
             return False
 
-        try:
-            existing_package = get_self_package(self.build_context(), mapped_id)
-        except Exception:
+        existing = self._existing_source_last_updated(mapped_id)
+        if not existing:
             return False
-
-        existing_source_last_updated = self._source_last_updated_from_package(existing_package)
+        existing_name, existing_title, existing_source_last_updated = existing
         if existing_source_last_updated != current_source_last_updated:
             return False
 
         attributes = src.get("attributes") or {}
-        package_name = existing_package.get("name") or attributes.get("name") or src.get("id") or ""
-        package_title = existing_package.get("title") or attributes.get("name") or package_name
+        package_name = existing_name or attributes.get("name") or src.get("id") or ""
+        package_title = existing_title or attributes.get("name") or package_name
         self.logger.info(
             f"Skip unchanged package {package_name} ({mapped_id}): source_last_updated={current_source_last_updated}"
         )
@@ -744,14 +760,22 @@ class ArcGISBasedImport(BaseImport):
         """
         self.running = True
         self.socket_client = SocketClient(self.job_id)
-        self.logger = ImportLogger(base_logger, 0, self.socket_client)
-        
-        # Fetch all datasets from ArcGIS Hub
-        self.all_datasets = get_all_datasets(
-            self.base_api, 
-            cb=lambda x: self.logger.info(x)
+        self.logger = ImportLogger(
+            base_logger, 0, self.socket_client, log_file=job_log_path(self.job_id)
         )
         
+        # A job re-queued after a worker restart resumes from its checkpoint
+        resuming = self.load_checkpoint()
+        if self.checkpoint.record_complete:
+            self.all_datasets = list(self.checkpoint.replay())
+        else:
+            # Fetch all datasets from ArcGIS Hub
+            self.checkpoint.clear()
+            self.all_datasets = list(self.checkpoint.record(get_all_datasets(
+                self.base_api, 
+                cb=lambda x: self.logger.info(x)
+            )))
+        
         # Preprocess the datasets, includes filtering and adding extra data
         self.all_datasets = [*self.iterate_imports()]
         
@@ -775,90 +799,52 @@ class ArcGISBasedImport(BaseImport):
             base_logger.info("Make sure remote endpoint is alive")
             if check_site_alive(self.base_api):
                 
-                # remote ID -> cudc ID
-                imported_id_map = {}
-                
-                def _delete_all_imports():
-                    for package_id_to_delete in get_package_ids_by_import_config_id(
-                        self.build_context(), self.import_config.id
-                    ):
-                        try:
-                            package_to_delete = get_self_package(
-                                self.build_context(), package_id_to_delete
-                            )
-                            purge_package(self.build_context(), package_id_to_delete)
-                            self.logger.finished_one(
-                                'deleted', 
-                                package_id_to_delete, 
-                                package_to_delete['name'], 
-                                package_to_delete['title']
-                            )
-                        except Exception as e:
-                            self.logger.error(
-                                f"ERROR: Failed to get package {package_id_to_delete} from remote"
-                            )
-                            self.logger.exception(e)
-                
-                if self.import_config.other_data.get("imported_id_map"):
-                    imported_id_map = self.import_config.other_data["imported_id_map"]
-                else:
+                # remote ID <-> cudc ID
+                imported_id_map = self.load_imported_id_map()
+                if not imported_id_map:
                     # Backward compatibility without imported_id_map
                     # Delete all previous imports
-                    _delete_all_imports()
+                    self.delete_all_imports()
 
                 # Remove datasets that are removed from the remote
                 if len(imported_id_map):
-                    if self.should_delete_previously_imported_for_run():
+                    if not resuming and self.should_delete_previously_imported_for_run():
                         # Delete all datasets that were previously imported
-                        _delete_all_imports()
-                        imported_id_map = {}
+                        self.delete_all_imports()
+                        imported_id_map = ImportedIdMap()
                         self._imported_map_pending += 1
                         self._persist_imported_id_map(imported_id_map, force=True)
                     else:
                         # Get all datasets that are deleted from the remote server, Remove them in ours
-                        for dataset_id_to_remove in [
-                            v for k, v in imported_id_map.items() 
-                            if k not in self.dataset_ids
-                        ]:
-                            try:
-                                package_to_delete = get_self_package(
-                                    self.build_context(), dataset_id_to_remove
-                                )
-                                purge_package(self.build_context(), dataset_id_to_remove)
-                                self.logger.finished_one(
-                                    'deleted', 
-                                    dataset_id_to_remove, 
-                                    package_to_delete['name'], 
-                                    package_to_delete['title']
-                                )
-                                # Remove from imported_id_map
-                                keys_to_remove = [
-                                    k for k, v in imported_id_map.items() 
-                                    if v == dataset_id_to_remove
-                                ]
-                                for k in keys_to_remove:
-                                    imported_id_map.pop(k, None)
-                                if keys_to_remove:
-                                    self._imported_map_pending += 1
-                                    self._persist_imported_id_map(imported_id_map)
-                            except Exception as e:
-                                self.logger.error(
-                                    f"ERROR: Failed to get package {dataset_id_to_remove} from remote"
-                                )
-                                self.logger.exception(e)
+                        dataset_ids = set(self.dataset_ids)
+                        stale_ids = imported_id_map.package_ids(
+                            [k for k in imported_id_map if k not in dataset_ids]
+                        )
+                        for package_id in self.purge_imported_packages(stale_ids):
+                            imported_id_map.remove_package(package_id)
+                            self._imported_map_pending += 1
+
+                # Record the snapshot in the checkpoint before importing
+                self._persist_imported_id_map(imported_id_map, force=True)
+
+                # Unchanged datasets are skipped by comparing with this, not with package_show
+                self.source_last_updated_snapshot = read_source_last_updated(self.import_config.id)
 
                 # Iterate remote datasets
                 base_logger.info("Starting iteration")
-                with ThreadPoolExecutor(max_workers=4) as executor:
+                with ThreadPoolExecutor(max_workers=import_workers()) as executor:
                     self.socket_client.executor = executor
-                    futures = {
-                        executor.submit(
+                    futures = {}
+                    for position, src in enumerate(self.all_datasets):
+                        if self.checkpoint.is_finished(position):
+                            # Processed before the job was interrupted
+                            self.logger.current += 1
+                            continue
+                        futures[executor.submit(
                             self.process_package, 
                             src, 
                             imported_id_map.get(src.get("id"))
-                        ): src 
-                        for src in self.all_datasets
-                    }
+                        )] = position
                     for future in as_completed(futures):
                         try:
                             result = future.result()
@@ -872,6 +858,10 @@ class ArcGISBasedImport(BaseImport):
                         except Exception as e:
                             self.logger.error('ERROR: A dataset import failed.')
                             self.logger.exception(e)
+                        finally:
+                            self.checkpoint.finished(futures[future])
+                            self._imported_map_pending += 1
+                            self._persist_imported_id_map(imported_id_map)
                         
                         if self.socket_client.stop_requested:
                             break
@@ -880,6 +870,9 @@ class ArcGISBasedImport(BaseImport):
                     self.socket_client.executor = None
                 
                 self._persist_imported_id_map(imported_id_map, force=True)
+                if not self.socket_client.stop_requested:
+                    self.clear_checkpoint()
+                self.logger.info(f"ArcGIS HTTP client: {get_client().stats_snapshot()}")
             else:
                 self.logger.error(f'ERROR: Remote endpoint is not alive!')
             
@@ -0,0 +1,185 @@
+"""
+Shared HTTP client for the ArcGIS Hub APIs (search, catalog, datasets).
+
+One keep-alive `requests.Session` per host with a bounded connection pool,
+at most `per_host_limit` requests in flight per host, adaptive backoff on
+429/5xx (honouring Retry-After), and conditional GETs (ETag /
+If-Modified-Since) for JSON responses that were seen before.
+"""
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.models import PreparedRequest
+
+from .http_utils import get_with_fast_fail
+
+logger = logging.getLogger(__name__)
+
+
+def arcgis_client_options(config) -> dict:
+    """Read the settings of ArcGISHttpClient from the CKAN config."""
+    return {
+        "per_host_limit": int(config.get("ckanext.udc.arcgis.per_host_limit", 16)),
+        "max_attempts": int(config.get("ckanext.udc.arcgis.max_attempts", 6)),
+        "cache_size": int(config.get("ckanext.udc.arcgis.cache_size", 4096)),
+        "connect_timeout": float(config.get("ckanext.udc.arcgis.connect_timeout", 5)),
+        "read_timeout": float(config.get("ckanext.udc.arcgis.read_timeout", 60)),
+    }
+
+
+class _HostPool:
+    def __init__(self, limit: int):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=limit, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.semaphore = threading.BoundedSemaphore(limit)
+        # Extra delay before each request, raised on 429/5xx and decayed on success
+        self.delay = 0.0
+        self.lock = threading.Lock()
+
+
+class ArcGISHttpClient:
+    """Thread-safe; share one instance (see get_client())."""
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, per_host_limit=16, max_attempts=6, backoff_base=0.5, backoff_max=60.0,
+                 cache_size=4096, connect_timeout=5, read_timeout=60):
+        self.per_host_limit = max(int(per_host_limit), 1)
+        self.max_attempts = max(int(max_attempts), 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache_size = cache_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._hosts = {}
+        self._lock = threading.Lock()
+        # url -> (etag, last_modified, payload)
+        self._cache = OrderedDict()
+        self.stats = {"requests": 0, "retries": 0, "not_modified": 0}
+
+    def _pool(self, url: str) -> _HostPool:
+        host = urlparse(url).netloc
+        with self._lock:
+            pool = self._hosts.get(host)
+            if pool is None:
+                pool = self._hosts[host] = _HostPool(self.per_host_limit)
+            return pool
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _backoff(self, pool: _HostPool, attempt: int, retry_after: Optional[str]) -> float:
+        with pool.lock:
+            pool.delay = min(max(pool.delay * 2, self.backoff_base), self.backoff_max)
+            delay = pool.delay
+        wait = min(self.backoff_base * 2 ** attempt, self.backoff_max) * (0.5 + random.random() / 2)
+        try:
+            wait = max(wait, float(retry_after)) if retry_after else wait
+        except ValueError:
+            pass
+        return max(wait, delay)
+
+    def get(self, url: str, params=None, timeout=None, conditional=True, max_attempts=None) -> requests.Response:
+        """
+        GET with retries. Raises requests.HTTPError for a final error status and
+        ValueError for DNS/SSL failures (see get_with_fast_fail).
+        """
+        return self._request(url, params, timeout, conditional, max_attempts)[0]
+
+    def get_json(self, url: str, params=None, timeout=None, conditional=True, max_attempts=None):
+        """GET a JSON document; served from the cache when the server answers 304."""
+        return self._request(url, params, timeout, conditional, max_attempts)[1]
+
+    def _request(self, url, params, timeout, conditional, max_attempts=None):
+        max_attempts = max_attempts or self.max_attempts
+        prepared = PreparedRequest()
+        prepared.prepare_url(url, params)
+        full_url = prepared.url
+        pool = self._pool(full_url)
+
+        headers = {}
+        cached = None
+        if conditional:
+            with self._lock:
+                cached = self._cache.get(full_url)
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        attempt = 0
+        while True:
+            if pool.delay:
+                time.sleep(pool.delay)
+            with pool.semaphore:
+                self._count("requests")
+                try:
+                    response = get_with_fast_fail(
+                        pool.session.get, full_url, headers=headers, timeout=timeout or self.timeout
+                    )
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt + 1 >= max_attempts:
+                        raise
+                    response = None
+
+            if response is not None and response.status_code not in self.RETRY_STATUSES:
+                break
+            attempt += 1
+            if attempt >= max_attempts:
+                break
+            self._count("retries")
+            wait = self._backoff(pool, attempt, response.headers.get("Retry-After") if response is not None else None)
+            logger.info(f"Retrying {full_url} in {wait:.1f}s (attempt {attempt + 1}/{max_attempts})")
+            time.sleep(wait)
+
+        with pool.lock:
+            pool.delay = pool.delay / 2 if pool.delay > 0.05 else 0.0
+
+        if response.status_code == 304 and cached:
+            self._count("not_modified")
+            with self._lock:
+                if full_url in self._cache:
+                    self._cache.move_to_end(full_url)
+            return response, cached[2]
+
+        response.raise_for_status()
+        payload = response.json()
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if conditional and (etag or last_modified) and self.cache_size:
+            with self._lock:
+                self._cache[full_url] = (etag, last_modified, payload)
+                self._cache.move_to_end(full_url)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return response, payload
+
+    def stats_snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "hosts": len(self._hosts), "cached": len(self._cache)}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ArcGISHttpClient:
+    """The process-wide client, configured from the CKAN config on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from ckan.plugins.toolkit import config
+                _client = ArcGISHttpClient(**arcgis_client_options(config))
+    return _client
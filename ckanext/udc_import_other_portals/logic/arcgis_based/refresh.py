@@ -0,0 +1,202 @@
+"""
+Refresh of the source_last_updated import extra of an ArcGIS import config.
+
+The upstream modified timestamps come from the paged dataset listing (only the
+modified fields are requested), ours from one SQL query over the package
+extras. Packages whose timestamp differs get their udc_import_extras rewritten
+in batched transactions, then are re-indexed with one Solr commit. Nothing
+else of the package changes, so the package is not re-validated and the
+knowledge graph (which does not map the import extras) is not synced.
+
+read_source_last_updated() gives an import run the same values for all the
+config's packages at once, so it can skip unchanged datasets without a
+package_show each.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import ckan.model as model
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+
+from ..base import deferred_search_indexing, index_packages
+from .api import get_all_datasets
+
+SOURCE_LAST_UPDATED = "source_last_updated"
+# Dataset attributes needed by the refresh
+MODIFIED_FIELDS = "itemModified,modified"
+
+
+def source_last_updated_iso(attributes: Dict[str, Any]) -> Optional[str]:
+    """Convert upstream ArcGIS modified fields to the ISO format used in extras."""
+    # ArcGIS uses either itemModified or modified depending on item type.
+    modified_ms = (attributes or {}).get("itemModified") or (attributes or {}).get("modified")
+    if not modified_ms:
+        return None
+    return datetime.utcfromtimestamp(modified_ms / 1000).isoformat()
+
+
+def upstream_source_last_updated(datasets: Iterable[dict]) -> Dict[str, Optional[str]]:
+    """remote id -> source_last_updated of the listed datasets."""
+    return {
+        dataset["id"]: source_last_updated_iso(dataset.get("attributes") or {})
+        for dataset in datasets
+        if dataset.get("id")
+    }
+
+
+def fetch_upstream_source_last_updated(base_api: str, cb=None) -> Dict[str, Optional[str]]:
+    return upstream_source_last_updated(get_all_datasets(base_api, fields=MODIFIED_FIELDS, cb=cb))
+
+
+def _update_import_extra(extras: List[Dict[str, Any]], key: str, value: str) -> List[Dict[str, Any]]:
+    """Replace or append a single key/value pair inside the import extras list."""
+    # Replace any existing key so the refresh stays idempotent.
+    updated = [item for item in extras if item.get("key") != key]
+    updated.append({"key": key, "value": value})
+    return updated
+
+
+def _load_import_extras(raw: Optional[str]) -> List[Dict[str, Any]]:
+    try:
+        extras = json.loads(raw) if raw else []
+    except ValueError:
+        return []
+    return [item for item in extras if isinstance(item, dict)] if isinstance(extras, list) else []
+
+
+_config_extra = aliased(model.PackageExtra, name="config_extra")
+_remote_extra = aliased(model.PackageExtra, name="remote_extra")
+_import_extra = aliased(model.PackageExtra, name="import_extra")
+
+
+def _config_packages_query(import_config_id: str, *columns):
+    """Query `columns` over the config's packages joined with their remote id and import extras."""
+    Package = model.Package
+    return (
+        model.Session.query(*columns)
+        .join(_config_extra, and_(
+            _config_extra.package_id == Package.id,
+            _config_extra.key == "cudc_import_config_id",
+            _config_extra.value == import_config_id,
+        ))
+        .outerjoin(_remote_extra, and_(
+            _remote_extra.package_id == Package.id,
+            _remote_extra.key == "cudc_import_remote_id",
+        ))
+        .outerjoin(_import_extra, and_(
+            _import_extra.package_id == Package.id,
+            _import_extra.key == "udc_import_extras",
+        ))
+    )
+
+
+def read_import_extras(import_config_id: str) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """(package id, cudc_import_remote_id, udc_import_extras JSON) of the config's active packages."""
+    return (
+        _config_packages_query(import_config_id, model.Package.id, _remote_extra.value, _import_extra.value)
+        .filter(model.Package.state == "active")
+        .all()
+    )
+
+
+def source_last_updated_from_extras(raw: Optional[str]) -> Optional[str]:
+    for item in _load_import_extras(raw):
+        value = item.get("value")
+        if item.get("key") == SOURCE_LAST_UPDATED and isinstance(value, str) and value:
+            return value
+    return None
+
+
+def read_source_last_updated(import_config_id: str, chunk: int = 1000) -> Dict[str, Tuple[str, str, Optional[str]]]:
+    """
+    package id -> (name, title, source_last_updated) of every package of the
+    config, read in one streaming query.
+    """
+    Package = model.Package
+    query = _config_packages_query(import_config_id, Package.id, Package.name, Package.title, _import_extra.value)
+    return {
+        package_id: (name, title, source_last_updated_from_extras(raw_extras))
+        for package_id, name, title, raw_extras in query.yield_per(chunk)
+    }
+
+
+def plan_refresh(
+    rows: Iterable[Tuple[str, Optional[str], Optional[str]]],
+    upstream: Dict[str, Optional[str]],
+) -> Tuple[Dict[str, str], List[Tuple[str, str]], int]:
+    """
+    Compare our source_last_updated values with the upstream ones.
+
+    :returns: (package id -> new udc_import_extras JSON of the changed packages,
+        [(package id, reason)] of the skipped packages, number of unchanged packages)
+    """
+    changes, skipped, unchanged = {}, [], 0
+    for package_id, remote_id, raw_extras in rows:
+        if not remote_id:
+            skipped.append((package_id, "missing cudc_import_remote_id"))
+            continue
+        if remote_id not in upstream:
+            skipped.append((package_id, f"upstream dataset not found ({remote_id})"))
+            continue
+        current = upstream[remote_id]
+        if not current:
+            skipped.append((package_id, f"upstream dataset has no modified timestamp ({remote_id})"))
+            continue
+        extras = _load_import_extras(raw_extras)
+        if any(item.get("key") == SOURCE_LAST_UPDATED and item.get("value") == current for item in extras):
+            unchanged += 1
+            continue
+        # Keep the existing import extras payload intact and only replace this one key.
+        changes[package_id] = json.dumps(
+            _update_import_extra(extras, SOURCE_LAST_UPDATED, current), ensure_ascii=False
+        )
+    return changes, skipped, unchanged
+
+
+def write_import_extras(changes: Dict[str, str], batch_size: int = 500, cb=None) -> List[str]:
+    """
+    Store the new udc_import_extras values, one transaction per `batch_size`
+    packages, then index the written packages with one Solr commit. Automatic
+    indexing skips them at each commit, as in import_packages.
+    """
+    written = []
+    package_ids = list(changes)
+    try:
+        for start in range(0, len(package_ids), batch_size):
+            chunk = package_ids[start:start + batch_size]
+            try:
+                with deferred_search_indexing(chunk):
+                    extras = (
+                        model.Session.query(model.PackageExtra)
+                        .filter(model.PackageExtra.package_id.in_(chunk))
+                        .filter(model.PackageExtra.key == "udc_import_extras")
+                        .all()
+                    )
+                    existing = {extra.package_id: extra for extra in extras}
+                    for package_id in chunk:
+                        extra = existing.get(package_id)
+                        if extra is None:
+                            model.Session.add(model.PackageExtra(
+                                package_id=package_id, key="udc_import_extras", value=changes[package_id]
+                            ))
+                        else:
+                            extra.value = changes[package_id]
+                    (
+                        model.Session.query(model.Package)
+                        .filter(model.Package.id.in_(chunk))
+                        .update({"metadata_modified": datetime.utcnow()}, synchronize_session=False)
+                    )
+                    model.Session.commit()
+            except Exception:
+                model.Session.rollback()
+                raise
+            written.extend(chunk)
+            if cb:
+                cb(f"Updated source_last_updated of {len(written)}/{len(package_ids)} packages")
+    finally:
+        # Committed batches are indexed even if a later one failed
+        if written:
+            index_packages(written)
+    return written
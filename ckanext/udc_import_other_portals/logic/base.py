@@ -1,18 +1,26 @@
+from ckanext.udc_import_other_portals.checkpoint import ImportCheckpoint, job_checkpoint_prefix
 from ckanext.udc_import_other_portals.logger import ImportLogger, generate_trace
-from ckanext.udc_import_other_portals.model import CUDCImportConfig
+from ckanext.udc_import_other_portals.model import CUDCImportConfig, CUDCImportJob
 from ckanext.udc_import_other_portals.worker.socketio_client import SocketClient
+from ckanext.udc.related_packages import invalidate_related_packages
+from ckanext.udc.search.facet_store import remove_packages_facet_values
 import ckan.plugins.toolkit as toolkit
 from ckan.types import Context
 import ckan.logic as logic
 import ckan.model as model
 from ckan.common import current_user
-from ckan.lib.search.common import SearchIndexError
+from ckan.lib.search.common import SearchIndexError, make_connection
+from ckan.lib import search
+from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 
 import threading
 import time
-from typing import List, Dict, cast
-from .deduplication import find_duplicated_packages, process_duplication
+from contextlib import contextmanager
+from typing import List, Dict, Iterable, Tuple, cast
+from .batch_writer import PackageBatchWriter
+from .imported_id_map import ImportedIdMap
+from .deduplication import build_fingerprint_index, find_duplicated_packages, process_duplication
 
 import logging
 import uuid
@@ -25,6 +33,11 @@ class ImportError(ValueError):
     pass
 
 
+def import_workers() -> int:
+    """Number of threads that import packages concurrently."""
+    return max(int(toolkit.config.get("ckanext.udc.import.workers", 4)), 1)
+
+
 def get_package(context: Context, package_id: str = None, package_name: str = None):
     if not package_id and not package_name:
         raise ValueError("Either package_id or package_name should be provided.")
@@ -83,45 +96,156 @@ def check_existing_package_id_or_name(context, id: str = None, name: str = None)
     return False
 
 
-def import_package(context: Context, package: dict, merge: bool = False):
+def resolve_existing_packages(ids: Iterable[str], names: Iterable[str]) -> Tuple[set, set]:
     """
-    :param merge: Merge with the fields from the existing package
+    The ids and the names (of any state) already used by packages, in one SQL query.
+    """
+    ids, names = list(set(ids)), list(set(names))
+    if not ids and not names:
+        return set(), set()
+    rows = (
+        model.Session.query(model.Package.id, model.Package.name)
+        .filter(or_(model.Package.id.in_(ids), model.Package.name.in_(names)))
+        .all()
+    )
+    return {row.id for row in rows}, {row.name for row in rows}
+
+
+def resolve_package_states(ids: Iterable[str]) -> Dict[str, str]:
     """
-    is_id_existed = check_existing_package_id_or_name(context, id=package["id"])
-    is_name_existed = check_existing_package_id_or_name(context, name=package["name"])
-    print(is_id_existed, is_name_existed)
+    The state of each package of `ids` that still exists, in one SQL query.
+    """
+    ids = list(set(ids))
+    if not ids:
+        return {}
+    rows = (
+        model.Session.query(model.Package.id, model.Package.state)
+        .filter(model.Package.id.in_(ids))
+        .all()
+    )
+    return {row.id: row.state for row in rows}
 
-    if not is_id_existed and is_name_existed:
-        raise ImportError(
-            f'There is a package name={package["name"]} with the "different id" but the "same name".'
-        )
 
-    existing_package = {}
-    action = "package_create"
+_SKIP_INDEXING = "cudc_skip_indexing"
+_index_notified_package = search.SynchronousSearchPlugin.notify
+
 
+def _notify_search_index(self, entity, operation):
+    """
+    SynchronousSearchPlugin.notify, CKAN's automatic indexing, except for the
+    packages whose indexing this thread deferred (see deferred_search_indexing).
+    The other IDomainObjectModification observers are notified as usual.
+    """
+    package_ids = model.Session.info.get(_SKIP_INDEXING)
+    if package_ids and isinstance(entity, model.Package) and entity.id in package_ids:
+        return
+    _index_notified_package(self, entity, operation)
+
+
+search.SynchronousSearchPlugin.notify = _notify_search_index
+
+
+@contextmanager
+def deferred_search_indexing(package_ids: Iterable[str]):
+    """
+    Skip the automatic indexing of these packages when this thread's session
+    commits; the caller indexes them. Writes of other threads and of other
+    packages are indexed as usual.
+    """
+    info = model.Session.info
+    previous = info.get(_SKIP_INDEXING)
+    info[_SKIP_INDEXING] = set(package_ids) | (previous or set())
     try:
-        existing_package = get_package(context, package["id"])
-        # If there is an existing package, we should call 'package_update'
-        action = "package_update"
-    except:
-        pass
+        yield
+    finally:
+        if previous is None:
+            info.pop(_SKIP_INDEXING, None)
+        else:
+            info[_SKIP_INDEXING] = previous
 
-    if merge:
-        existing_package.update(package)
-    else:
-        existing_package = package
 
-    logic.check_access("package_show", context, data_dict=existing_package)
-    logic.check_access(action, context, data_dict=existing_package)
-    # print(action, existing_package)
+def index_packages(package_ids: List[str]):
+    """Index the packages without a Solr commit each, then commit once."""
+    search.rebuild(package_ids=package_ids, defer_commit=True, quiet=True)
+    search.commit()
+
+
+def import_packages(context: Context, packages: List[dict], merge: bool = False) -> list:
+    """
+    Create or update a batch of packages in one transaction and index them with
+    one Solr commit. If the batch fails, its packages are written one by one.
+
+    :param merge: Merge with the fields from the existing packages
+    :returns: one entry per package, "created"/"updated" or the exception raised for it.
+    """
+    existing_ids, existing_names = resolve_existing_packages(
+        [p["id"] for p in packages], [p["name"] for p in packages]
+    )
+    results = [None] * len(packages)
+    plan = []
+    batch_names = set()
+    for i, package in enumerate(packages):
+        is_id_existed = package["id"] in existing_ids
+        if not is_id_existed and (package["name"] in existing_names or package["name"] in batch_names):
+            results[i] = ImportError(
+                f'There is a package name={package["name"]} with the "different id" but the "same name".'
+            )
+            continue
+        batch_names.add(package["name"])
+        action = "package_update" if is_id_existed else "package_create"
+        data = package
+        if merge and is_id_existed:
+            try:
+                data = {**get_package(context, package["id"]), **package}
+            except Exception as e:
+                results[i] = e
+                continue
+        plan.append((i, action, data))
+
+    def _write(i, action, data, action_context):
+        logic.check_access("package_show", action_context, data_dict=data)
+        logic.check_access(action, action_context, data_dict=data)
+        logic.get_action(action)(action_context, data)
+        results[i] = "created" if action == "package_create" else "updated"
+
     try:
-        logic.get_action(action)(context, existing_package)
-    except IntegrityError as e:
-        base_logger.error(f"IntegrityError: {e}")
-        # Rollback session to make sure future transactions are not affected
+        with deferred_search_indexing(data["id"] for i, action, data in plan):
+            for i, action, data in plan:
+                _write(i, action, data, {**(context or {}), "defer_commit": True})
+            model.Session.commit()
+    except Exception as e:
+        base_logger.warning(f"Batch write of {len(plan)} packages failed, writing them one by one: {e}")
         model.Session.rollback()
-        raise e
-    return "created" if action == "package_create" else "updated"
+        for i, action, data in plan:
+            try:
+                _write(i, action, data, dict(context or {}))
+            except Exception as e:
+                if isinstance(e, IntegrityError):
+                    base_logger.error(f"IntegrityError: {e}")
+                # Rollback session to make sure future transactions are not affected
+                model.Session.rollback()
+                results[i] = e
+        return results
+
+    written = [data["id"] for i, action, data in plan]
+    if written:
+        try:
+            index_packages(written)
+        except Exception as e:
+            base_logger.error(f"Failed to index {len(written)} imported packages: {e}")
+            for i, action, data in plan:
+                results[i] = SearchIndexError(f'Package {data["name"]} is saved but not indexed: {e}')
+    return results
+
+
+def import_package(context: Context, package: dict, merge: bool = False):
+    """
+    :param merge: Merge with the fields from the existing package
+    """
+    result = import_packages(context, [package], merge)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
 
 def delete_package(context: Context, package_id: str):
@@ -136,6 +260,81 @@ def purge_package(context: Context, package_id: str):
     logic.check_access("dataset_purge", context, data_dict={"id": package_id})
     logic.get_action("dataset_purge")(context, {"id": package_id})
 
+def _delete_from_index(package_ids: List[str]):
+    """Remove the packages from Solr with one delete query."""
+    ids = " OR ".join(f'"{package_id}"' for package_id in package_ids)
+    site_id = toolkit.config.get("ckan.site_id")
+    make_connection().delete(q=f'+site_id:"{site_id}" +id:({ids})', commit=True)
+
+
+def purge_packages(context: Context, package_ids: Iterable[str], batch_size: int = 100,
+                   cb=None) -> Tuple[Dict[str, Tuple[str, str]], Dict[str, Exception]]:
+    """
+    Purge packages like dataset_purge, `batch_size` at a time: one transaction
+    and one Solr delete query per batch. The facet counts and the related
+    packages cache are kept in line, as in organization/bulk.py. If a batch
+    fails, its packages are purged one by one.
+
+    :param cb: called with (number purged, number of packages) after each batch
+    :returns: (purged id -> (name, title), failed id -> exception)
+    """
+    package_ids = list(dict.fromkeys(package_ids))
+    purged, failed = {}, {}
+    for start in range(0, len(package_ids), batch_size):
+        chunk = package_ids[start:start + batch_size]
+        packages = model.Session.query(model.Package).filter(model.Package.id.in_(chunk)).all()
+        found = {package.id: package for package in packages}
+        batch = []
+        for package_id in chunk:
+            if package_id not in found:
+                failed[package_id] = logic.NotFound(f"Package id={package_id} is not found.")
+                continue
+            try:
+                logic.check_access("dataset_purge", context, data_dict={"id": package_id})
+            except Exception as e:
+                failed[package_id] = e
+                continue
+            batch.append(found[package_id])
+        info = {package.id: (package.name, package.title) for package in batch}
+        if not batch:
+            continue
+
+        try:
+            with deferred_search_indexing(info):
+                remove_packages_facet_values(list(info))
+                (
+                    model.Session.query(model.Member)
+                    .filter(model.Member.table_id.in_(list(info)))
+                    .filter(model.Member.state == "active")
+                    .update({"state": "deleted"}, synchronize_session=False)
+                )
+                for package in batch:
+                    package.purge()
+                model.Session.commit()
+        except Exception as e:
+            base_logger.warning(f"Batch purge of {len(batch)} packages failed, purging them one by one: {e}")
+            model.Session.rollback()
+            for package_id, name_title in info.items():
+                try:
+                    purge_package(context, package_id)
+                    purged[package_id] = name_title
+                except Exception as e:
+                    model.Session.rollback()
+                    failed[package_id] = e
+            continue
+
+        try:
+            _delete_from_index(list(info))
+        except Exception as e:
+            base_logger.error(f"Failed to remove {len(info)} purged packages from the search index: {e}")
+        purged.update(info)
+        if cb:
+            cb(len(purged), len(package_ids))
+    if purged:
+        invalidate_related_packages()
+    return purged, failed
+
+
 def get_organization(context: Context, organization_id: str = None):
     data_dict = {"id": organization_id}
     logic.check_access("organization_show", context, data_dict=data_dict)
@@ -174,7 +373,7 @@ class BaseImport:
     Abstract class that manages logging and provides interface to backend APIs
     """
 
-    logger = ImportLogger(base_logger)
+    logger: ImportLogger = None
     import_size = 0
     running = False
     socket_client: SocketClient = None
@@ -183,8 +382,21 @@ class BaseImport:
         self.context = context
         self.import_config = import_config
         self.job_id = job_id
+        # Replaced by a logger spilling to the job log file in run_imports()
+        self.logger = ImportLogger(base_logger)
         self._imported_map_pending = 0
         self._last_imported_map_persist = 0.0
+        # Per-package watermarks of incremental imports, persisted with imported_id_map
+        self._import_watermarks = None
+        # Imported packages deleted outside the importer, restored when imported again
+        self._restore_ids = set()
+        # Dedup fingerprint index, built on the first duplication check of the run
+        self._dedup_index = None
+        self._dedup_index_built = False
+        self._dedup_index_lock = threading.Lock()
+        self._package_writer = None
+        # Resume point of the job, see load_checkpoint()
+        self.checkpoint: ImportCheckpoint = None
 
     def build_context(self):
         if not self.context:
@@ -215,9 +427,13 @@ class BaseImport:
                 return
 
         # Persist the mapping to survive main-process restarts during long imports.
-        self.import_config.other_data["imported_id_map"] = imported_id_map
+        self.import_config.other_data["imported_id_map"] = dict(imported_id_map)
+        if self._import_watermarks is not None:
+            self.import_config.other_data["import_watermarks"] = self._import_watermarks
         if self.import_config.other_data.get("imported_ids"):
             del self.import_config.other_data["imported_ids"]
+        # Saved in the same commit, so a resumed job agrees with imported_id_map
+        self._stage_checkpoint()
 
         try:
             model.Session.add(self.import_config)
@@ -228,6 +444,100 @@ class BaseImport:
             # Failed commit should not poison future DB operations.
             model.Session.rollback()
 
+    def load_checkpoint(self) -> bool:
+        """
+        Load the checkpoint of this job. True when the job resumes a previous
+        attempt that was interrupted (e.g. by a worker restart).
+        """
+        job = CUDCImportJob.get(self.job_id) if self.import_config else None
+        state = ((job.other_data or {}) if job else {}).get("checkpoint")
+        self.checkpoint = ImportCheckpoint(job_checkpoint_prefix(self.job_id), state)
+        if state:
+            self.logger.info(
+                f"INFO: Resuming from the checkpoint, {self.checkpoint.finished_count} packages already processed."
+            )
+        return bool(state)
+
+    def _stage_checkpoint(self, state=None):
+        if self.checkpoint is None:
+            return
+        if state is None:
+            self.checkpoint.flush()
+            state = self.checkpoint.state
+        job = CUDCImportJob.get_for_update(self.job_id)
+        if job:
+            job.other_data = {**(job.other_data or {}), "checkpoint": state}
+            model.Session.add(job)
+
+    def clear_checkpoint(self):
+        """The run completed: remove the snapshot and the checkpoint."""
+        if self.checkpoint is None:
+            return
+        self.checkpoint.clear()
+        self._stage_checkpoint(state={})
+        try:
+            model.Session.commit()
+        except Exception:
+            model.Session.rollback()
+
+    def _get_dedup_index(self):
+        """
+        The fingerprint index of the existing packages, or None when it is disabled
+        (ckanext.udc.import.dedup_index) or could not be built; deduplication then
+        falls back to one Solr search per rule.
+        """
+        if self._dedup_index_built:
+            return self._dedup_index
+        with self._dedup_index_lock:
+            if not self._dedup_index_built:
+                context = self.build_context()
+                if context and toolkit.asbool(toolkit.config.get("ckanext.udc.import.dedup_index", True)):
+                    try:
+                        self._dedup_index = build_fingerprint_index(
+                            context, self.import_config.id, cb=self.logger.info
+                        )
+                    except Exception as e:
+                        self.logger.warning(f"Cannot build the deduplication index, using Solr searches: {e}")
+                self._dedup_index_built = True
+        return self._dedup_index
+
+    def _write_package(self, package: dict, merge: bool = False) -> str:
+        """Create or update the package, batched with the other importer threads."""
+        if self._package_writer is None:
+            with lock:
+                if self._package_writer is None:
+                    self._package_writer = PackageBatchWriter(
+                        lambda packages, merge: import_packages(self.build_context(), packages, merge),
+                        batch_size=int(toolkit.config.get("ckanext.udc.import.write_batch_size", 50)),
+                        max_wait=int(toolkit.config.get("ckanext.udc.import.write_batch_wait", 100)) / 1000,
+                        writers=import_workers(),
+                    )
+        return self._package_writer.write(package, merge)
+
+    def load_imported_id_map(self) -> ImportedIdMap:
+        """The remote id -> CUDC id map of the packages imported by this config."""
+        return ImportedIdMap((self.import_config.other_data or {}).get("imported_id_map"))
+
+    def purge_imported_packages(self, package_ids: Iterable[str]) -> List[str]:
+        """Purge packages in batches, logging each of them; returns the purged ids."""
+        purged, failed = purge_packages(
+            self.build_context(),
+            package_ids,
+            batch_size=int(toolkit.config.get("ckanext.udc.import.purge_batch_size", 100)),
+        )
+        for package_id, (name, title) in purged.items():
+            self.logger.finished_one("deleted", package_id, name, title)
+        for package_id, e in failed.items():
+            self.logger.error(f"ERROR: Failed to purge package {package_id}")
+            self.logger.exception(e)
+        return list(purged)
+
+    def delete_all_imports(self):
+        """Purge every package imported by this config."""
+        self.purge_imported_packages(
+            get_package_ids_by_import_config_id(self.build_context(), self.import_config.id)
+        )
+
     def _portal_type_label(self) -> str:
         platform = (self.import_config.platform or "").strip().lower()
         return {
@@ -323,6 +633,8 @@ class BaseImport:
         mapped["cudc_import_remote_id"] = mapped["id"]
         # Preserve the ID if exists
         mapped["id"] = mapped_id if mapped_id else str(uuid.uuid4())
+        if mapped_id in self._restore_ids:
+            mapped["state"] = "active"
         # if mapped_id:
         #     print("Mapped ID:", mapped_id)
 
@@ -377,13 +689,13 @@ class BaseImport:
 
         # Use different context for each package import
         # This will replace with the exisiting package
-        action_done = import_package(self.build_context(), package, merge)
+        action_done = self._write_package(package, merge)
         duplications_log = None
         err_msg = None
 
         # Duplication check
         duplications, reason = find_duplicated_packages(
-            self.build_context(), package, self.import_config.id
+            self.build_context(), package, self.import_config.id, self._get_dedup_index()
         )
 
         if duplications:
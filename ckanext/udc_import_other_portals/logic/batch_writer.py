@@ -0,0 +1,82 @@
+"""
+Group commit for the importer threads.
+
+Each worker thread hands its mapped package to PackageBatchWriter.write() and
+blocks until the package is written. The first waiting thread whose batch is
+full (or whose wait is over) writes the whole batch with one
+`write_batch(packages, merge)` call, e.g. logic.base.import_packages.
+"""
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+
+class PackageBatchWriter:
+    """
+    :param write_batch: called with (packages, merge); returns one entry per
+        package, the action done ("created"/"updated") or the exception raised for it.
+    :param batch_size: write as soon as this many packages are waiting.
+    :param max_wait: seconds a package waits for the batch to fill.
+    :param writers: number of threads calling write(). Each of them waits for
+        its package, so no more than this many packages can be waiting: the
+        batch size is capped to it, and a batch is written once every writer
+        has handed in a package instead of after max_wait.
+    """
+
+    def __init__(self, write_batch: Callable[[List[dict], bool], list], batch_size: int = 50, max_wait: float = 0.1,
+                 writers: Optional[int] = None):
+        self.write_batch = write_batch
+        self.batch_size = max(int(batch_size), 1)
+        if writers:
+            self.batch_size = min(self.batch_size, max(int(writers), 1))
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._pending = []
+        self._flushing = False
+        self.stats = {"batches": 0, "packages": 0}
+
+    def write(self, package: dict, merge: bool = False) -> str:
+        """Write one package with the next batch; raises what writing it raised."""
+        future = Future()
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            self._pending.append((package, merge, future))
+            self._cond.notify_all()
+            while True:
+                if future.done():
+                    return future.result()
+                remaining = deadline - time.monotonic()
+                if not self._flushing and (len(self._pending) >= self.batch_size or remaining <= 0):
+                    batch, self._pending = self._pending, []
+                    self._flushing = True
+                    break
+                # Another thread is writing (our package may be in its batch): wait for it
+                self._cond.wait(remaining if remaining > 0 else None)
+
+        try:
+            self._write(batch)
+        finally:
+            with self._cond:
+                self._flushing = False
+                self._cond.notify_all()
+        return future.result()
+
+    def _write(self, batch):
+        for merge in (False, True):
+            group = [(package, future) for package, m, future in batch if bool(m) == merge]
+            if not group:
+                continue
+            try:
+                results = self.write_batch([package for package, _ in group], merge)
+                if len(results) != len(group):
+                    raise RuntimeError(f"write_batch returned {len(results)} results for {len(group)} packages")
+            except Exception as e:
+                results = [e] * len(group)
+            for (_, future), result in zip(group, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self.stats["batches"] += 1
+            self.stats["packages"] += len(group)
@@ -24,53 +24,82 @@ def get_package(package_id, base_api, api_key=None):
     return res["result"]
 
 
+def _search_session():
+    session = requests.Session()
+    retries = Retry(total=10, backoff_factor=1, status_forcelist=[ 104, 502, 503, 504 ])
+    session.mount('https://', HTTPAdapter(max_retries=retries))
+    return session
+
+
+def iter_package_search(base_api, rows=500, fl=None, fq=None, api_key=None, cb=None, session=None):
+    """
+    Page through package_search sorted by id, yielding one package at a time,
+    so that only one page is held in memory.
+
+    :param fl: Optional comma separated list of fields to return (e.g. "id,metadata_modified")
+    :param fq: Optional Solr filter query (e.g. "metadata_modified:[2024-01-01T00:00:00Z TO *]")
+    :raises requests.RequestException | Exception: when a page cannot be fetched,
+        instead of silently ending the listing early.
+    """
+    session = session or _search_session()
+    headers = {'Authorization': api_key} if api_key else {}
+    params = {"rows": rows, "sort": "id asc"}
+    if fl:
+        params["fl"] = fl
+    if fq:
+        params["fq"] = fq
+    offset = 0
+
+    while True:
+        if cb:
+            cb(f"Got {offset} packages")
+        response = session.get(
+            f"{base_api}/3/action/package_search",
+            params={**params, "start": offset},
+            headers=headers,
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        if not data['success']:
+            raise Exception(f"API request failed: {data['error']}")
+
+        result_packages = data['result']['results']
+        if not result_packages:
+            break  # Stop if no more packages are returned
+        yield from result_packages
+        offset += rows  # Increase the offset for the next request
+
+
+def get_package_listing(base_api, api_key=None, cb=None):
+    """
+    Cheap id-only pass over the remote catalogue.
+
+    :return: {package_id: metadata_modified}
+    """
+    return {
+        p["id"]: p.get("metadata_modified")
+        for p in iter_package_search(base_api, rows=1000, fl="id,metadata_modified", api_key=api_key, cb=cb)
+    }
+
+
 def get_all_packages(base_api, size=None, api_key=None, cb=None):
     """
     Retrieve all packages from the CKAN API using the package_search endpoint.
+    Prefer iter_package_search() for imports; this materializes every package.
     
     :param base_url: The base URL of the CKAN instance (e.g., "https://demo.ckan.org")
     :param api_key: Optional API key for authorization, if required
     :return: A list of all packages
     """
-    session = requests.Session()
-    retries = Retry(total=10, backoff_factor=1, status_forcelist=[ 104, 502, 503, 504 ])
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    
     packages = []
-    rows = 500
-    offset = 0
-    headers = {'Authorization': api_key} if api_key else {}
-
-    while True:
-        # Construct the API request URL
-        url = f"{base_api}/3/action/package_search?rows={rows}&start={offset}"
-        print(f"getting package rows={rows} offset={offset}")
-        if cb:
-            cb(f"Got {offset} packages")
-        
-        try:
-            # Make the API request
-            response = session.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-
-            if not data['success']:
-                raise Exception(f"API request failed: {data['error']}")
-
-            # Extract the results
-            result_packages = data['result']['results']
-            if not result_packages:
-                break  # Stop if no more packages are returned
-
-            packages.extend(result_packages)
-            offset += rows  # Increase the offset for the next request
-            
+    try:
+        for package in iter_package_search(base_api, api_key=api_key, cb=cb):
+            packages.append(package)
             if size and len(packages) >= size:
                 break
-            
-        except requests.RequestException as e:
-            print(f"Request failed: {e}")
-            break
+    except requests.RequestException as e:
+        print(f"Request failed: {e}")
 
     return packages
 
@@ -3,12 +3,14 @@ import logging
 from ckanext.udc_import_other_portals.model import CUDCImportConfig
 from ckanext.udc_import_other_portals.worker.socketio_client import SocketClient
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
-from ckanext.udc_import_other_portals.logger import ImportLogger
+from ckanext.udc_import_other_portals.logger import ImportLogger, job_log_path
 
-from ckanext.udc_import_other_portals.logic.ckan_based.api import get_package_ids, get_package, check_site_alive, get_all_packages
-from ckanext.udc_import_other_portals.logic.base import BaseImport, delete_package, get_package as get_self_package, purge_package, get_package_ids_by_import_config_id
+from ckanext.udc_import_other_portals.logic.ckan_based.api import get_package_ids, get_package, check_site_alive, get_package_listing, iter_package_search
+from ckanext.udc_import_other_portals.logic.ckan_based.watermarks import changed_packages, config_fingerprint, metadata_modified_fq, package_fingerprint, stale_imports
+from ckanext.udc_import_other_portals.logic.base import BaseImport, delete_package, import_workers, resolve_package_states
+from ckanext.udc_import_other_portals.logic.imported_id_map import ImportedIdMap
 from ckan import model
 
 
@@ -34,19 +36,27 @@ class CKANBasedImport(BaseImport):
     def run_imports(self):
         """
         Run imports for all source packages. Users should not override this.
+
+        Remote packages are streamed page by page through iterate_imports() into a
+        bounded work queue, so memory depends on the concurrency, not the portal size.
+        Only packages changed since their watermark (see watermarks.py) are fetched and
+        mapped; the id-only listing detects deletions.
         """
         self.running = True
         self.socket_client = SocketClient(self.job_id)
-        self.logger = ImportLogger(base_logger, 0, self.socket_client)
-        
-        self.all_packages = get_all_packages(self.base_api, cb=lambda x: self.logger.info(x))
-        
-        # Preprocess the packages, includes filtering and adding extra data
-        self.all_packages = [*self.iterate_imports()]
+        self.logger = ImportLogger(
+            base_logger, 0, self.socket_client, log_file=job_log_path(self.job_id)
+        )
         
-        self.packages_ids = [p['id'] for p in self.all_packages]
-        # Set the import size for reporting in the frontend
-        self.logger.total = self.import_size = len(self.packages_ids)
+        # A job re-queued after a worker restart resumes from its checkpoint
+        resuming = self.load_checkpoint()
+        plan = self.checkpoint.load("plan") if resuming else None
+        if plan:
+            remote_listing = plan["listing"]
+        else:
+            # Cheap id-only pass: {remote_id: metadata_modified}
+            remote_listing = get_package_listing(self.base_api, cb=lambda x: self.logger.info(x))
+        self.logger.total = self.import_size = len(remote_listing)
         
         # Make sure the sockeio server is connected
         while not self.socket_client.registered:
@@ -65,81 +75,178 @@ class CKANBasedImport(BaseImport):
             base_logger.info("Make sure remote endpoint is alive")
             if check_site_alive(self.base_api):
                 
-                # remote ID -> cudc ID
-                imported_id_map = {}
-                
-                def _delete_all_imports():
-                    for package_id_to_delete in get_package_ids_by_import_config_id(self.build_context(), self.import_config.id):
-                        try:
-                            package_to_delete = get_self_package(self.build_context(), package_id_to_delete)
-                            purge_package(self.build_context(), package_id_to_delete)
-                            self.logger.finished_one('deleted', package_id_to_delete, package_to_delete['name'], package_to_delete['title'])
-                        except Exception as e:
-                            self.logger.error(f"ERROR: Failed to get package {package_id_to_delete} from remote")
-                            self.logger.exception(e)
-                
+                # remote ID <-> cudc ID
+                imported_id_map = self.load_imported_id_map()
+                if not imported_id_map:
+                    # Backward compatibility without imported_id_map
+                    # Delete all previous imports
+                    self.delete_all_imports()
 
-                if self.import_config.other_data.get("imported_id_map"):
-                    imported_id_map = self.import_config.other_data["imported_id_map"]
+                # A resumed job already did this before it was interrupted
+                if len(imported_id_map) and not resuming and self.should_delete_previously_imported_for_run():
+                    # Delete all packages that were previously imported
+                    self.delete_all_imports()
+                    imported_id_map = ImportedIdMap()
+                    self._imported_map_pending += 1
+                    self._persist_imported_id_map(imported_id_map, force=True)
 
+                # Incremental import: compare the listing with the watermarks of the last runs
+                watermark_config = config_fingerprint(self.import_config)
+                watermarks = self.import_config.other_data.get("import_watermarks") or {}
+                if not imported_id_map or self.import_config.other_data.get("import_watermark_config") != watermark_config:
+                    # First run, purged imports, or the mapping changed: process everything
+                    watermarks = {}
+                self.import_config.other_data["import_watermark_config"] = watermark_config
+                self._import_watermarks = watermarks
+                if plan:
+                    changed, since = set(plan["changed"]), plan["since"]
+                    self._restore_ids = set(plan.get("restore") or ())
                 else:
-                    # Backward compatibility without imported_id_map
-                    # Delete all previous imports
-                    _delete_all_imports()
+                    # Local copies purged or deleted outside the importer are imported again
+                    self._restore_ids = stale_imports(
+                        imported_id_map, watermarks, resolve_package_states(imported_id_map.values())
+                    )
+                    changed, since = changed_packages(remote_listing, watermarks)
+                    self.checkpoint.save("plan", {
+                        "listing": remote_listing, "changed": sorted(changed), "since": since,
+                        "restore": sorted(self._restore_ids),
+                    })
+                    self._persist_imported_id_map(imported_id_map, force=True)
+                skipped_unchanged = len(remote_listing) - len(changed)
 
-                # In the CKAN based import, we only care about the ids
-                # Remove packages that are removed from the remote
-                if len(imported_id_map):
+                # remote ID -> [metadata_modified, content hash] of the packages offered to iterate_imports()
+                offered = {}
+                future_ids = {}
+                future_positions = {}
 
-                    if self.should_delete_previously_imported_for_run():
-                        # Delete all packages that were previously imported
-                        _delete_all_imports()
-                        imported_id_map = {}
-                        self._imported_map_pending += 1
-                        self._persist_imported_id_map(imported_id_map, force=True)
-                    else:
-                        # Get all packages that are deleted from the remote server, Remove them in ours
-                        for remote_id, package_id_to_remove in [
-                            (k, v) for k, v in imported_id_map.items() if k not in self.packages_ids
-                        ]:
-                            try:
-                                package_to_delete = get_self_package(self.build_context(), package_id_to_remove)
-                                # delete_package(self.build_context(), package_id_to_remove)
-                                purge_package(self.build_context(), package_id_to_remove)
-                                self.logger.finished_one('deleted', package_id_to_remove, package_to_delete['name'], package_to_delete['title'])
-                                imported_id_map.pop(remote_id, None)
-                                self._imported_map_pending += 1
-                                self._persist_imported_id_map(imported_id_map)
-                            except Exception as e:
-                                self.logger.error(f"ERROR: Failed to get package {package_id_to_remove} from remote")
-                                self.logger.exception(e)
-
-                # Iterate remote packages
-                base_logger.info("Starting iteration")
-                with ThreadPoolExecutor(max_workers=4) as executor:
+                def _changed_packages(after=None):
+                    nonlocal skipped_unchanged
+                    if not changed:
+                        return
+                    fq = [metadata_modified_fq(since) if since else None]
+                    if after:
+                        # Continue the id-sorted stream after the last recorded package
+                        fq.append(f'id:{{"{after}" TO *]')
+                    for src in iter_package_search(self.base_api, fq=" ".join(filter(None, fq)) or None):
+                        remote_id = src.get("id")
+                        if remote_id not in changed or remote_id in offered:
+                            continue
+                        mark = [src.get("metadata_modified"), package_fingerprint(src)]
+                        if (watermarks.get(remote_id) or [None, None])[1] == mark[1]:
+                            # Only metadata_modified moved, the content is the same
+                            watermarks[remote_id] = mark
+                            skipped_unchanged += 1
+                            self.logger.current += 1
+                            continue
+                        offered[remote_id] = mark
+                        yield src
+
+                def _stream():
+                    # Replay the packages fetched before an interruption, then fetch the rest
+                    last_id = None
+                    for src in self.checkpoint.replay():
+                        offered[src["id"]] = [src.get("metadata_modified"), package_fingerprint(src)]
+                        last_id = src["id"]
+                        yield src
+                    if not self.checkpoint.record_complete:
+                        yield from self.checkpoint.record(_changed_packages(after=last_id))
+
+                def _handle_result(future):
+                    remote_id = future_ids.pop(future, None)
+                    position = future_positions.pop(future, None)
+                    try:
+                        result = future.result()
+                        # Imported, or skipped by map_to_cudc_package: up to date until it changes again
+                        if remote_id in offered:
+                            watermarks[remote_id] = offered[remote_id]
+                        if not result:
+                            return
+                        remote_id, mapped_id, name = result
+                        if mapped_id:
+                            imported_id_map[remote_id] = mapped_id
+                            self._imported_map_pending += 1
+                            self._persist_imported_id_map(imported_id_map)
+                    except Exception as e:
+                        self.logger.error('ERROR: A package import failed.')
+                        self.logger.exception(e)
+                    finally:
+                        if position is not None:
+                            self.checkpoint.finished(position)
+                            self._imported_map_pending += 1
+                            self._persist_imported_id_map(imported_id_map)
+
+                if skipped_unchanged:
+                    self.logger.current += skipped_unchanged
+                    self.logger.info(f"INFO: {skipped_unchanged} packages unchanged since the last import, skipped.")
+
+                # Stream changed remote packages, the subclasses iterate self.all_packages
+                base_logger.info(f"Starting iteration over {len(changed)} changed packages")
+                self.all_packages = _stream()
+                self.packages_ids = []
+                max_workers = import_workers()
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
                     self.socket_client.executor = executor
-                    futures = {executor.submit(self.process_package, src, imported_id_map.get(src.get("id"))): src for src in self.all_packages}
-                    for future in as_completed(futures):
-                        try:
-                            result = future.result()
-                            if not result:
+                    in_flight = set()
+                    try:
+                        for position, src in enumerate(self.iterate_imports()):
+                            if self.socket_client.stop_requested:
+                                break
+                            self.packages_ids.append(src["id"])
+                            if self.checkpoint.is_finished(position):
+                                # Processed before the job was interrupted
+                                self.logger.current += 1
                                 continue
-                            remote_id, mapped_id, name = result
-                            if mapped_id:
-                                imported_id_map[remote_id] = mapped_id
-                                self._imported_map_pending += 1
-                                self._persist_imported_id_map(imported_id_map)
-                        except Exception as e:
-                            self.logger.error('ERROR: A package import failed.')
-                            self.logger.exception(e)
-                        
-                        if self.socket_client.stop_requested:
-                            break
-                        
-                    # Cleanup
-                    self.socket_client.executor = None
+                            try:
+                                future = executor.submit(self.process_package, src, imported_id_map.get(src.get("id")))
+                            except RuntimeError:
+                                # The executor was shut down by a stop request
+                                break
+                            future_ids[future] = src["id"]
+                            future_positions[future] = position
+                            in_flight.add(future)
+                            if len(in_flight) >= max_workers * 2:
+                                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                                for future in done:
+                                    _handle_result(future)
+                    finally:
+                        # Record the packages already imported, even if the remote listing failed
+                        for future in as_completed(in_flight):
+                            _handle_result(future)
+                            if self.socket_client.stop_requested:
+                                break
                         
+                        # Cleanup
+                        self.socket_client.executor = None
+                        self._persist_imported_id_map(imported_id_map, force=True)
+
+                # Report the unchanged packages and the ones that passed iterate_imports()
+                self.logger.total = self.import_size = skipped_unchanged + len(self.packages_ids)
+                self.socket_client.update_progress(self.logger.current, self.logger.total)
+                packages_ids = set(self.packages_ids)
+                if self.socket_client.stop_requested:
+                    base_logger.info("Stop requested, skipping the removal of deleted packages.")
+                else:
+                    # Filtered out by iterate_imports(): up to date until they change again
+                    for remote_id, mark in offered.items():
+                        if remote_id not in packages_ids:
+                            watermarks[remote_id] = mark
+                    for remote_id in [k for k in watermarks if k not in remote_listing]:
+                        del watermarks[remote_id]
+
+                if not self.socket_client.stop_requested and len(imported_id_map):
+                    # Remove packages that are removed from the remote (or no longer pass iterate_imports)
+                    stale_ids = imported_id_map.package_ids([
+                        k for k in imported_id_map
+                        if k not in remote_listing or (k in offered and k not in packages_ids)
+                    ])
+                    for package_id in self.purge_imported_packages(stale_ids):
+                        for remote_id in imported_id_map.remove_package(package_id):
+                            watermarks.pop(remote_id, None)
+                        self._imported_map_pending += 1
+
                 self._persist_imported_id_map(imported_id_map, force=True)
+                if not self.socket_client.stop_requested:
+                    self.clear_checkpoint()
             else:
                 self.logger.error(f'ERROR: Remote endpoint is not alive!')
             
@@ -0,0 +1,155 @@
+"""
+In-memory fingerprint index of the existing catalogues, used by
+find_duplicated_packages() to pick duplicate candidates without a Solr query
+per rule. Solr is then only asked to confirm the candidates.
+
+The rules mirror find_duplicated_packages(), in the same order:
+    "global unique identifier"  normalized unique_metadata_identifier
+    "title + authors"           hash of normalized title + author
+    "title + author emails"     hash of normalized title + author_email
+    "title + description"       MinHash/LSH over the title + notes tokens
+
+Titles and authors are normalized like Solr's text analysis (casefolded
+alphanumeric tokens), so exact rules match when the whole field matches.
+"""
+import random
+import re
+import threading
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_MASK64 = (1 << 64) - 1
+
+RULES = ("global unique identifier", "title + authors", "title + author emails", "title + description")
+
+
+def normalize_text(value) -> str:
+    return " ".join(_TOKEN.findall(str(value or "").casefold()))
+
+
+def text_tokens(package: dict, limit: int = 200) -> set:
+    """Distinct title + notes tokens (longer than 2 characters), at most `limit` of them."""
+    tokens = set()
+    for field in ("title", "notes"):
+        for token in _TOKEN.findall(str(package.get(field) or "").casefold()):
+            if len(token) > 2:
+                tokens.add(token)
+                if len(tokens) >= limit:
+                    return tokens
+    return tokens
+
+
+class MinHasher:
+    """MinHash signatures from XOR-masked multiplicative hashes of the token hashes."""
+
+    def __init__(self, num_perm: int = 32, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.params = [(rng.getrandbits(64), rng.getrandbits(64) | 1) for _ in range(num_perm)]
+
+    def signature(self, tokens: Iterable[str]) -> Optional[array]:
+        hashes = [hash(token) & _MASK64 for token in tokens]
+        if not hashes:
+            return None
+        return array("Q", (min(((h ^ mask) * mult) & _MASK64 for h in hashes) for mask, mult in self.params))
+
+
+def estimated_jaccard(a: array, b: array) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class FingerprintIndex:
+    """
+    Built once per import run; add() is thread-safe, lookups take no lock.
+
+    :param bands: LSH bands; bands * rows must equal num_perm. With 8 x 4 a pair
+        with Jaccard 0.8 becomes a candidate with probability ~0.98, 0.5 with ~0.4.
+    :param similarity: minimum estimated Jaccard of a "title + description" candidate.
+    """
+
+    def __init__(self, num_perm: int = 32, bands: int = 8, similarity: float = 0.5):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.similarity = similarity
+        self._exact = {rule: defaultdict(list) for rule in RULES[:3]}
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+        self._ids: List[str] = []
+        self._configs: List[Optional[str]] = []
+        self._signatures: List[Optional[array]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _exact_keys(self, package: dict) -> Dict[str, int]:
+        keys = {}
+        identifier = str(package.get("unique_metadata_identifier") or "").strip().casefold()
+        if identifier:
+            keys[RULES[0]] = hash(identifier)
+        title = normalize_text(package.get("title"))
+        if title:
+            author = normalize_text(package.get("author"))
+            if author:
+                keys[RULES[1]] = hash((title, author))
+            email = str(package.get("author_email") or "").strip().casefold()
+            if email:
+                keys[RULES[2]] = hash((title, email))
+        return keys
+
+    def _band_keys(self, signature: array):
+        for band in range(self.bands):
+            yield band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows]))
+
+    def add(self, package: dict) -> None:
+        keys = self._exact_keys(package)
+        signature = None
+        if package.get("title") and package.get("notes"):
+            signature = self.hasher.signature(text_tokens(package))
+        with self._lock:
+            idx = len(self._ids)
+            self._ids.append(package["id"])
+            self._configs.append(package.get("cudc_import_config_id"))
+            self._signatures.append(signature)
+            for rule, key in keys.items():
+                self._exact[rule][key].append(idx)
+            if signature is not None:
+                for band, key in self._band_keys(signature):
+                    self._buckets[band][key].append(idx)
+
+    def candidates(self, package: dict, exclude_config_id: Optional[str] = None) -> List[Tuple[str, List[str]]]:
+        """
+        [(rule, [package ids])] for every rule with candidates, in rule order.
+        Packages of `exclude_config_id` and the package itself are left out.
+        """
+        own_id = package.get("id")
+
+        def keep(idx):
+            return self._ids[idx] != own_id and (
+                exclude_config_id is None or self._configs[idx] != exclude_config_id
+            )
+
+        found = []
+        for rule, key in self._exact_keys(package).items():
+            ids = [self._ids[idx] for idx in self._exact[rule].get(key, ()) if keep(idx)]
+            if ids:
+                found.append((rule, ids))
+
+        if package.get("title") and package.get("notes"):
+            signature = self.hasher.signature(text_tokens(package))
+            if signature is not None:
+                seen = set()
+                for band, key in self._band_keys(signature):
+                    seen.update(self._buckets[band].get(key, ()))
+                scored = sorted(
+                    ((estimated_jaccard(signature, self._signatures[idx]), idx) for idx in seen if keep(idx)),
+                    reverse=True,
+                )
+                ids = [self._ids[idx] for score, idx in scored if score >= self.similarity]
+                if ids:
+                    found.append((RULES[3], ids))
+        return found
@@ -1,4 +1,5 @@
 from ckanext.udc_import_other_portals.logger import ImportLogger
+from ckanext.udc_import_other_portals.logic.dedup_index import FingerprintIndex
 import json
 import ckan.plugins.toolkit as toolkit
 from ckan.types import Context
@@ -31,11 +32,18 @@ def escape_solr_query(query):
     return escaped_query
 
 
-def package_search(context, current_import_config_id, search_filter={}, rows=20):
+def _ids_fq(ids):
+    return "id:(" + " OR ".join(f'"{i}"' for i in ids) + ")"
+
+
+def package_search(context, current_import_config_id, search_filter={}, rows=20, ids=None):
     # Do not include the package within the same import config id
     fq = f'-cudc_import_config_id:"{current_import_config_id}" -is_unified:"true" '
     for key, value in search_filter.items():
         fq += f'{key}:"{value}" '
+    if ids:
+        # Only confirm the candidates found by the fingerprint index
+        fq += _ids_fq(ids)
 
     query = {"fq": fq.strip(), "rows": rows}
     logic.check_access("package_search", context, query)
@@ -50,8 +58,11 @@ def find_similar_packages(
     search_filter={},
     minimun_should_match=80,
     rows=20,
+    ids=None,
 ):
     fq = f'-cudc_import_config_id:"{current_import_config_id}" -is_unified:"true" '
+    if ids:
+        fq += _ids_fq(ids)
     q = []
     qf = ""
     for key, value in search_filter.items():
@@ -74,8 +85,85 @@ def find_similar_packages(
     return result
 
 
-def find_duplicated_packages(context, package_dict: dict, current_import_config_id):
-    # return None, None
+INDEX_FIELDS = ("id", "title", "author", "author_email", "notes")
+# Solr only stores these extras under their extras_ prefix (CKAN's schema.xml
+# does not store the "*" dynamic field they are also indexed under)
+INDEX_EXTRAS = ("unique_metadata_identifier", "cudc_import_config_id")
+
+
+def _from_index_doc(doc: dict) -> dict:
+    """The package fields the fingerprint index needs, from a Solr document."""
+    package = {field: doc.get(field) for field in INDEX_FIELDS}
+    for field in INDEX_EXTRAS:
+        package[field] = doc.get("extras_" + field)
+    return package
+
+
+def build_fingerprint_index(context, current_import_config_id, rows=1000, cb=None) -> FingerprintIndex:
+    """
+    Index every non-unified package outside the current import config with one
+    streaming package_search pass (sorted by id, `rows` per page).
+    """
+    index = FingerprintIndex()
+    fq = f'-cudc_import_config_id:"{current_import_config_id}" -is_unified:"true"'
+    start = 0
+    started = time.monotonic()
+    fl = ",".join(INDEX_FIELDS + tuple("extras_" + field for field in INDEX_EXTRAS))
+    while True:
+        query = {"fq": fq, "fl": fl, "sort": "id asc", "rows": rows, "start": start}
+        logic.check_access("package_search", context, query)
+        result = logic.get_action("package_search")(context, query)
+        packages = result["results"]
+        for package in packages:
+            index.add(_from_index_doc(package))
+        start += len(packages)
+        if not packages or start >= result["count"]:
+            break
+    if cb:
+        cb(f"Indexed {len(index)} packages for deduplication in {time.monotonic() - started:.1f}s")
+    return index
+
+
+def _confirm_candidates(context, package_dict, current_import_config_id, candidates):
+    """Ask Solr to confirm the index candidates, rule by rule, with the original queries."""
+    title = package_dict.get("title")
+    for reason, ids in candidates:
+        ids = ids[:20]
+        if reason == "global unique identifier":
+            search_filter = {"unique_metadata_identifier": package_dict.get("unique_metadata_identifier")}
+        elif reason == "title + authors":
+            search_filter = {"title": title, "author": package_dict.get("author")}
+        elif reason == "title + author emails":
+            search_filter = {"title": title, "author_email": package_dict.get("author_email")}
+        else:
+            result = find_similar_packages(
+                context,
+                current_import_config_id,
+                {"title": title, "notes": package_dict.get("notes")},
+                ids=ids,
+            )
+            if result["count"] > 0:
+                return result, reason
+            continue
+        result = package_search(context, current_import_config_id, search_filter, ids=ids)
+        if result["count"] > 0:
+            return result, reason
+    return None, None
+
+
+def find_duplicated_packages(
+    context, package_dict: dict, current_import_config_id, index: FingerprintIndex = None
+):
+    """
+    :param index: fingerprint index of the existing packages (see
+        build_fingerprint_index). When given, the candidates are looked up in
+        memory and Solr is only queried to confirm them.
+    """
+    if index is not None:
+        candidates = index.candidates(package_dict, exclude_config_id=current_import_config_id)
+        if not candidates:
+            return None, None
+        return _confirm_candidates(context, package_dict, current_import_config_id, candidates)
 
     # Exact match with global unique identifier
     global_id = package_dict.get("unique_metadata_identifier")
@@ -0,0 +1,63 @@
+"""
+Mapping of the remote ids of an import config to the ids of the CUDC packages
+they were imported as, persisted in other_data["imported_id_map"].
+"""
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+
+class ImportedIdMap(MutableMapping):
+    """
+    remote id -> CUDC id, with the reverse index CUDC id -> remote ids so a
+    deleted package is removed without scanning the whole map.
+
+    It persists as the plain dict it was loaded from: dict(imported_id_map).
+    """
+
+    def __init__(self, mapping: Optional[Dict[str, str]] = None):
+        self._forward: Dict[str, str] = {}
+        self._reverse: Dict[str, Set[str]] = {}
+        for remote_id, package_id in (mapping or {}).items():
+            self[remote_id] = package_id
+
+    def __getitem__(self, remote_id: str) -> str:
+        return self._forward[remote_id]
+
+    def __setitem__(self, remote_id: str, package_id: str) -> None:
+        previous = self._forward.get(remote_id)
+        if previous is not None:
+            self._unlink(remote_id, previous)
+        self._forward[remote_id] = package_id
+        self._reverse.setdefault(package_id, set()).add(remote_id)
+
+    def __delitem__(self, remote_id: str) -> None:
+        package_id = self._forward.pop(remote_id)
+        self._unlink(remote_id, package_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._forward)
+
+    def __len__(self) -> int:
+        return len(self._forward)
+
+    def _unlink(self, remote_id: str, package_id: str) -> None:
+        remote_ids = self._reverse.get(package_id)
+        if remote_ids is not None:
+            remote_ids.discard(remote_id)
+            if not remote_ids:
+                del self._reverse[package_id]
+
+    def remote_ids(self, package_id: str) -> Set[str]:
+        """The remote ids imported as `package_id`."""
+        return set(self._reverse.get(package_id, ()))
+
+    def remove_package(self, package_id: str) -> Set[str]:
+        """Forget every remote id imported as `package_id`; returns them."""
+        remote_ids = self._reverse.pop(package_id, set())
+        for remote_id in remote_ids:
+            self._forward.pop(remote_id, None)
+        return remote_ids
+
+    def package_ids(self, remote_ids: Iterable[str]) -> List[str]:
+        """The CUDC ids `remote_ids` were imported as, each once."""
+        return list(dict.fromkeys(self._forward[r] for r in remote_ids if r in self._forward))
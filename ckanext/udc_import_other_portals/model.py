@@ -111,6 +111,21 @@ class CUDCImportJob(Base):
     @classmethod
     def get(cls, id):
         return model.Session.query(cls).filter(cls.id == id).first()
+
+    @classmethod
+    def get_for_update(cls, id):
+        """
+        The job as stored now, locked until the next commit. The worker and the
+        Socket.IO server both write other_data: load it this way and merge into
+        it, so neither drops the other's keys.
+        """
+        return (
+            model.Session.query(cls)
+            .filter(cls.id == id)
+            .populate_existing()
+            .with_for_update()
+            .first()
+        )
     
     @classmethod
     def delete_by_config_id(cls, id):
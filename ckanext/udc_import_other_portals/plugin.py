@@ -17,7 +17,9 @@ from .logic.actions import (
     cudc_import_config_delete,
     cudc_import_config_update,
     cudc_import_run,
+    cudc_import_job_resume,
     cudc_import_logs_get,
+    cudc_import_log_range_get,
     cudc_import_log_delete,
     cudc_clear_organization,
     cudc_import_language_options,
@@ -71,8 +73,10 @@ class UdcImportOtherPortalsPlugin(plugins.SingletonPlugin):
             "cudc_organization_list_min": cudc_organization_list_min,
             "cudc_import_config_update": cudc_import_config_update,
             "cudc_import_run": cudc_import_run,
+            "cudc_import_job_resume": cudc_import_job_resume,
             "cudc_import_config_delete": cudc_import_config_delete,
             "cudc_import_logs_get": cudc_import_logs_get,
+            "cudc_import_log_range_get": cudc_import_log_range_get,
             "cudc_import_log_delete": cudc_import_log_delete,
             "cudc_clear_organization": cudc_clear_organization,
             "cudc_import_language_options": cudc_import_language_options,
@@ -0,0 +1,60 @@
+"""
+Tests for the dataset listing in arcgis_based/api.py.
+"""
+import pytest
+import requests
+
+from ckanext.udc_import_other_portals.logic.arcgis_based import api
+
+
+class FakeClient:
+    """/api/v3/datasets over `total` datasets; fails on page `fail_page`."""
+
+    per_host_limit = 2
+
+    def __init__(self, total, fail_page=None, next_links=False):
+        self.total = total
+        self.fail_page = fail_page
+        self.next_links = next_links
+
+    def get_json(self, url, params=None):
+        page = (params or {}).get("page[number]") or int(url.rsplit("=", 1)[1])
+        if page == self.fail_page:
+            raise requests.ConnectionError("connection reset")
+        start = (page - 1) * 10
+        data = [{"id": str(n)} for n in range(start, min(start + 10, self.total))]
+        if self.next_links:
+            return {"data": data, "meta": {}, "links": {"next": f"/api/v3/datasets?page={page + 1}"}}
+        return {"data": data, "meta": {"stats": {"totalCount": self.total}}}
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    monkeypatch.setattr(api, "get_site_scope_group_ids", lambda base: [])
+
+    def use(client):
+        monkeypatch.setattr(api, "get_client", lambda: client)
+    return use
+
+
+def test_all_pages_are_listed(hub):
+    hub(FakeClient(total=35))
+
+    datasets = api.get_all_datasets("https://hub.example.com", page_size=10)
+
+    assert [d["id"] for d in datasets] == [str(n) for n in range(35)]
+
+
+@pytest.mark.parametrize("fail_page", [1, 3])
+def test_failed_page_raises_instead_of_truncating(hub, fail_page):
+    hub(FakeClient(total=35, fail_page=fail_page))
+
+    with pytest.raises(requests.RequestException):
+        api.get_all_datasets("https://hub.example.com", page_size=10)
+
+
+def test_failed_next_link_raises_instead_of_truncating(hub):
+    hub(FakeClient(total=35, fail_page=2, next_links=True))
+
+    with pytest.raises(requests.RequestException):
+        api.get_all_datasets("https://hub.example.com", page_size=10)
@@ -0,0 +1,115 @@
+"""
+Tests for arcgis_based/http_client.py - the pooled ArcGIS Hub client.
+
+The per-host sessions are replaced by a fake that replays scripted responses,
+so retries, per-host limits and conditional GETs can be checked offline.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from ckanext.udc_import_other_portals.logic.arcgis_based.http_client import ArcGISHttpClient
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None, headers=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+
+class FakeSession:
+    def __init__(self, responses=None, delay=0.0):
+        self.responses = list(responses or [])
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get(self, url, headers=None, timeout=None):
+        with self.lock:
+            self.calls.append((url, dict(headers or {})))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+            if self.responses:
+                return self.responses.pop(0)
+        return FakeResponse(payload={"url": url})
+
+
+def _client(session, **options):
+    client = ArcGISHttpClient(backoff_base=0.001, backoff_max=0.01, **options)
+    client._pool("https://hub.example.com").session = session
+    return client
+
+
+class TestArcGISHttpClient:
+    """Test retries, concurrency limits and conditional GETs."""
+
+    def test_retries_429_and_5xx(self):
+        session = FakeSession([
+            FakeResponse(429, headers={"Retry-After": "0"}),
+            FakeResponse(503),
+            FakeResponse(200, {"data": []}),
+        ])
+        client = _client(session)
+
+        assert client.get_json("https://hub.example.com/api/v3/datasets") == {"data": []}
+        assert len(session.calls) == 3
+        assert client.stats["retries"] == 2
+
+    def test_gives_up_after_max_attempts(self):
+        session = FakeSession([FakeResponse(502)] * 3)
+        client = _client(session, max_attempts=3)
+
+        with pytest.raises(requests.HTTPError):
+            client.get_json("https://hub.example.com/api/v3/datasets")
+        assert len(session.calls) == 3
+
+    def test_in_flight_requests_are_limited_per_host(self):
+        session = FakeSession(delay=0.01)
+        client = _client(session, per_host_limit=3)
+
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            list(pool.map(lambda n: client.get_json("https://hub.example.com/api/v3/datasets",
+                                                    params={"page[number]": n}), range(24)))
+
+        assert session.max_in_flight == 3
+
+    def test_conditional_get_serves_unchanged_items_from_cache(self):
+        session = FakeSession([
+            FakeResponse(200, {"data": {"id": "a"}}, headers={"ETag": '"v1"'}),
+            FakeResponse(304),
+        ])
+        client = _client(session)
+        url = "https://hub.example.com/api/v3/datasets/a"
+
+        assert client.get_json(url) == {"data": {"id": "a"}}
+        assert client.get_json(url) == {"data": {"id": "a"}}
+        assert session.calls[1][1] == {"If-None-Match": '"v1"'}
+        assert client.stats["not_modified"] == 1
+
+    def test_cache_is_bounded(self):
+        session = FakeSession([
+            FakeResponse(200, {"n": n}, headers={"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+            for n in range(5)
+        ])
+        client = _client(session, cache_size=2)
+
+        for n in range(5):
+            client.get_json(f"https://hub.example.com/api/v3/datasets/{n}")
+
+        assert client.stats_snapshot()["cached"] == 2
@@ -0,0 +1,72 @@
+"""
+Tests for the source_last_updated refresh of ArcGIS configs (arcgis_based/refresh.py).
+"""
+import json
+
+from ckanext.udc_import_other_portals.logic.arcgis_based.refresh import (
+    plan_refresh,
+    source_last_updated_from_extras,
+    source_last_updated_iso,
+    upstream_source_last_updated,
+)
+
+
+def _extras(**values):
+    return json.dumps([{"key": key, "value": value} for key, value in values.items()])
+
+
+def test_upstream_timestamps_prefer_item_modified():
+    datasets = [
+        {"id": "a", "attributes": {"itemModified": 1700000000123, "modified": 1600000000000}},
+        {"id": "b", "attributes": {"modified": 1700000000000}},
+        {"id": "c", "attributes": {}},
+        {"attributes": {"modified": 1700000000000}},
+    ]
+
+    assert upstream_source_last_updated(datasets) == {
+        "a": "2023-11-14T22:13:20.123000",
+        "b": "2023-11-14T22:13:20",
+        "c": None,
+    }
+    assert source_last_updated_iso({"modified": 1700000000000}) == "2023-11-14T22:13:20"
+
+
+def test_plan_refresh_only_changes_outdated_packages():
+    upstream = {"r1": "2024-02-01T00:00:00", "r2": "2024-01-01T00:00:00", "r3": None, "r4": "2024-03-01T00:00:00"}
+    rows = [
+        ("p1", "r1", _extras(source_portal="Hub", source_last_updated="2024-01-01T00:00:00")),
+        ("p2", "r2", _extras(source_last_updated="2024-01-01T00:00:00")),
+        ("p3", "r3", _extras()),
+        ("p4", "r4", None),
+        ("p5", None, _extras()),
+        ("p6", "gone", _extras()),
+    ]
+
+    changes, skipped, unchanged = plan_refresh(rows, upstream)
+
+    assert set(changes) == {"p1", "p4"}
+    assert json.loads(changes["p1"]) == [
+        {"key": "source_portal", "value": "Hub"},
+        {"key": "source_last_updated", "value": "2024-02-01T00:00:00"},
+    ]
+    assert json.loads(changes["p4"]) == [{"key": "source_last_updated", "value": "2024-03-01T00:00:00"}]
+    assert unchanged == 1
+    assert [package_id for package_id, reason in skipped] == ["p3", "p5", "p6"]
+
+
+def test_plan_refresh_ignores_malformed_import_extras():
+    changes, skipped, unchanged = plan_refresh([("p1", "r1", "not json"), ("p2", "r2", '{"a": 1}')],
+                                               {"r1": "2024-01-01T00:00:00", "r2": "2024-01-01T00:00:00"})
+
+    assert {package_id: json.loads(value) for package_id, value in changes.items()} == {
+        "p1": [{"key": "source_last_updated", "value": "2024-01-01T00:00:00"}],
+        "p2": [{"key": "source_last_updated", "value": "2024-01-01T00:00:00"}],
+    }
+    assert (skipped, unchanged) == ([], 0)
+
+
+def test_source_last_updated_from_stored_extras():
+    assert source_last_updated_from_extras(_extras(source_portal="Hub", source_last_updated="2024-01-01")) == "2024-01-01"
+    assert source_last_updated_from_extras(_extras(source_last_updated="")) is None
+    assert source_last_updated_from_extras(None) is None
+    assert source_last_updated_from_extras("not json") is None
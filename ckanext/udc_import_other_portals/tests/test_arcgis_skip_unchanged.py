@@ -0,0 +1,94 @@
+"""
+Tests for skipping unchanged ArcGIS datasets from the source_last_updated snapshot.
+
+The benchmark runs the skip decision of a no-op re-import of a large portal:
+every dataset is already imported and unchanged, so nothing is written.
+"""
+import time
+
+import pytest
+
+from ckanext.udc_import_other_portals.logic.arcgis_based import base as arcgis_base
+from ckanext.udc_import_other_portals.logic.arcgis_based.base import ArcGISBasedImport
+
+MODIFIED_MS = 1700000000000
+MODIFIED_ISO = "2023-11-14T22:13:20"
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.finished = []
+
+    def info(self, message):
+        pass
+
+    def finished_one(self, status, package_id, name, title, logs=None):
+        self.finished.append((status, package_id, name, title))
+
+
+def _importer(snapshot):
+    importer = ArcGISBasedImport.__new__(ArcGISBasedImport)
+    importer.logger = RecordingLogger()
+    importer.source_last_updated_snapshot = snapshot
+    return importer
+
+
+def _dataset(n, modified=MODIFIED_MS):
+    return {"id": f"remote-{n}", "attributes": {"name": f"Dataset {n}", "modified": modified}}
+
+
+@pytest.fixture
+def no_package_show(monkeypatch):
+    def package_show(context, package_id):
+        raise AssertionError(f"package_show called for {package_id}")
+
+    monkeypatch.setattr(arcgis_base, "get_self_package", package_show)
+
+
+class TestSkipUnchanged:
+    """Test the skip decision against the snapshot."""
+
+    def test_unchanged_dataset_is_skipped(self, no_package_show):
+        importer = _importer({"pkg-1": ("dataset-1", "Dataset 1", MODIFIED_ISO)})
+
+        assert importer._should_skip_existing_package(_dataset(1), "pkg-1")
+        assert importer.logger.finished == [("skipped", "pkg-1", "dataset-1", "Dataset 1")]
+
+    def test_changed_new_or_missing_packages_are_imported(self, no_package_show):
+        importer = _importer({
+            "pkg-1": ("dataset-1", "Dataset 1", "2023-01-01T00:00:00"),
+            "pkg-2": ("dataset-2", "Dataset 2", None),
+        })
+
+        assert not importer._should_skip_existing_package(_dataset(1), "pkg-1")
+        assert not importer._should_skip_existing_package(_dataset(2), "pkg-2")
+        # Mapped, but the package is gone
+        assert not importer._should_skip_existing_package(_dataset(3), "pkg-3")
+        assert not importer._should_skip_existing_package(_dataset(4), None)
+        assert importer.logger.finished == []
+
+    def test_without_snapshot_falls_back_to_package_show(self, monkeypatch):
+        importer = _importer(None)
+        importer.build_context = lambda: {}
+        monkeypatch.setattr(arcgis_base, "get_self_package", lambda context, package_id: {
+            "name": "dataset-1",
+            "title": "Dataset 1",
+            "udc_import_extras": [{"key": "source_last_updated", "value": MODIFIED_ISO}],
+        })
+
+        assert importer._should_skip_existing_package(_dataset(1), "pkg-1")
+
+    @pytest.mark.benchmark
+    def test_benchmark_no_op_reimport(self, no_package_show):
+        size = 30000
+        importer = _importer({f"pkg-{n}": (f"dataset-{n}", f"Dataset {n}", MODIFIED_ISO) for n in range(size)})
+        datasets = [_dataset(n) for n in range(size)]
+
+        started = time.perf_counter()
+        skipped = sum(importer._should_skip_existing_package(src, f"pkg-{n}") for n, src in enumerate(datasets))
+        elapsed = time.perf_counter() - started
+
+        print(f"\nNo-op re-import of {size:,} datasets: {elapsed:.2f}s ({size / elapsed:,.0f} datasets/s), "
+              f"0 package_show calls")
+        assert skipped == size
+        assert elapsed < 5
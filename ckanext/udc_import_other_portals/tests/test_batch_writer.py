@@ -0,0 +1,77 @@
+"""
+Tests for logic/batch_writer.py - group commit of the importer threads.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ckanext.udc_import_other_portals.logic.batch_writer import PackageBatchWriter
+
+
+class RecordingWrite:
+    def __init__(self, fail=()):
+        self.batches = []
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+
+    def __call__(self, packages, merge):
+        with self.lock:
+            self.batches.append(([p["id"] for p in packages], merge))
+        return [ValueError(p["id"]) if p["id"] in self.fail else "created" for p in packages]
+
+
+class TestPackageBatchWriter:
+    """Test batching, timeouts and per-package errors."""
+
+    def test_concurrent_writes_share_batches(self):
+        write = RecordingWrite()
+        writer = PackageBatchWriter(write, batch_size=8, max_wait=1.0)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda n: writer.write({"id": str(n)}), range(32)))
+
+        assert results == ["created"] * 32
+        assert sorted(i for ids, _ in write.batches for i in ids) == sorted(str(n) for n in range(32))
+        assert len(write.batches) == 4
+
+    def test_batch_is_capped_to_the_writer_threads(self):
+        write = RecordingWrite()
+        # Only 4 threads write: the batch must not wait for 50 packages
+        writer = PackageBatchWriter(write, batch_size=50, max_wait=3600, writers=4)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(writer.write, {"id": str(n)}) for n in range(8)]
+            results = [future.result(timeout=30) for future in futures]
+
+        assert writer.batch_size == 4
+        assert results == ["created"] * 8
+        assert [len(ids) for ids, _ in write.batches] == [4, 4]
+
+    def test_single_write_is_flushed_after_max_wait(self):
+        write = RecordingWrite()
+        writer = PackageBatchWriter(write, batch_size=50, max_wait=0.01)
+
+        assert writer.write({"id": "a"}) == "created"
+        assert write.batches == [(["a"], False)]
+
+    def test_errors_are_raised_to_their_own_writer(self):
+        write = RecordingWrite(fail={"bad"})
+        writer = PackageBatchWriter(write, batch_size=2, max_wait=1.0)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            good = pool.submit(writer.write, {"id": "good"})
+            bad = pool.submit(writer.write, {"id": "bad"})
+            assert good.result() == "created"
+            with pytest.raises(ValueError):
+                bad.result()
+        assert len(write.batches) == 1
+
+    def test_merge_writes_are_grouped_apart(self):
+        write = RecordingWrite()
+        writer = PackageBatchWriter(write, batch_size=2, max_wait=1.0)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(lambda args: writer.write(*args), [({"id": "a"}, False), ({"id": "b"}, True)]))
+
+        assert sorted(write.batches) == [(["a"], False), (["b"], True)]
@@ -0,0 +1,70 @@
+"""
+Tests for checkpoint.py - resuming an interrupted import job.
+"""
+import pytest
+
+from ckanext.udc_import_other_portals.checkpoint import ImportCheckpoint
+
+
+@pytest.fixture
+def prefix(tmp_path):
+    return str(tmp_path / "logs" / "job.snapshot")
+
+
+class TestImportCheckpoint:
+    """Test the snapshot, the cursor and the resume from a persisted state."""
+
+    def test_cursor_advances_over_finished_positions(self, prefix):
+        checkpoint = ImportCheckpoint(prefix)
+        for position in (1, 2, 4):
+            checkpoint.finished(position)
+        assert checkpoint.state["cursor"] == 0
+        assert checkpoint.state["ahead"] == [1, 2, 4]
+
+        checkpoint.finished(0)
+        assert checkpoint.state["cursor"] == 3
+        assert checkpoint.state["ahead"] == [4]
+        assert [checkpoint.is_finished(n) for n in range(6)] == [True, True, True, False, True, False]
+
+    def test_resume_replays_the_snapshot(self, prefix):
+        checkpoint = ImportCheckpoint(prefix)
+        checkpoint.save("plan", {"listing": {"a": "2024-01-01"}})
+        assert list(checkpoint.record(({"id": n} for n in range(5)), chunk=2)) == [{"id": n} for n in range(5)]
+        checkpoint.finished(0)
+        checkpoint.finished(1)
+
+        resumed = ImportCheckpoint(prefix, checkpoint.state)
+        assert resumed.record_complete
+        assert resumed.load("plan") == {"listing": {"a": "2024-01-01"}}
+        assert list(resumed.replay()) == [{"id": n} for n in range(5)]
+        assert resumed.finished_count == 2
+
+    def test_interrupted_recording_continues_after_the_persisted_items(self, prefix):
+        checkpoint = ImportCheckpoint(prefix)
+        stream = checkpoint.record(({"id": n} for n in range(10)), chunk=3)
+        for _ in range(4):
+            next(stream)
+        checkpoint.flush()
+        state = checkpoint.state
+        # Written after the state was persisted: lost with the worker
+        next(stream)
+        next(stream)
+        checkpoint.flush()
+
+        resumed = ImportCheckpoint(prefix, state)
+        assert not resumed.record_complete
+        replayed = list(resumed.replay())
+        assert replayed == [{"id": n} for n in range(4)]
+        rest = list(resumed.record({"id": n} for n in range(4, 7)))
+        assert rest == [{"id": n} for n in range(4, 7)]
+        assert resumed.record_complete
+        assert list(ImportCheckpoint(prefix, resumed.state).replay()) == [{"id": n} for n in range(7)]
+
+    def test_clear_removes_the_snapshot(self, prefix, tmp_path):
+        checkpoint = ImportCheckpoint(prefix)
+        checkpoint.save("plan", {})
+        list(checkpoint.record([{"id": "a"}]))
+        checkpoint.clear()
+
+        assert list((tmp_path / "logs").iterdir()) == []
+        assert checkpoint.state["recorded"] == 0
@@ -0,0 +1,80 @@
+"""
+Tests for the streaming package_search pager in ckan_based/api.py.
+"""
+import pytest
+
+from ckanext.udc_import_other_portals.logic.ckan_based import api
+from ckanext.udc_import_other_portals.logic.ckan_based.api import (
+    get_all_packages,
+    get_package_listing,
+    iter_package_search,
+)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """package_search over `total` packages; fails on the page starting at `fail_at`."""
+
+    def __init__(self, total, fail_at=None):
+        self.total = total
+        self.fail_at = fail_at
+        self.calls = []
+
+    def get(self, url, params=None, headers=None):
+        self.calls.append(params)
+        start, rows = params["start"], params["rows"]
+        if start == self.fail_at:
+            return FakeResponse({"success": False, "error": "boom"})
+        results = [
+            {"id": f"{n:05d}", "metadata_modified": "2024-01-01", "title": f"Package {n}"}
+            for n in range(start, min(start + rows, self.total))
+        ]
+        if params.get("fl"):
+            fields = params["fl"].split(",")
+            results = [{k: v for k, v in r.items() if k in fields} for r in results]
+        return FakeResponse({"success": True, "result": {"results": results}})
+
+
+def test_iter_package_search_streams_page_by_page():
+    session = FakeSession(total=25)
+    packages = iter_package_search("http://remote/api", rows=10, session=session)
+
+    first = next(packages)
+    assert first["id"] == "00000"
+    assert len(session.calls) == 1
+
+    assert [p["id"] for p in packages] == [f"{n:05d}" for n in range(1, 25)]
+    assert [c["start"] for c in session.calls] == [0, 10, 20, 30]
+    assert all(c["sort"] == "id asc" for c in session.calls)
+
+
+def test_iter_package_search_raises_instead_of_truncating():
+    session = FakeSession(total=25, fail_at=10)
+    with pytest.raises(Exception, match="API request failed"):
+        list(iter_package_search("http://remote/api", rows=10, session=session))
+
+
+def test_get_package_listing_is_id_only(monkeypatch):
+    session = FakeSession(total=3)
+    monkeypatch.setattr(api, "_search_session", lambda: session)
+
+    assert get_package_listing("http://remote/api") == {
+        "00000": "2024-01-01", "00001": "2024-01-01", "00002": "2024-01-01",
+    }
+    assert session.calls[0]["fl"] == "id,metadata_modified"
+
+
+def test_get_all_packages_honours_size(monkeypatch):
+    monkeypatch.setattr(api, "_search_session", lambda: FakeSession(total=2000))
+
+    assert len(get_all_packages("http://remote/api", size=600)) == 600
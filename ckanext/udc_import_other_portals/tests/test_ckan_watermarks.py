@@ -0,0 +1,70 @@
+"""
+Tests for the incremental CKAN import watermarks (ckan_based/watermarks.py).
+"""
+from types import SimpleNamespace
+
+from ckanext.udc_import_other_portals.logic.ckan_based.watermarks import (
+    changed_packages,
+    config_fingerprint,
+    metadata_modified_fq,
+    package_fingerprint,
+    stale_imports,
+)
+from ckanext.udc_import_other_portals.logic.imported_id_map import ImportedIdMap
+
+
+def test_changed_packages_compares_metadata_modified():
+    listing = {
+        "a": "2024-01-01T00:00:00.000001",
+        "b": "2024-03-01T10:00:00.123456",
+        "c": "2024-02-01T00:00:00",
+    }
+    watermarks = {
+        "a": ["2024-01-01T00:00:00.000001", "hash-a"],
+        "b": ["2024-01-15T00:00:00", "hash-b"],
+        "gone": ["2023-01-01T00:00:00", "hash-gone"],
+    }
+
+    changed, since = changed_packages(listing, watermarks)
+
+    assert changed == {"b", "c"}
+    assert since == "2024-02-01T00:00:00"
+    assert metadata_modified_fq(since) == "metadata_modified:[2024-02-01T00:00:00Z TO *]"
+
+
+def test_changed_packages_without_timestamps_fetches_everything():
+    changed, since = changed_packages({"a": None, "b": "2024-01-01"}, {})
+    assert changed == {"a", "b"}
+    assert since is None
+
+    assert changed_packages({"a": "2024-01-01"}, {"a": ["2024-01-01", "h"]}) == (set(), None)
+
+
+def test_package_fingerprint_ignores_volatile_fields():
+    package = {"id": "a", "title": "Roads", "tags": [{"name": "x"}], "metadata_modified": "2024-01-01"}
+    touched = {**package, "metadata_modified": "2024-05-01", "tracking_summary": {"total": 3}}
+    edited = {**package, "title": "Roads and bridges"}
+
+    assert package_fingerprint(package) == package_fingerprint(touched)
+    assert package_fingerprint(package) != package_fingerprint(edited)
+
+
+def test_config_fingerprint_changes_with_the_mapping():
+    config = SimpleNamespace(code="class A: pass", owner_org="org", other_config={"base_api": "x"})
+    edited = SimpleNamespace(code="class A: x = 1", owner_org="org", other_config={"base_api": "x"})
+
+    assert config_fingerprint(config) == config_fingerprint(SimpleNamespace(**vars(config)))
+    assert config_fingerprint(config) != config_fingerprint(edited)
+
+
+def test_stale_imports_are_imported_again():
+    imported_id_map = ImportedIdMap({"a": "cudc-a", "b": "cudc-b", "c": "cudc-c"})
+    watermarks = {"a": ["2024-01-01", "h"], "b": ["2024-01-01", "h"], "c": ["2024-01-01", "h"]}
+    listing = {"a": "2024-01-01", "b": "2024-01-01", "c": "2024-01-01"}
+
+    # cudc-b was purged, cudc-c deleted
+    restore = stale_imports(imported_id_map, watermarks, {"cudc-a": "active", "cudc-c": "deleted"})
+
+    assert restore == {"cudc-c"}
+    assert dict(imported_id_map) == {"a": "cudc-a", "c": "cudc-c"}
+    assert changed_packages(listing, watermarks)[0] == {"b", "c"}
@@ -0,0 +1,184 @@
+"""
+Tests for logic/dedup_index.py - the in-memory dedup fingerprint index - and for
+building it from package_search in logic/deduplication.py.
+
+The recall test plants near-duplicates in a synthetic catalogue and compares
+the index with a brute-force emulation of the Solr rules (exact fields, then 80%
+of the query terms matching). The benchmark (`-m benchmark`) reports lookups per
+second for both.
+"""
+import random
+import sys
+import time
+
+import pytest
+
+from ckanext.udc_import_other_portals.logic import deduplication
+from ckanext.udc_import_other_portals.logic.dedup_index import FingerprintIndex, text_tokens
+
+
+WORDS = [f"word{n}" for n in range(3000)]
+
+
+def _package(rng, n, config="other"):
+    return {
+        "id": f"pkg-{n}",
+        "title": " ".join(rng.choices(WORDS, k=6)),
+        "notes": " ".join(rng.choices(WORDS, k=60)),
+        "author": f"Author {rng.randrange(500)}",
+        "cudc_import_config_id": config,
+    }
+
+
+def _near_duplicate(rng, package, n):
+    notes = package["notes"].split()
+    for pos in rng.sample(range(len(notes)), 5):
+        notes[pos] = rng.choice(WORDS)
+    return {**package, "id": f"new-{n}", "notes": " ".join(notes), "author": "Someone Else",
+            "cudc_import_config_id": "current"}
+
+
+def _workload():
+    """A synthetic catalogue, 100 planted near-duplicates and 100 new packages."""
+    rng = random.Random(7)
+    corpus = [_package(rng, n) for n in range(5000)]
+    queries = [_near_duplicate(rng, corpus[n], n) for n in rng.sample(range(len(corpus)), 100)]
+    queries += [{**_package(rng, 10_000 + n), "cudc_import_config_id": "current"} for n in range(100)]
+    return corpus, queries
+
+
+def _brute_force(corpus, package):
+    """What the per-package Solr searches return, emulated by a scan of (package, tokens)."""
+    for doc, _ in corpus:
+        if doc["title"] == package["title"] and doc["author"] == package["author"]:
+            return doc["id"]
+    query = text_tokens(package)
+    for doc, tokens in corpus:
+        if len(query & tokens) >= 0.8 * len(query):
+            return doc["id"]
+    return None
+
+
+class TestFingerprintIndex:
+    """Test the exact rules, the similarity rule and the exclusions."""
+
+    def test_exact_rules_are_normalized(self):
+        index = FingerprintIndex()
+        index.add({"id": "a", "title": "Road  Closures, 2024", "author": "City of Toronto",
+                   "author_email": "Open@Toronto.ca", "unique_metadata_identifier": " DOI:10.1/X "})
+
+        assert index.candidates({"title": "road closures 2024", "author": "city of toronto"}) == [
+            ("title + authors", ["a"])
+        ]
+        assert index.candidates({"title": "Road Closures 2024", "author_email": "open@toronto.ca"}) == [
+            ("title + author emails", ["a"])
+        ]
+        assert index.candidates({"unique_metadata_identifier": "doi:10.1/x"}) == [
+            ("global unique identifier", ["a"])
+        ]
+        assert index.candidates({"title": "Road Closures", "author": "City of Toronto"}) == []
+
+    def test_similar_descriptions(self):
+        rng = random.Random(3)
+        index = FingerprintIndex()
+        original = _package(rng, 0)
+        index.add(original)
+        index.add(_package(rng, 1))
+
+        found = index.candidates(_near_duplicate(rng, original, 0))
+        assert found == [("title + description", ["pkg-0"])]
+        assert index.candidates(_package(rng, 2)) == []
+
+    def test_excludes_current_config_and_itself(self):
+        index = FingerprintIndex()
+        package = {"id": "a", "title": "Roads", "author": "X", "cudc_import_config_id": "current"}
+        index.add(package)
+        index.add({**package, "id": "b", "cudc_import_config_id": "other"})
+
+        assert index.candidates(package, exclude_config_id="current") == [("title + authors", ["b"])]
+        assert index.candidates({**package, "id": "b"}) == [("title + authors", ["a"])]
+
+    def test_recall_against_search_path(self):
+        corpus, queries = _workload()
+        index = FingerprintIndex()
+        for package in corpus:
+            index.add(package)
+
+        found = [index.candidates(q, exclude_config_id="current") for q in queries]
+        scanned = [(package, text_tokens(package)) for package in corpus]
+        expected = [_brute_force(scanned, q) for q in queries]
+
+        hits = sum(1 for e, f in zip(expected, found) if e and any(e in ids for _, ids in f))
+        relevant = sum(1 for e in expected if e)
+        false_positives = sum(1 for e, f in zip(expected, found) if not e and f)
+        assert relevant == 100
+        assert hits >= 95
+        assert false_positives == 0
+
+
+class TestBuildFingerprintIndex:
+    """Test the index built from package_search results shaped like the Solr `fl` output."""
+
+    # What CKAN's schema.xml stores for an indexed package: extras only under extras_*
+    STORED = [
+        {"id": "a", "title": "Roads", "notes": "Road closures", "author": "X",
+         "extras_unique_metadata_identifier": "doi:10.1/x", "extras_cudc_import_config_id": "other"},
+        {"id": "b", "title": "Parks", "notes": "Park permits", "author": "Y",
+         "extras_cudc_import_config_id": "current"},
+    ]
+
+    def _package_search(self, queries):
+        def package_search(context, query):
+            queries.append(query)
+            fl = query["fl"].split(",")
+            docs = [{k: v for k, v in doc.items() if k in fl} for doc in self.STORED]
+            docs = docs[query["start"]:query["start"] + query["rows"]]
+            return {"count": len(self.STORED), "results": docs}
+        return package_search
+
+    def test_identifiers_come_from_the_stored_fields(self, monkeypatch):
+        queries = []
+        monkeypatch.setattr(deduplication.logic, "check_access", lambda *args, **kwargs: True)
+        monkeypatch.setattr(deduplication.logic, "get_action", lambda name: self._package_search(queries))
+
+        index = deduplication.build_fingerprint_index({}, "current", rows=1)
+
+        assert len(index) == 2
+        assert len(queries) == 2
+        assert index.candidates({"id": "new", "unique_metadata_identifier": "DOI:10.1/X"}) == [
+            ("global unique identifier", ["a"])
+        ]
+        assert index.candidates({"id": "new", "title": "Parks", "author": "Y"},
+                                exclude_config_id="current") == []
+
+
+@pytest.mark.benchmark
+class TestFingerprintIndexBenchmark:
+    """Benchmark: lookups per second of the index against the search path."""
+
+    def test_lookups_per_second(self):
+        corpus, queries = _workload()
+
+        started = time.perf_counter()
+        index = FingerprintIndex()
+        for package in corpus:
+            index.add(package)
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for q in queries:
+            index.candidates(q, exclude_config_id="current")
+        index_time = time.perf_counter() - started
+
+        scanned = [(package, text_tokens(package)) for package in corpus]
+        started = time.perf_counter()
+        for q in queries:
+            _brute_force(scanned, q)
+        brute_time = time.perf_counter() - started
+
+        print(
+            f"\ndedup index: {len(corpus)} packages indexed in {build:.2f}s, "
+            f"{len(queries) / index_time:,.0f} lookups/s vs {len(queries) / brute_time:,.0f} searches/s",
+            file=sys.stderr,
+        )
+        assert index_time * 10 < brute_time
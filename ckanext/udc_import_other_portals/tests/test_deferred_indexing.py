@@ -0,0 +1,61 @@
+"""
+Tests for deferred_search_indexing() in logic/base.py, run through CKAN's own
+DomainObjectModificationExtension and SynchronousSearchPlugin.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+import ckan.model as model
+from ckan.lib import search
+from ckan.model import modification
+
+from ckanext.udc_import_other_portals.logic.base import deferred_search_indexing
+
+
+class RecordingObserver:
+    def __init__(self):
+        self.notified = []
+
+    def notify(self, entity, operation):
+        self.notified.append((entity.id, operation))
+
+
+@pytest.fixture
+def observers(monkeypatch):
+    """The search plugin, with Solr replaced by a recorder, and another observer."""
+    indexed = []
+    monkeypatch.setattr(search, "dispatch_by_operation",
+                        lambda entity_type, pkg_dict, operation: indexed.append((pkg_dict["id"], operation)))
+    monkeypatch.setattr(search.logic, "get_action", lambda name: lambda context, data_dict: data_dict)
+    other = RecordingObserver()
+    monkeypatch.setattr(modification.plugins, "PluginImplementations",
+                        lambda interface: [search.SynchronousSearchPlugin(), other])
+    return SimpleNamespace(indexed=indexed, other=other)
+
+
+def _commit(new=(), deleted=()):
+    """What CKAN runs before a commit of these packages."""
+    session = SimpleNamespace(flush=lambda: None,
+                              _object_cache={"new": set(new), "changed": set(), "deleted": set(deleted)})
+    modification.DomainObjectModificationExtension().before_commit(session)
+
+
+@pytest.mark.parametrize("operation", ["new", "deleted"])
+def test_only_the_search_index_skips_the_deferred_packages(observers, operation):
+    batch = model.Package(id="batch", name="batch")
+    outside = model.Package(id="outside", name="outside")
+
+    with deferred_search_indexing(["batch"]):
+        _commit(**{operation: [batch, outside]})
+
+    assert observers.indexed == [("outside", operation)]
+    assert sorted(observers.other.notified) == [("batch", operation), ("outside", operation)]
+
+
+def test_indexing_resumes_after_the_batch(observers):
+    with deferred_search_indexing(["batch"]):
+        pass
+    _commit(new=[model.Package(id="batch", name="batch")])
+
+    assert observers.indexed == [("batch", "new")]
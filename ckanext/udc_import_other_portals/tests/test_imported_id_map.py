@@ -0,0 +1,61 @@
+"""
+Tests for imported_id_map.py - the remote id <-> CUDC id map of an import config.
+"""
+import time
+
+from ckanext.udc_import_other_portals.logic.imported_id_map import ImportedIdMap
+
+
+class TestImportedIdMap:
+    """Test the reverse index and the persisted form."""
+
+    def test_reverse_index_follows_updates(self):
+        id_map = ImportedIdMap({"r1": "p1", "r2": "p2"})
+        id_map["r3"] = "p1"
+        id_map["r2"] = "p3"
+
+        assert id_map.remote_ids("p1") == {"r1", "r3"}
+        assert id_map.remote_ids("p2") == set()
+        assert id_map.remote_ids("p3") == {"r2"}
+
+        del id_map["r1"]
+        assert id_map.remote_ids("p1") == {"r3"}
+        assert id_map.pop("r3") == "p1"
+        assert id_map.remote_ids("p1") == set()
+
+    def test_remove_package_forgets_all_its_remote_ids(self):
+        id_map = ImportedIdMap({"r1": "p1", "r2": "p1", "r3": "p2"})
+
+        assert id_map.remove_package("p1") == {"r1", "r2"}
+        assert dict(id_map) == {"r3": "p2"}
+        assert id_map.remove_package("p1") == set()
+
+    def test_package_ids_of_stale_remote_ids(self):
+        id_map = ImportedIdMap({"r1": "p1", "r2": "p1", "r3": "p2", "r4": "p3"})
+        remote_listing = {"r3", "r4"}
+
+        assert id_map.package_ids([k for k in id_map if k not in remote_listing]) == ["p1"]
+        assert id_map.package_ids(["r4", "missing", "r3", "r4"]) == ["p3", "p2"]
+
+    def test_persists_as_a_plain_dict(self):
+        mapping = {"r1": "p1", "r2": "p2"}
+        id_map = ImportedIdMap(mapping)
+
+        assert dict(id_map) == mapping
+        assert ImportedIdMap(None) == {}
+        assert id_map.get("r1") == "p1" and "r2" in id_map and len(id_map) == 2
+
+    def test_large_cleanup_is_linear(self):
+        size, removed = 50000, 20000
+        id_map = ImportedIdMap({f"r{n}": f"p{n}" for n in range(size)})
+        remote_listing = {f"r{n}" for n in range(removed, size)}
+
+        started = time.perf_counter()
+        stale = id_map.package_ids([k for k in id_map if k not in remote_listing])
+        for package_id in stale:
+            id_map.remove_package(package_id)
+        elapsed = time.perf_counter() - started
+
+        assert len(stale) == removed
+        assert len(id_map) == size - removed
+        assert elapsed < 2
@@ -0,0 +1,103 @@
+"""
+Tests for log_buffer.py - the bounded, spilling log storage of ImportLogger.
+
+The benchmark compares the peak memory of a synthetic 100k-entry run with the
+previous unbounded list.
+"""
+import sys
+import tracemalloc
+
+import pytest
+
+from ckanext.udc_import_other_portals.log_buffer import LogBuffer, read_spill_file
+
+
+TRACE = "Exception: Traceback (most recent call last):\n  File \"base.py\", line 300\nValueError: bad\n"
+
+
+def _entry(n):
+    return TRACE if n % 10 == 0 else f"Info: Created package package-{n} (catalogue {n})"
+
+
+@pytest.fixture
+def spill_path(tmp_path):
+    return str(tmp_path / "logs" / "job.jsonl.gz")
+
+
+class TestLogBuffer:
+    """Test the ring buffer, the spill file and the range reads."""
+
+    def test_keeps_everything_under_capacity(self, spill_path):
+        buffer = LogBuffer(capacity=10, spill_path=spill_path)
+        for n in range(5):
+            buffer.append("info", f"line {n}")
+
+        assert buffer.tail() == [f"line {n}" for n in range(5)]
+        assert buffer.spilled == 0
+        assert read_spill_file(spill_path) == []
+
+    def test_spills_in_chunks_and_reads_by_range(self, spill_path):
+        buffer = LogBuffer(capacity=5, spill_path=spill_path, spill_chunk=3)
+        for n in range(20):
+            buffer.append("error" if n % 4 == 0 else "info", _entry(n))
+
+        assert buffer.spilled == 15
+        assert len(buffer.tail()) == 5
+        assert buffer.counts == {"error": 5, "info": 15}
+        assert buffer.read() == [_entry(n) for n in range(20)]
+        assert buffer.read(13, 4) == [_entry(n) for n in range(13, 17)]
+        assert buffer.read(30, 4) == []
+
+    def test_close_writes_the_whole_run(self, spill_path):
+        buffer = LogBuffer(capacity=5, spill_path=spill_path, spill_chunk=3)
+        for n in range(12):
+            buffer.append("info", _entry(n))
+        buffer.close()
+
+        assert read_spill_file(spill_path) == [_entry(n) for n in range(12)]
+        assert read_spill_file(spill_path, 10, 5) == [_entry(10), _entry(11)]
+        assert buffer.read(8) == [_entry(n) for n in range(8, 12)]
+        assert buffer.tail() == [_entry(n) for n in range(7, 12)]
+
+    def test_drops_without_spill_file(self):
+        buffer = LogBuffer(capacity=3)
+        for n in range(10):
+            buffer.append("info", f"line {n}")
+
+        assert buffer.tail() == ["line 7", "line 8", "line 9"]
+        assert (buffer.total, buffer.spilled) == (10, 7)
+        assert buffer.read(0, 8) == ["line 7"]
+
+
+@pytest.mark.benchmark
+class TestLogBufferBenchmark:
+    """Benchmark: peak memory of a 100k-entry import log."""
+
+    def test_memory_100k_entries(self, spill_path):
+        events = 100_000
+
+        def peak(run):
+            tracemalloc.start()
+            run()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return peak_bytes
+
+        def unbounded():
+            logs = []
+            for n in range(events):
+                logs.append(_entry(n))
+
+        def bounded():
+            buffer = LogBuffer(capacity=1000, spill_path=spill_path)
+            for n in range(events):
+                buffer.append("info", _entry(n))
+            buffer.close()
+
+        list_peak = peak(unbounded)
+        buffer_peak = peak(bounded)
+
+        print(f"\nimport log, {events // 1000}k entries: list {list_peak / 2**20:.1f} MiB peak, "
+              f"ring buffer + spill file {buffer_peak / 2**20:.1f} MiB peak", file=sys.stderr)
+        assert buffer_peak * 5 < list_peak
+        assert len(read_spill_file(spill_path, events - 1)) == 1
@@ -1,8 +1,18 @@
+import threading
+
 import socketio
 from ckan.plugins.toolkit import config
 
 
 class SocketClient:
+    """
+    Socket.IO client of an import worker.
+
+    Logs, finished packages and progress are buffered and sent as one
+    "event_batch" frame every `ckanext.udc.socketio.flush_interval` ms
+    (default 250) or as soon as `ckanext.udc.socketio.batch_size` (default 200)
+    logs + finished packages are pending. Progress collapses to the latest value.
+    """
     namespace = "/import-worker"
     executor = None
     registered = False
@@ -18,6 +28,16 @@ class SocketClient:
         self.sio = socketio.Client(logger=False)
         self.registered = False  # Flag to track if the client is registered
 
+        self.flush_interval = int(config.get("ckanext.udc.socketio.flush_interval", 250)) / 1000
+        self.batch_size = int(config.get("ckanext.udc.socketio.batch_size", 200))
+        self._logs = []
+        self._finished = []
+        self._progress = None
+        self._buffer_lock = threading.Lock()
+        # Serializes flushes so batches reach the server in order
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+
         # Event listener for 'registered' event from the server
         @self.sio.on("registered", namespace=self.namespace)
         def on_registered():
@@ -46,6 +66,7 @@ class SocketClient:
             if self.executor:
                 print("Shutting down executor")
                 self.executor.shutdown(cancel_futures=True)
+                self.flush()
                 self.sio.emit("job_stopped", (job_id,), namespace=self.namespace)
                 
         
@@ -55,7 +76,10 @@ class SocketClient:
             transports=["websocket"],
             namespaces=[self.namespace],
         )
-                
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
     def register_client(self, job_id: str):
         """
         Register the client with the server.
@@ -66,35 +90,58 @@ class SocketClient:
             "register", data=(job_id, validation_key), namespace=self.namespace
         )
 
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def _buffer(self, logs=None, finished=None, progress=None):
+        with self._buffer_lock:
+            if logs is not None:
+                self._logs.append(logs)
+            if finished is not None:
+                self._finished.append(finished)
+            if progress is not None:
+                self._progress = progress
+            full = len(self._logs) + len(self._finished) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the buffered events as one "event_batch" frame.
+        Events stay buffered until the client is registered.
+        """
+        with self._flush_lock:
+            if not self.registered:
+                return
+            with self._buffer_lock:
+                if not (self._logs or self._finished or self._progress):
+                    return
+                batch = {"logs": self._logs, "finished": self._finished, "progress": self._progress}
+                self._logs, self._finished, self._progress = [], [], None
+            self.sio.emit("event_batch", batch, namespace=self.namespace)
+
     def send_message(self, log_level: str, message: str):
         """
-        Send a message with the specified log level to the server.
+        Queue a message with the specified log level for the server.
 
         :param log_level: The level of the log (e.g., 'info', 'error', 'debug', 'exception').
         :param message: The message content to send.
         """
-        if self.registered:
-            data = {"log_level": log_level, "message": message}
-            self.sio.emit("log_message", data, namespace=self.namespace)
-        else:
-            print("Client is not registered yet. Message not sent.")
+        self._buffer(logs={"log_level": log_level, "message": message})
 
     def update_progress(self, current: int, total: int):
         """
-        Sends the current progress to the server.
+        Queue the current progress for the server; only the latest value is sent.
 
         :param current: The current progress value.
         :param total: The total value for progress completion.
         """
-        if self.registered:
-            progress_data = {"current": current, "total": total}
-            self.sio.emit("progress_update", progress_data, namespace=self.namespace)
-        else:
-            print("Client is not registered yet. Progress not sent.")
+        self._buffer(progress={"current": current, "total": total})
 
     def finish_one(self, type: str, data: dict):
         """
-        Sends a message to the server indicating that a package import has been completed.
+        Queue a message to the server indicating that a package import has been completed.
 
         type: created, updated, deleted, errored
         data: {
@@ -103,16 +150,15 @@ class SocketClient:
             "duplications": {"id": id, "name": name, "title": title}
             }
         """
-        if self.registered:
-            progress_data = {"type": type, "data": data}
-            self.sio.emit("finish_one", progress_data, namespace=self.namespace)
-        else:
-            print("Client is not registered yet. Progress not sent.")
+        self._buffer(finished={"type": type, "data": data})
 
     def disconnect(self):
         """
-        Disconnects the client from the server.
+        Flushes the pending events and disconnects the client from the server.
         """
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
         self.sio.disconnect()
 
 
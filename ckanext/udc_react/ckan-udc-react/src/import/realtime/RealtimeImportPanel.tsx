@@ -78,6 +78,18 @@ export function RealtimeImportPanel(props: ImportPanelProps) {
         );
       });
 
+      // Listen for batched worker events (logs, finished packages and the latest progress)
+      socket.on('event_batch', (batch: { logs: ImportLog[], finished: FinishedPackage[], progress: ImportProgress | null }) => {
+        if (batch.progress)
+          setImportProgress(batch.progress);
+        if (batch.logs.length > 0)
+          setImportLogs(batch.logs);
+        if (batch.finished.length > 0)
+          setFinishedPackages((prevPackages) =>
+            Array.isArray(prevPackages) ? [...prevPackages, ...batch.finished] : batch.finished
+          );
+      });
+
       socket.on('job_started', (job: RunningJob) => {
         console.log("job_started", job);
         if (job.import_config_id === props.uuid) {
@@ -0,0 +1,131 @@
+"""
+Redis storage of the import job telemetry relayed by socketio.py.
+
+Each job has three keys, so an event only appends to or overwrites a small
+value instead of rewriting the whole job:
+
+    udc:import:job:<id>:meta      hash  - worker sid and the latest progress
+    udc:import:job:<id>:logs      list  - log entries (JSON), RPUSH
+    udc:import:job:<id>:finished  list  - finish_one payloads (JSON), RPUSH
+
+Every write refreshes the TTL of the key it touches. Readers page through the
+lists by index: without a start they get the tail window.
+"""
+import json
+from typing import Optional
+
+JOB_KEY_PREFIX = "udc:import:job:"
+
+
+class JobTelemetryStore:
+
+    def __init__(self, redis_client, ttl: int = 86400, window: int = 200):
+        self.redis = redis_client
+        self.ttl = ttl
+        # Default number of entries returned by get_status() and replayed on subscribe
+        self.window = window
+
+    def _key(self, job_id: str, part: str) -> str:
+        return f"{JOB_KEY_PREFIX}{job_id}:{part}"
+
+    def register(self, job_id: str, sid: str) -> None:
+        key = self._key(job_id, "meta")
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(key, "sid", sid)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def get_sid(self, job_id: str) -> Optional[str]:
+        return self.redis.hget(self._key(job_id, "meta"), "sid")
+
+    def _append(self, job_id: str, part: str, entry) -> None:
+        key = self._key(job_id, part)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(key, json.dumps(entry))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def append_log(self, job_id: str, entry: dict) -> None:
+        self._append(job_id, "logs", entry)
+
+    def append_finished(self, job_id: str, data: dict) -> None:
+        self._append(job_id, "finished", data)
+
+    def append_batch(self, job_id: str, logs: list = (), finished: list = (),
+                     progress: Optional[dict] = None) -> None:
+        """
+        Store one batched frame from the worker (logs, finished packages and the
+        latest progress) in a single round trip.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for part, entries in (("logs", logs), ("finished", finished)):
+            if entries:
+                key = self._key(job_id, part)
+                pipe.rpush(key, *(json.dumps(entry) for entry in entries))
+                pipe.expire(key, self.ttl)
+        if progress is not None:
+            key = self._key(job_id, "meta")
+            pipe.hset(key, mapping={
+                "current": json.dumps(progress["current"]),
+                "total": json.dumps(progress["total"]),
+            })
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def set_progress(self, job_id: str, current, total) -> None:
+        key = self._key(job_id, "meta")
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(key, mapping={"current": json.dumps(current), "total": json.dumps(total)})
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def get_progress(self, job_id: str) -> Optional[dict]:
+        current, total = self.redis.hmget(self._key(job_id, "meta"), ["current", "total"])
+        if current is None or total is None:
+            return None
+        return {"current": json.loads(current), "total": json.loads(total)}
+
+    def get_range(self, job_id: str, part: str, start: Optional[int] = None,
+                  limit: Optional[int] = None) -> dict:
+        """
+        Entries [start, start + limit) of the "logs" or "finished" list, or the
+        last `limit` entries when `start` is None.
+        Returns {"items", "start", "total"}; the next page starts at start + len(items).
+        """
+        key = self._key(job_id, part)
+        limit = self.window if limit is None else max(int(limit), 0)
+        total = self.redis.llen(key)
+        if start is None:
+            start = max(total - limit, 0)
+        start = min(max(int(start), 0), total)
+        items = []
+        if limit and start < total:
+            items = [json.loads(raw) for raw in self.redis.lrange(key, start, start + limit - 1)]
+        return {"items": items, "start": start, "total": total}
+
+    def get_all_finished(self, job_id: str) -> list:
+        return [json.loads(raw) for raw in self.redis.lrange(self._key(job_id, "finished"), 0, -1)]
+
+    def get_status(self, job_id: str, logs_start: Optional[int] = None, logs_limit: Optional[int] = None,
+                   finished_start: Optional[int] = None, finished_limit: Optional[int] = None) -> Optional[dict]:
+        """
+        The job_status payload: progress plus one page of logs and finished
+        packages (the tail windows by default), or None for an unknown job.
+        """
+        progress = self.get_progress(job_id)
+        logs = self.get_range(job_id, "logs", logs_start, logs_limit)
+        finished = self.get_range(job_id, "finished", finished_start, finished_limit)
+        if progress is None and not logs["total"] and not finished["total"]:
+            return None
+        return {
+            "progress": progress,
+            "logs": logs["items"],
+            "logs_start": logs["start"],
+            "logs_total": logs["total"],
+            "finished": finished["items"],
+            "finished_start": finished["start"],
+            "finished_total": finished["total"],
+        }
+
+    def delete(self, job_id: str) -> None:
+        self.redis.delete(*(self._key(job_id, part) for part in ("meta", "logs", "finished")))
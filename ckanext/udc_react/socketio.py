@@ -1,4 +1,5 @@
 from ckanext.udc_import_other_portals.model import CUDCImportJob, CUDCImportConfig
+from ckanext.udc_react.job_telemetry import JobTelemetryStore
 from ckan.plugins.toolkit import config
 from flask import request, session
 from flask_socketio import (
@@ -8,7 +9,6 @@ from flask_socketio import (
     join_room,
     leave_room,
 )
-import json
 import redis
 import logging
 from pprint import pprint
@@ -28,6 +28,11 @@ def initSocketIO(app):
     redis_url = config.get("ckan.redis.url", "redis://localhost:6379/0")
     redis_ttl = int(config.get("ckanext.udc.socketio.redis_ttl", 86400))
     redis_client = redis.Redis.from_url(redis_url, decode_responses=True)
+    telemetry = JobTelemetryStore(
+        redis_client,
+        ttl=redis_ttl,
+        window=int(config.get("ckanext.udc.socketio.status_window", 200)),
+    )
 
     socketio = SocketIO(
         app,
@@ -40,21 +45,6 @@ def initSocketIO(app):
     # client_map stays local to the process; per-connection state lives here.
     client_map = {}  # Structure: { sid: job_id }
 
-    def _job_key(job_id: str) -> str:
-        return f"udc:import:job:{job_id}"
-
-    def _get_job_data(job_id: str) -> dict:
-        raw = redis_client.get(_job_key(job_id))
-        if not raw:
-            return {"logs": [], "progress": None, "finished": []}
-        try:
-            return json.loads(raw)
-        except json.JSONDecodeError:
-            return {"logs": [], "progress": None, "finished": []}
-
-    def _set_job_data(job_id: str, data: dict) -> None:
-        redis_client.setex(_job_key(job_id), redis_ttl, json.dumps(data))
-    
 
     @socketio.event(namespace="/admin-dashboard")
     def connect(auth=None):
@@ -98,7 +88,7 @@ def initSocketIO(app):
 
     @socketio.event(namespace="/admin-dashboard")
     def stop_job(job_id: str):
-        if not worker_data.get(job_id):
+        if not telemetry.get_sid(job_id):
             job = CUDCImportJob.get(job_id)
             config_id = job.import_config_id
             job.is_running = False
@@ -144,18 +134,17 @@ def initSocketIO(app):
         sid = request.sid
         join_room(import_id)  # Join a room named after the job_id
 
-        job_data = _get_job_data(import_id)
-        if job_data.get("logs") or job_data.get("progress") is not None:
-            # Emit the entire log and progress history for the job_id to the newly subscribed client
-            for log_entry in job_data.get("logs", []):
-                emit("log_message", log_entry, room=sid, namespace="/admin-dashboard")
-            if job_data.get("progress") is not None:
-                emit(
-                    "progress_update",
-                    job_data["progress"],
-                    room=sid,
-                    namespace="/admin-dashboard",
-                )
+        # Replay the latest logs and the progress to the newly subscribed client
+        for log_entry in telemetry.get_range(import_id, "logs")["items"]:
+            emit("log_message", log_entry, room=sid, namespace="/admin-dashboard")
+        progress = telemetry.get_progress(import_id)
+        if progress is not None:
+            emit(
+                "progress_update",
+                progress,
+                room=sid,
+                namespace="/admin-dashboard",
+            )
 
         emit("subscribed", {"job_id": import_id})
         log.info(f"Admin client {sid} subscribed to job_id {import_id}")
@@ -173,14 +162,25 @@ def initSocketIO(app):
         log.info(f"Admin client {sid} unsubscribed from job_id {import_id}")
 
     @socketio.event(namespace="/admin-dashboard")
-    def get_job_status(import_id):
+    def get_job_status(import_id, page=None):
         """
         Allows the frontend to request the current status of a specific job_id.
 
         :param import_id: The ID of the import/job.
+        :param page: Optional {"logs_start", "logs_limit", "finished_start", "finished_limit"}.
+            Without a start, the last `limit` (default ckanext.udc.socketio.status_window)
+            logs / finished packages are returned. The reply carries `logs_start`,
+            `logs_total`, `finished_start` and `finished_total` to request other ranges.
         """
-        job_data = _get_job_data(import_id)
-        if job_data.get("logs") or job_data.get("progress") is not None:
+        page = page if isinstance(page, dict) else {}
+        job_data = telemetry.get_status(
+            import_id,
+            logs_start=page.get("logs_start"),
+            logs_limit=page.get("logs_limit"),
+            finished_start=page.get("finished_start"),
+            finished_limit=page.get("finished_limit"),
+        )
+        if job_data is not None:
             emit("job_status", job_data)
             log.info(
                 f"Sent status for job_id {import_id} to admin client {request.sid}"
@@ -217,13 +217,8 @@ def initSocketIO(app):
             sio_disconnect()
             return
 
-        # Initialize job entry if it doesn't exist
-        job_data = _get_job_data(job_id)
-        job_data["sid"] = sid
-        job_data.setdefault("logs", [])
-        job_data.setdefault("progress", None)
-        job_data.setdefault("finished", [])
-        _set_job_data(job_id, job_data)
+        # Record the worker of the job
+        telemetry.register(job_id, sid)
 
         # Map the client's sid to their job_id
         client_map[sid] = job_id
@@ -266,9 +261,7 @@ def initSocketIO(app):
 
         log_entry = {"log_level": log_level, "message": message}
 
-        job_data = _get_job_data(job_id)
-        job_data.setdefault("logs", []).append(log_entry)
-        _set_job_data(job_id, job_data)
+        telemetry.append_log(job_id, log_entry)
 
         # Emit the log message to the admin-dashboard room corresponding to the job_id
         emit("log_message", log_entry, room=job_id, namespace="/admin-dashboard")
@@ -316,9 +309,7 @@ def initSocketIO(app):
 
         progress_entry = {"current": current, "total": total}
 
-        job_data = _get_job_data(job_id)
-        job_data["progress"] = progress_entry
-        _set_job_data(job_id, job_data)
+        telemetry.set_progress(job_id, current, total)
 
         # Emit the progress update to the admin-dashboard room corresponding to the job_id
         emit(
@@ -356,9 +347,7 @@ def initSocketIO(app):
 
         job_id = client_map[sid]
         
-        job_data = _get_job_data(job_id)
-        job_data.setdefault("finished", []).append(data)
-        _set_job_data(job_id, job_data)
+        telemetry.append_finished(job_id, data)
 
         # Emit the progress update to the admin-dashboard room corresponding to the job_id
         emit(
@@ -367,6 +356,61 @@ def initSocketIO(app):
         
         
 
+    @socketio.event(namespace="/import-worker")
+    def event_batch(data):
+        """
+        Handle a batched frame sent by the worker client.
+
+        data: {
+            "logs": [{"log_level": str, "message": str}],
+            "finished": [finish_one payload],
+            "progress": {"current": int, "total": int} | None
+        }
+        The frame is stored and forwarded as is to the admin dashboard room of the job.
+        """
+        sid = request.sid
+
+        # Check if the client is registered
+        if sid not in client_map:
+            log.error(
+                f"Received event_batch from unregistered client {sid}. Ignoring batch."
+            )
+            return
+
+        job_id = client_map[sid]
+
+        logs = [
+            entry for entry in data.get("logs") or []
+            if entry.get("log_level") and entry.get("message")
+        ]
+        finished = data.get("finished") or []
+        progress = data.get("progress")
+        if progress is not None and (progress.get("current") is None or progress.get("total") is None):
+            log.error(f"Invalid progress in event_batch from client {sid}: {progress}")
+            progress = None
+
+        telemetry.append_batch(job_id, logs, finished, progress)
+
+        emit(
+            "event_batch",
+            {"logs": logs, "finished": finished, "progress": progress},
+            room=job_id,
+            namespace="/admin-dashboard",
+        )
+
+        for entry in logs:
+            log_msg = f"Job {job_id}: {entry['message']}"
+            if entry["log_level"] in ("error", "exception"):
+                log.error(log_msg)
+            elif entry["log_level"] == "warning":
+                log.warning(log_msg)
+            elif entry["log_level"] == "debug":
+                log.debug(log_msg)
+            else:
+                log.info(log_msg)
+        if progress is not None:
+            log.info(f"Progress for job {job_id}: {progress['current']}/{progress['total']}")
+
     @socketio.event(namespace="/import-worker")
     def disconnect_request():
         """
@@ -386,16 +430,16 @@ def initSocketIO(app):
         if sid in client_map:
             job_id = client_map.pop(sid)
             leave_room(job_id)
-            job_data = _get_job_data(job_id)
-            if job_data.get("finished") is not None:
-                # Store finished data in the database
-                job = CUDCImportJob.get(job_id)
-                job.other_data = {"finished": job_data.get("finished", [])}
+            # Store finished data in the database, keeping what the worker stored
+            # (checkpoint, log summary, run flags)
+            job = CUDCImportJob.get_for_update(job_id)
+            if job:
+                job.other_data = {**(job.other_data or {}), "finished": telemetry.get_all_finished(job_id)}
                 model.Session.add(job)
-                model.Session.commit()
+            model.Session.commit()
 
-                redis_client.delete(_job_key(job_id))
-                log.info(f"Removed worker data for job {job_id} upon disconnect.")
+            telemetry.delete(job_id)
+            log.info(f"Removed worker data for job {job_id} upon disconnect.")
         
         emit(
             "job_stopped", (job_id), broadcast=True, namespace="/admin-dashboard"
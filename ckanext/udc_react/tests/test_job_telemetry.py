@@ -0,0 +1,175 @@
+"""
+Tests for job_telemetry.py - import job telemetry in Redis lists and a hash.
+
+FakeRedis implements the few commands used, in memory. The benchmark
+compares events per second of the append-only layout with the previous
+layout (GET, json.loads, append, json.dumps, SETEX of one blob per job).
+"""
+import json
+import sys
+import time
+
+import pytest
+
+from ckanext.udc_react.job_telemetry import JobTelemetryStore
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        h = self.data.setdefault(key, {})
+        if field is not None:
+            h[field] = value
+        h.update(mapping or {})
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        h = self.data.get(key, {})
+        return [h.get(f) for f in fields]
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+    def lrange(self, key, start, end):
+        values = self.data.get(key, [])
+        return values[start:] if end == -1 else values[start:end + 1]
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return call
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+@pytest.fixture
+def store():
+    return JobTelemetryStore(FakeRedis(), ttl=60, window=3)
+
+
+class TestJobTelemetryStore:
+    """Test the layout and the paginated status."""
+
+    def test_events_append_and_refresh_ttl(self, store):
+        store.register("job", "sid-1")
+        store.append_log("job", {"log_level": "info", "message": "one"})
+        store.set_progress("job", 1, 10)
+        store.append_finished("job", {"type": "created", "data": {"id": "a"}})
+
+        assert store.get_sid("job") == "sid-1"
+        assert store.get_progress("job") == {"current": 1, "total": 10}
+        assert store.redis.llen("udc:import:job:job:logs") == 1
+        assert set(store.redis.ttls.values()) == {60}
+
+    def test_append_batch(self, store):
+        store.append_batch(
+            "job",
+            logs=[{"log_level": "info", "message": "one"}, {"log_level": "info", "message": "two"}],
+            finished=[{"type": "created", "data": {"id": "a"}}],
+            progress={"current": 1, "total": 10},
+        )
+        store.append_batch("job", logs=[{"log_level": "info", "message": "three"}])
+
+        assert [entry["message"] for entry in store.get_status("job")["logs"]] == ["one", "two", "three"]
+        assert store.get_all_finished("job") == [{"type": "created", "data": {"id": "a"}}]
+        assert store.get_progress("job") == {"current": 1, "total": 10}
+        assert set(store.redis.ttls.values()) == {60}
+
+    def test_status_is_the_tail_window_by_default(self, store):
+        for n in range(10):
+            store.append_log("job", {"log_level": "info", "message": str(n)})
+
+        status = store.get_status("job")
+
+        assert [entry["message"] for entry in status["logs"]] == ["7", "8", "9"]
+        assert (status["logs_start"], status["logs_total"]) == (7, 10)
+        assert status["progress"] is None and status["finished"] == []
+
+    def test_status_cursor_range(self, store):
+        for n in range(10):
+            store.append_finished("job", {"data": {"id": str(n)}})
+
+        page = store.get_status("job", finished_start=2, finished_limit=4)
+        last = store.get_status("job", finished_start=8, finished_limit=4)
+
+        assert [item["data"]["id"] for item in page["finished"]] == ["2", "3", "4", "5"]
+        assert [item["data"]["id"] for item in last["finished"]] == ["8", "9"]
+        assert store.get_status("job", finished_start=50)["finished"] == []
+
+    def test_unknown_job(self, store):
+        assert store.get_status("missing") is None
+
+    def test_delete(self, store):
+        store.register("job", "sid-1")
+        store.append_log("job", {"log_level": "info", "message": "one"})
+        store.append_finished("job", {"data": {"id": "a"}})
+
+        assert store.get_all_finished("job") == [{"data": {"id": "a"}}]
+        store.delete("job")
+        assert store.redis.data == {}
+
+
+def _blob_event(redis, job_id, entry):
+    """The previous layout: one JSON blob per job rewritten on every event."""
+    key = f"udc:import:job:{job_id}"
+    raw = redis.get(key)
+    data = json.loads(raw) if raw else {"logs": [], "progress": None, "finished": []}
+    data["logs"].append(entry)
+    redis.setex(key, 60, json.dumps(data))
+
+
+@pytest.mark.benchmark
+class TestTelemetryBenchmark:
+    """Benchmark: events per second of the job telemetry writes."""
+
+    def test_events_per_second(self):
+        entry = {"log_level": "info", "message": "Created package housing-starts-2024 (catalogue)"}
+
+        def run(write, events):
+            redis = FakeRedis()
+            start = time.perf_counter()
+            for _ in range(events):
+                write(redis, entry)
+            return events / (time.perf_counter() - start)
+
+        # The blob layout is quadratic; a thousand events are enough to show it
+        blob_rate = run(lambda redis, e: _blob_event(redis, "job", e), 1000)
+        rates = {events: run(lambda redis, e: JobTelemetryStore(redis).append_log("job", e), events)
+                 for events in (10_000, 50_000, 100_000)}
+
+        print(f"\njob telemetry: json blob {blob_rate:.0f} events/s at 1k events; append-only "
+              + ", ".join(f"{rate:.0f} events/s at {events // 1000}k" for events, rate in rates.items()),
+              file=sys.stderr)
+        assert rates[100_000] > blob_rate